@@ -0,0 +1,127 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains a stand-in for the QTSBE API serving deterministic
+# synthetic OHLCV (a random walk seeded by the pair name), used by the
+# benchmarks. It answers /QTSBE/{pair}/{strategy} like QTSBE, with the
+# optional start_ts parameter. With ragged, the pairs have different numbers
+# of candles (they end at different dates).
+#
+# Standalone: python -m benchmarks.fake_qtsbe --candles 5000 --port 5000
+# =============================================================================
+
+import argparse
+import json
+import multiprocessing
+import random
+import socket
+import time
+import zlib
+from datetime import datetime, timedelta
+from aiohttp import web
+
+START_DATE = datetime(2015, 1, 1)
+TIMEFRAMES = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def timeframe_seconds(pair_name):
+    """
+    Duration of a candle of a pair from its name suffix (e.g., 'Bench_P001USDT_1h' -> 3600).
+    """
+    suffix = pair_name.rsplit('_', 1)[-1]
+    try:
+        return int(suffix[:-1] or 1) * TIMEFRAMES[suffix[-1]]
+    except (KeyError, ValueError):
+        return TIMEFRAMES['d']
+
+def candles_count(pair_name, candles, ragged=False):
+    """
+    Number of candles of a pair: candles, or between half of it and candles if ragged.
+    """
+    if not ragged:
+        return candles
+    return candles - zlib.crc32(pair_name.encode()) % (candles // 2 + 1)
+
+def generate_candles(pair_name, count):
+    """
+    Generate the candles of a pair, always the same ones for the same name and count.
+
+    return: List of OHLCV rows ([date, open, high, low, close, volume]).
+    """
+    rng = random.Random(zlib.crc32(pair_name.encode()))
+    step = timedelta(seconds=timeframe_seconds(pair_name))
+    price = rng.uniform(10, 1000)
+    rows = []
+    for i in range(count):
+        open_price = price
+        price = max(0.01, price * (1 + rng.gauss(0, 0.02)))
+        high = max(open_price, price) * (1 + abs(rng.gauss(0, 0.005)))
+        low = min(open_price, price) * (1 - abs(rng.gauss(0, 0.005)))
+        rows.append([(START_DATE + i * step).strftime('%Y-%m-%d %H:%M:%S'),
+                     round(open_price, 6), round(high, 6), round(low, 6), round(price, 6),
+                     round(rng.uniform(100, 10000), 2)])
+    return rows
+
+def make_app(candles, ragged=False):
+    """
+    Create the aiohttp application of the fake API.
+
+    candles: Number of candles of every pair (the longest ones if ragged, see candles_count).
+    """
+    pairs = {}  # pair -> rows, generated on first request
+
+    async def handle(request):
+        pair_name = request.match_info['pair']
+        rows = pairs.get(pair_name)
+        if rows is None:
+            rows = pairs[pair_name] = generate_candles(pair_name, candles_count(pair_name, candles, ragged))
+        start_ts = request.query.get('start_ts')
+        if start_ts:
+            rows = [row for row in rows if row[0] >= start_ts]
+        return web.Response(text=json.dumps({'pair': pair_name, 'data': rows, 'result': [{}]}),
+                            content_type='application/json')
+
+    app = web.Application()
+    app.router.add_get('/QTSBE/{pair}/{strategy}', handle)
+    return app
+
+def serve(candles, port, ragged=False):
+    web.run_app(make_app(candles, ragged), host='127.0.0.1', port=port, print=None)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server_process(candles, port=None, timeout=10, ragged=False):
+    """
+    Start the fake API in a separate process, so that serving the candles
+    isn't counted in the time of the simulator.
+
+    return: Tuple of (process, base URL).
+    """
+    port = port or free_port()
+    process = multiprocessing.get_context("spawn").Process(target=serve, args=(candles, port, ragged), daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                break
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError(f"Fake QTSBE didn't start on port {port}")
+            time.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake QTSBE API serving synthetic OHLCV")
+    parser.add_argument("--candles", type=int, default=5000, help="Number of candles of every pair")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--ragged", action="store_true", help="Give the pairs different numbers of candles")
+    args = parser.parse_args()
+    serve(args.candles, args.port, args.ragged)
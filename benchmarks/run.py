@@ -0,0 +1,240 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file runs the simulator against the fake QTSBE API (see
+# benchmarks/fake_qtsbe.py) without Discord, and reports its throughput
+# (candles/s), the time spent in each stage of the pipeline and the peak
+# memory of the process. When both engines run, their trades are compared,
+# and so are the trades of the runs by work units (--unit-budget) with the
+# ones of the full runs.
+#
+# Usage: python -m benchmarks.run --pairs 10 --candles 5000 --strategy sma_cross
+# =============================================================================
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from loguru import logger
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+STAGES = ('fetch', 'index', 'indicators', 'signals', 'db', 'notify')
+
+def peak_memory_mb():
+    """
+    return: Peak resident memory of the process in MB, or None if unknown (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB elsewhere
+
+def read_trades(db_path):
+    """
+    Summarize the positions of the benchmarked simulations, to compare the engines.
+
+    return: Dictionary with the number of positions, the sum of the ratios of the
+            closed ones and a digest of every position (pair, dates, prices, fund
+            slot), by simulation number.
+    """
+    connection = sqlite3.connect(db_path)
+    try:
+        rows = connection.execute("SELECT simulation_name, pair, buy_date, buy_price, sell_date, sell_price, "
+                                  "fund_slot, ratio FROM positions").fetchall()
+    finally:
+        connection.close()
+    trades = sorted((name.rsplit('_', 1)[-1],) + tuple(row) for name, *row in rows)  # bench_<engine>_<i>
+    return {
+        'positions': len(trades),
+        'ratio_sum': sum(trade[-1] for trade in trades if trade[-1] is not None),
+        'digest': hashlib.blake2b(repr(trades).encode(), digest_size=16).hexdigest(),
+    }
+
+def compare_trades(results):
+    """
+    Check that the engines (and the runs by work units) made the same trades.
+
+    return: True if every result has the same positions.
+    """
+    reference = results[0]['trades']
+    same = all(result['trades']['digest'] == reference['digest'] for result in results[1:])
+    if same:
+        print(f"\nTrades: identical across runs ({reference['positions']} positions)")
+    else:
+        print("\nTrades: the runs differ")
+        for result in results:
+            print(f"  {result['engine']:<12} {result['trades']['positions']} positions, "
+                  f"ratio sum {result['trades']['ratio_sum']:.6f}")
+    return same
+
+def simulations_config(args, engine, url):
+    """
+    Build the configuration of the benchmarked simulations (same format as configs/simulations.json).
+    """
+    pairs_list = [f"Bench_P{i:03d}USDT_{args.timeframe}" for i in range(args.pairs)]
+    return {
+        f"bench_{engine}_{i}": {
+            "discord": {"discord_channel_id": "0"},
+            "api": {"pairs_list": pairs_list, "strategy": args.strategy, "start_ts": "", "end_ts": "",
+                    "engine": engine, "qtsbe_url": url},
+            "positions": {"position_%_invest": str(args.invest)},
+            "wallet": {"invest_capital": "1000"},
+        }
+        for i in range(args.simulations)
+    }
+
+async def run_engine(simulator, config, budget=None):
+    """
+    Run the simulations until they have no date left.
+
+    budget: Seconds of work of each work unit (like the bot, see WorkQueue),
+            None to process every candle in a single run.
+
+    return: The number of runs (work units) of the simulations.
+    """
+    from src.simulation.simulates import simulate
+    from src.api.fetch import close_session
+    units = 0
+    try:
+        for simulation_name, simulation in config.items():
+            remaining = True
+            while remaining:
+                remaining, _ = await simulate(simulator, simulation_name, simulation, budget=budget)
+                units += 1
+    finally:
+        await close_session()
+    return units
+
+def benchmark(args, engine, url, budget=None):
+    """
+    Run every benchmarked simulation on an empty database, at once or by work units.
+
+    budget: Seconds of work of each work unit, None to process every candle at once.
+
+    return: Dictionary of the results.
+    """
+    from src.simulation.simulator import Simulator
+    from src.simulation.simulates import indicators_cache, reset_simulation
+    from src.discord.notifier import NullNotifier
+    from src.api.fetch import close_candle_store
+    from src.internal.timing import get_stages, reset_stages
+
+    from benchmarks.fake_qtsbe import candles_count
+
+    # a fresh folder for the database, the candle store and the journals
+    os.chdir(tempfile.mkdtemp(prefix=f"bench_{engine}_", dir=args.workdir))
+    indicators_cache.invalidate()
+    reset_stages()
+
+    simulator = Simulator(None, {}, 'bench.db', notifier=NullNotifier())
+    config = simulations_config(args, engine, url)
+    for simulation_name in config:
+        reset_simulation(simulation_name)  # same names as the previous run of the engine, on another database
+    started = time.perf_counter()
+    try:
+        units = asyncio.run(run_engine(simulator, config, budget))
+    finally:
+        simulator.close()
+        close_candle_store()
+    elapsed = time.perf_counter() - started
+    trades = read_trades('bench.db')
+
+    pairs_list = next(iter(config.values()))['api']['pairs_list']
+    candles = args.simulations * sum(candles_count(pair_name, args.candles, args.ragged) for pair_name in pairs_list)
+    return {
+        'engine': engine if budget is None else f"{engine}/units",
+        'units': units,
+        'strategy': args.strategy,
+        'simulations': args.simulations,
+        'pairs': args.pairs,
+        'candles': candles,
+        'seconds': elapsed,
+        'candles_per_second': candles / elapsed,
+        'stages': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in get_stages().items()},
+        'peak_memory_mb': peak_memory_mb(),
+        'trades': trades,
+    }
+
+def print_results(results):
+    for result in results:
+        print(f"\n{result['engine']} engine, {result['strategy']}: {result['simulations']} simulation(s) x "
+              f"{result['pairs']} pairs, {result['candles']} candles in {result['units']} run(s), "
+              f"{result['seconds']:.2f}s -> {result['candles_per_second']:.0f} candles/s")
+        stages = result['stages']
+        for name in list(STAGES) + sorted(set(stages) - set(STAGES)):
+            if name in stages:
+                seconds = stages[name]['seconds']
+                print(f"  {name:<12} {seconds:9.3f}s {100 * seconds / result['seconds']:6.1f}%  ({stages[name]['calls']} calls)")
+        if result['peak_memory_mb'] is not None:
+            print(f"  peak memory  {result['peak_memory_mb']:9.1f} MB (process, so far)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the simulator")
+    parser.add_argument("--pairs", type=int, default=10, help="Number of pairs of each simulation")
+    parser.add_argument("--candles", type=int, default=5000, help="Number of candles of each pair")
+    parser.add_argument("--simulations", type=int, default=1, help="Number of simulations")
+    parser.add_argument("--timeframe", default="1h", help="Timeframe suffix of the pairs (1h, 1d, ...)")
+    parser.add_argument("--strategy", default="sma_cross", help="Strategy of benchmarks/strategies")
+    parser.add_argument("--invest", type=int, default=20, help="position_%%_invest of the simulations")
+    parser.add_argument("--engine", choices=("step", "batch", "both"), default="both")
+    parser.add_argument("--unit-budget", type=float,
+                        help="Also run the simulations by work units of this many seconds, and compare their trades")
+    parser.add_argument("--ragged", action="store_true",
+                        help="Give the pairs different numbers of candles (up to --candles), so that they end at different dates")
+    parser.add_argument("--url", help="Base URL of a running QTSBE (or fake) API, started in a separate process otherwise")
+    parser.add_argument("--workdir", help="Folder of the temporary benchmark files (system temp folder by default)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary benchmark files")
+    parser.add_argument("--json", help="Also write the results to this JSON file (to track regressions)")
+    parser.add_argument("-debug", action="store_true", help="Show the logs of the simulator")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG" if args.debug else "WARNING")
+
+    # the reference strategies replace the ones of the strategies folder
+    from src.simulation import simulates
+    from src.simulation.strategy_loader import StrategyLoader
+    from benchmarks.fake_qtsbe import start_server_process
+    simulates.strategies = StrategyLoader(os.path.join(BENCHMARKS_FOLDER, "strategies"))
+    if args.strategy not in simulates.strategies:
+        parser.error(f"unknown strategy {args.strategy}, available: {', '.join(simulates.strategies.available())}")
+
+    server, url = (None, args.url) if args.url else start_server_process(args.candles, ragged=args.ragged)
+    if args.workdir:
+        args.workdir = os.path.abspath(args.workdir)
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = args.workdir = tempfile.mkdtemp(prefix="smartswap_bench_", dir=args.workdir)
+    cwd = os.getcwd()
+    try:
+        engines = ("step", "batch") if args.engine == "both" else (args.engine,)
+        budgets = (None, args.unit_budget) if args.unit_budget else (None,)
+        results = [benchmark(args, engine, url, budget) for engine in engines for budget in budgets]
+    finally:
+        os.chdir(cwd)
+        if server is not None:
+            server.terminate()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    same = len(results) < 2 or compare_trades(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not same:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
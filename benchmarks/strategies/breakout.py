@@ -0,0 +1,31 @@
+# Reference strategy of the benchmarks: buy when the close breaks the highest
+# high of the 50 previous candles, sell 10% below the buy price or 20% above.
+# Scalar only (the exit depends on the position), so the batch engine falls
+# back to the per-candle functions.
+
+from collections import deque
+
+PERIOD = 50
+
+class Indicators:
+    def __init__(self, data):
+        highest, window = [], deque()  # indexes of decreasing highs
+        for i, row in enumerate(data):
+            highest.append(data[window[0]][2] if window else float('inf'))
+            while window and data[window[-1]][2] <= row[2]:
+                window.pop()
+            window.append(i)
+            if window[0] <= i - PERIOD:
+                window.popleft()
+        self.indicators = {'highest': highest}
+
+def buy_signal(position, data, index, indicators):
+    if data[index][4] > indicators['highest'][index]:
+        return 1, data[index][4]
+    return 0, None
+
+def sell_signal(position, data, index, indicators):
+    close = data[index][4]
+    if close < position['buy_price'] * 0.9 or close > position['buy_price'] * 1.2:
+        return 1, close
+    return 0, None
@@ -0,0 +1,32 @@
+# Reference strategy of the benchmarks: buy when the 14 candles RSI is below
+# 30, sell when it is above 70. Scalar and vectorized.
+
+import numpy as np
+
+PERIOD = 14
+
+class Indicators:
+    def __init__(self, data):
+        rsi, gain, loss = [50.0], 0.0, 0.0
+        for i in range(1, len(data)):
+            change = data[i][4] - data[i - 1][4]
+            gain = (gain * (PERIOD - 1) + max(change, 0.0)) / PERIOD
+            loss = (loss * (PERIOD - 1) + max(-change, 0.0)) / PERIOD
+            rsi.append(100.0 if loss == 0 else 100.0 - 100.0 / (1 + gain / loss))
+        self.indicators = {'rsi': rsi[:len(data)]}
+
+def buy_signal(position, data, index, indicators):
+    if indicators['rsi'][index] < 30:
+        return 1, data[index][4]
+    return 0, None
+
+def sell_signal(position, data, index, indicators):
+    if indicators['rsi'][index] > 70:
+        return 1, data[index][4]
+    return 0, None
+
+def buy_signals(ohlcv, indicators):
+    return (np.asarray(indicators['rsi']) < 30).astype(np.int64), ohlcv['close']
+
+def sell_signals(ohlcv, indicators):
+    return (np.asarray(indicators['rsi']) > 70).astype(np.int64), ohlcv['close']
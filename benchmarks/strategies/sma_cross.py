@@ -0,0 +1,37 @@
+# Reference strategy of the benchmarks: buy when the close crosses above its
+# 20 candles moving average, sell when it closes below it. Scalar and vectorized.
+
+import numpy as np
+
+PERIOD = 20
+
+class Indicators:
+    def __init__(self, data):
+        sma, total = [], 0.0
+        for i, row in enumerate(data):
+            total += row[4]
+            if i >= PERIOD:
+                total -= data[i - PERIOD][4]
+            sma.append(total / min(i + 1, PERIOD))
+        self.indicators = {'sma': sma}
+
+def buy_signal(position, data, index, indicators):
+    sma = indicators['sma']
+    if index > 0 and data[index][4] > sma[index] and data[index - 1][4] <= sma[index - 1]:
+        return 1, data[index][4]
+    return 0, None
+
+def sell_signal(position, data, index, indicators):
+    if data[index][4] < indicators['sma'][index]:
+        return 1, data[index][4]
+    return 0, None
+
+def buy_signals(ohlcv, indicators):
+    close, sma = ohlcv['close'], np.asarray(indicators['sma'])
+    signals = np.zeros(len(close), dtype=np.int64)
+    signals[1:] = (close[1:] > sma[1:]) & (close[:-1] <= sma[:-1])
+    return signals, close
+
+def sell_signals(ohlcv, indicators):
+    close = ohlcv['close']
+    return (close < np.asarray(indicators['sma'])).astype(np.int64), close
@@ -1,61 +1,154 @@
 import discord
-import socket
-#import sqlite3
 import argparse
+import asyncio
+import json
 import os
-from discord.ext import tasks
+import sys
 from discord import Activity, ActivityType
 from datetime import datetime
 from loguru import logger
-from src.discord.configs import get_discord_config
-from src.db.manager import DatabaseManager 
-from src.simulation.simulates import simulates
-from src.discord.integ_logs.log import log 
-from src.db.positions import Positions
-
-# argument parser for handling debug mode
-parser = argparse.ArgumentParser(description='Run the simulator.')
-parser.add_argument('-debug', action='store_true', help='Run in debug mode')
-args = parser.parse_args()
-
-# directory for log files
-log_dir = 'logs'
-os.makedirs(log_dir, exist_ok=True)  # create the logs directory if it doesn't exist
-
-# log file name based on current date
-log_file = os.path.join(log_dir, f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.log")
-
-# configure loguru to handle logging
-logger.add(log_file, rotation="00:00", retention="7 days", level="DEBUG" if args.debug else "INFO")
-
-class Simulator:
-    def __init__(self, discord_bot, bot_config, db_path='simulator.db'):
-        self.discord_bot = discord_bot
-        self.bot_config = bot_config
-        self.db_manager = DatabaseManager(db_path)
-        self.positions = Positions(self.db_manager)
-
-    def close(self):
-        self.db_manager.close()
-
-    @tasks.loop(seconds=1)
-    async def simulates_loop(self):
-        await simulates(self)
-
-    async def start_simulation(self):
-        await log(self, self.bot_config["logs_channel_id"], "🚀 Started", 
-                  f"Simulator has been started on host: {socket.gethostname()}")
-        self.simulates_loop.start()
+from src.discord.configs import get_config, get_discord_config
+from src.discord.notifier import NullNotifier, FileNotifier
+from src.simulation.simulator import Simulator
+from src.simulation.parallel import SimulationPool
+from src.simulation.backtest import select_simulations, backtest, get_results, format_results
+from src.simulation.sweep import run_sweep, format_sweep_results
+from src.internal.profiling import profiler, DEFAULT_CANDLE_BUDGET
+from src.api.fetch import close_session
 
 class MyClient(discord.Client):
+    simulator = None  # set by main()
+
     async def on_ready(self):
         logger.info(f'Logged in as {self.user} (ID: {self.user.id})')
-        await simulator.start_simulation()
+        await self.simulator.start_simulation()
         await self.change_presence(activity=Activity(type=ActivityType.custom, name=" ", state="🚀 working"))
 
-discord_bot = MyClient(intents=discord.Intents.all())
-simulator = Simulator(discord_bot, get_discord_config())
-try:
-    discord_bot.run(simulator.bot_config["token"])
-finally:
-    simulator.close()
\ No newline at end of file
+    async def close(self):
+        await self.simulator.stop()  # send the pending notifications
+        await close_session()  # release the pooled QTSBE connections
+        await super().close()
+
+def start_profiling(args):
+    # the strategies are profiled in the main process only
+    if args.workers > 1:
+        logger.warning("-profile runs the simulations in the main process, -workers is ignored")
+        args.workers = 1
+    profiler.start(args.profile_budget)
+
+def write_profiles(args):
+    profiler.stop()
+    for strategy_name in profiler.strategies():
+        logger.info("\n" + profiler.format_report(strategy_name))
+    paths = profiler.write(args.profile_dir)
+    logger.warning(f"Strategy profiles written to {args.profile_dir}/ ({len(paths)} files)")
+
+def run_bot(args, log_file, log_level):
+    discord_bot = MyClient(intents=discord.Intents.all())
+    simulator = Simulator(discord_bot, get_discord_config())
+    if args.workers > 1:
+        simulator.pool = SimulationPool(simulator, args.workers, log_file, log_level)
+    discord_bot.simulator = simulator
+    try:
+        discord_bot.run(simulator.bot_config["token"])
+    finally:
+        simulator.close()
+        if args.profile:
+            write_profiles(args)
+
+def run_backtest(args, log_file, log_level):
+    # headless: no Discord, the simulations run once at full speed
+    logger.remove()  # only warnings on the console, everything in the log file
+    logger.add(sys.stderr, level="DEBUG" if args.debug else "WARNING")
+    logger.add(log_file, level=log_level)
+
+    try:
+        simulations_config = select_simulations(get_config(args.config), args.simulation, args.engine, args.offline)
+    except KeyError as e:
+        sys.exit(e.args[0])
+    simulator = Simulator(None, {}, args.db, notifier=NullNotifier())
+    if args.notifications:
+        simulator.notifier = FileNotifier(simulator, args.notifications)
+    if args.workers > 1:
+        simulator.pool = SimulationPool(simulator, args.workers, log_file, log_level)
+    try:
+        asyncio.run(backtest(simulator, simulations_config))
+        print(format_results(get_results(simulator, simulations_config)))
+    finally:
+        simulator.close()
+        if args.profile:
+            write_profiles(args)
+
+def run_sweep_command(args, log_file, log_level):
+    # headless like a backtest, the variants run in worker processes on in-memory databases
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG" if args.debug else "WARNING")
+    logger.add(log_file, level=log_level)
+
+    with open(args.spec, 'r') as f:
+        spec = json.load(f)
+    simulations_config = get_config(args.config)
+    if spec.get('simulation') not in simulations_config:
+        sys.exit(f"Unknown simulation: {spec.get('simulation')}")
+    results = run_sweep(simulations_config[spec['simulation']], spec['grid'], args.results, args.workers,
+                        args.random, args.seed, args.engine, args.offline, "DEBUG" if args.debug else "WARNING")
+    print(format_sweep_results(results, args.top))
+
+def main():
+    # argument parser for handling debug mode
+    parser = argparse.ArgumentParser(description='Run the simulator.')
+    parser.add_argument('-debug', action='store_true', help='Run in debug mode')
+    parser.add_argument('-workers', type=int, default=1,
+                        help='Run the simulations in this many worker processes (1 = in the main process)')
+    parser.add_argument('-profile', action='store_true',
+                        help='Profile the strategies (timings per pair, sampled stacks) and write reports to -profile-dir')
+    parser.add_argument('-profile-budget', type=float, default=DEFAULT_CANDLE_BUDGET,
+                        help='Time budget of a strategy per candle, in milliseconds (calls over it are reported)')
+    parser.add_argument('-profile-dir', default='profiles', help='Folder of the strategy profiles')
+    subparsers = parser.add_subparsers(dest='command')
+    backtest_parser = subparsers.add_parser('backtest', help='Run the simulations once without Discord and print their results')
+    backtest_parser.add_argument('--simulation', action='append',
+                                 help='Name of a simulation to run (repeatable), all of them by default')
+    backtest_parser.add_argument('--config', default='configs/simulations.json', help='Simulations configuration file')
+    backtest_parser.add_argument('--db', default='backtest.db', help='SQLite database file of the results')
+    backtest_parser.add_argument('--engine', choices=('step', 'batch'), help='Force the engine of every simulation')
+    backtest_parser.add_argument('--offline', action='store_true',
+                                 help='Only use the candles already stored in ohlcv_cache.db (no QTSBE requests)')
+    backtest_parser.add_argument('--notifications', help='Write the opened / closed positions to this JSON lines file')
+    sweep_parser = subparsers.add_parser('sweep', help='Backtest variants of a simulation over a grid of parameters')
+    sweep_parser.add_argument('spec', help='JSON file of the sweep: {"simulation": NAME, "grid": {"field.path": [values]}}')
+    sweep_parser.add_argument('--config', default='configs/simulations.json', help='Simulations configuration file')
+    sweep_parser.add_argument('--results', default='sweep.db',
+                              help='SQLite file of the results (variants already in it are not run again)')
+    sweep_parser.add_argument('--random', type=int, help='Only run this many variants drawn at random from the grid')
+    sweep_parser.add_argument('--seed', type=int, default=0, help='Seed of --random')
+    sweep_parser.add_argument('--engine', choices=('step', 'batch'), default='batch', help='Engine of the variants')
+    sweep_parser.add_argument('--offline', action='store_true',
+                              help='Only use the candles already stored in ohlcv_cache.db (no QTSBE requests)')
+    sweep_parser.add_argument('--top', type=int, help='Only print the best N variants')
+    args = parser.parse_args()
+
+    # directory for log files
+    log_dir = 'logs'
+    os.makedirs(log_dir, exist_ok=True)  # create the logs directory if it doesn't exist
+
+    # log file name based on current date
+    log_file = os.path.join(log_dir, f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.log")
+    log_level = "DEBUG" if args.debug else "INFO"
+
+    if args.profile:
+        if args.command == 'sweep':
+            parser.error("-profile is not supported by sweep (its variants run in worker processes)")
+        start_profiling(args)
+
+    # configure loguru to handle logging
+    if args.command == 'backtest':
+        run_backtest(args, log_file, log_level)
+    elif args.command == 'sweep':
+        run_sweep_command(args, log_file, log_level)
+    else:
+        logger.add(log_file, rotation="00:00", retention="7 days", level=log_level)
+        run_bot(args, log_file, log_level)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the CandleStore class, a local SQLite cache of the OHLCV
+# candles fetched from the API, so that each tick only has to fetch the
+# candles after the last stored one (and can run from the cache when the API
+# is down).
+# =============================================================================
+
+import asyncio
+import functools
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from src.api.frame import OHLCVFrame, parse_date
+
+def get_timeframe(pair_name):
+    """
+    Get the timeframe of a pair from its name suffix (e.g., 'Binance_BTCUSDT_1d' -> '1d').
+    """
+    return pair_name.rsplit('_', 1)[-1] if '_' in pair_name else ''
+
+class CandleStore:
+    def __init__(self, db_path='ohlcv_cache.db'):
+        """
+        Initialize the candle store.
+
+        db_path: Path to the SQLite cache file.
+        """
+        self.db_connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)  # shared by the worker processes
+        self.db_connection.execute("PRAGMA journal_mode = WAL")
+        self.db_cursor = self.db_connection.cursor()
+        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS candles (
+                                  pair TEXT,
+                                  timeframe TEXT,
+                                  date TEXT,
+                                  row TEXT,
+                                  PRIMARY KEY (pair, timeframe, date)) WITHOUT ROWID''')
+        self.db_connection.commit()
+        self.rows = {}  # in-memory copy of the stored candles of each pair (OHLCVFrame)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="candle-store")
+
+    async def run(self, func, *args):
+        """
+        Run func(*args) on the thread of the store and return its result: from
+        async code, the store is only used through run() so SQLite never
+        blocks the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self.executor.shutdown(wait=True)
+        self.db_connection.close()
+
+    def get_rows(self, pair_name):
+        """
+        Get all stored candles of a pair, loading them from disk on first use.
+
+        pair_name: The trading pair (e.g., 'Binance_BTCUSDT_1d').
+
+        return: OHLCVFrame of the candles, sorted by date.
+        """
+        rows = self.rows.get(pair_name)
+        if rows is None:
+            self.db_cursor.execute(
+                "SELECT row FROM candles WHERE pair = ? AND timeframe = ? ORDER BY date",
+                (pair_name, get_timeframe(pair_name)))
+            rows = OHLCVFrame.from_rows(json.loads(row[0]) for row in self.db_cursor)
+            self.rows[pair_name] = rows
+        return rows
+
+    def get_last_date(self, pair_name):
+        """
+        Get the date of the last stored candle of a pair, or None if nothing is stored.
+        """
+        rows = self.get_rows(pair_name)
+        return rows.date(-1) if rows else None
+
+    def read_last_epoch(self, pair_name):
+        """
+        Read the epoch of the last stored candle of a pair from disk (including
+        the candles merged by other processes), or None if nothing is stored.
+        """
+        self.db_cursor.execute("SELECT MAX(date) FROM candles WHERE pair = ? AND timeframe = ?",
+                               (pair_name, get_timeframe(pair_name)))
+        last_date = self.db_cursor.fetchone()[0]
+        return parse_date(last_date) if last_date else None
+
+    def merge(self, pair_name, new_rows):
+        """
+        Merge freshly fetched candles into the store.
+
+        Stored candles at or after the first new date are replaced, which also
+        updates the last candle when it was still forming.
+
+        pair_name: The trading pair.
+        new_rows: OHLCVFrame (or list of OHLCV rows) of the new candles, sorted by date.
+
+        return: The merged OHLCVFrame.
+        """
+        rows = self.get_rows(pair_name)
+        if not isinstance(new_rows, OHLCVFrame):
+            new_rows = OHLCVFrame.from_rows(new_rows)
+        if not new_rows:
+            return rows
+        cut = len(rows)
+        first_epoch = new_rows.epochs[0]
+        while cut and rows.epochs[cut - 1] >= first_epoch:  # new rows usually overlap only the last candle
+            cut -= 1
+        merged = (rows[:cut] if cut < len(rows) else rows).concat(new_rows)
+        timeframe = get_timeframe(pair_name)
+        if cut < len(rows):
+            self.db_cursor.execute(
+                "DELETE FROM candles WHERE pair = ? AND timeframe = ? AND date >= ?",
+                (pair_name, timeframe, new_rows.date(0)))
+        self.db_cursor.executemany(
+            "INSERT OR REPLACE INTO candles (pair, timeframe, date, row) VALUES (?, ?, ?, ?)",
+            [(pair_name, timeframe, row[0], json.dumps(row)) for row in new_rows])
+        self.db_connection.commit()
+        self.rows[pair_name] = merged
+        return merged
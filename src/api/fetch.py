@@ -10,36 +10,186 @@
 # intervalls (start_ts - end_ts)
 # =============================================================================
 
+import asyncio
 import aiohttp
 from loguru import logger
+from src.api.cache import CandleStore
+from src.api.stream import CandlesDecoder
+from src.internal.metrics import metrics
 
-async def fetch_ohlcv_from_api(simulation):
+DEFAULT_CONCURRENCY = 8  # simultaneous requests per simulation fetch
+DEFAULT_TIMEOUT = 30  # seconds per request
+DEFAULT_RETRIES = 3  # retries after the first attempt
+RETRY_BACKOFF = 0.5  # seconds, doubled after every failed attempt
+POOL_LIMIT = 32  # maximum open connections of the shared session
+CANDLE_STORE_PATH = 'ohlcv_cache.db'
+DEFAULT_QTSBE_URL = 'http://127.0.0.1:5000'
+STREAM_BLOCK = 1 << 20  # bytes of response decoded at once, in a thread
+
+_session = None
+_candle_store = None
+
+def get_session():
     """
-    Fetch positions from an API endpoint for a specific simulation and time range.
-    
-    simulation: Simulation configuration dictionary.
-    start_ts_config: Start timestamp for the API query.
-    end_ts: End timestamp for the API query.
+    Get the shared aiohttp session, creating it on first use.
 
-    return: Tuple containing current positions fetched from API and previous positions.
+    The session (and its connection pool) is kept for the whole lifetime of
+    the simulator so every fetch reuses the same keep-alive connections.
     """
-    try:
-        pairs = list(simulation['api']['pairs_list'])
-        pairs_data = []
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_LIMIT, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+async def close_session():
+    """
+    Close the shared aiohttp session if it was opened.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def get_candle_store():
+    """
+    Get the local candle store, opening it on first use.
+    """
+    global _candle_store
+    if _candle_store is None:
+        _candle_store = CandleStore(CANDLE_STORE_PATH)
+    return _candle_store
+
+def close_candle_store():
+    """
+    Close the local candle store if it was opened.
+    """
+    global _candle_store
+    if _candle_store is not None:
+        _candle_store.close()
+    _candle_store = None
+
+async def read_payload(response):
+    """
+    Decode a QTSBE response while it is received. Blocks of STREAM_BLOCK bytes
+    are decoded in a thread so large histories don't block the event loop;
+    small responses (new candles only) are decoded directly.
+
+    return: The payload, with the OHLCVFrame of the candles in 'data'.
+    """
+    loop = asyncio.get_running_loop()
+    decoder = CandlesDecoder()
+    block = bytearray()
+    streamed = False
+    async for chunk in response.content.iter_any():
+        block += chunk
+        if len(block) >= STREAM_BLOCK:
+            await loop.run_in_executor(None, decoder.feed, bytes(block))
+            block.clear()
+            streamed = True
+
+    def finish():
+        decoder.feed(bytes(block))
+        return decoder.close()
+    return await loop.run_in_executor(None, finish) if streamed else finish()
+
+async def fetch_pair(session, url, params, semaphore, timeout, retries):
+    """
+    Fetch the JSON payload of a single pair, retrying with exponential backoff.
 
-        async with aiohttp.ClientSession() as session:
-            for pair in pairs:
-                url = f"http://127.0.0.1:5000/QTSBE/{pair}/default?details=True" # {simulation['api']['strategy']}
+    session: The shared aiohttp session.
+    url: The QTSBE URL of the pair.
+    params: Query parameters of the request.
+    semaphore: Semaphore limiting the number of concurrent requests.
+    timeout: aiohttp.ClientTimeout applied to each attempt.
+    retries: Number of retries after the first attempt.
 
-                async with session.get(url) as response:
+    return: The decoded payload (see read_payload), or None if every attempt failed.
+    """
+    with metrics.timer('simulator_fetch_seconds'):
+        return await fetch_with_retries(session, url, params, semaphore, timeout, retries)
+
+async def fetch_with_retries(session, url, params, semaphore, timeout, retries):
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                async with session.get(url, params=params, timeout=timeout) as response:
                     if response.status == 200:
-                        response_json = await response.json()
-                        pairs_data.extend([response_json])
-                    else:
-                        logger.error(f"Failed to fetch data from {url}, status code: {response.status}")
+                        return await read_payload(response)
+                    logger.error(f"Failed to fetch data from {url}, status code: {response.status}")
+                    metrics.inc('simulator_fetch_errors_total', reason=str(response.status))
+                    if response.status < 500 and response.status != 429:
+                        return None  # client errors won't be fixed by retrying
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Error fetching data from {url} (attempt {attempt + 1}/{retries + 1}): {e!r}")
+            metrics.inc('simulator_fetch_errors_total', reason=type(e).__name__)
+        if attempt < retries:
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    return None
 
-        return pairs_data
+async def fetch_ohlcv_from_api(simulation, pairs_to_fetch=None):
+    """
+    Fetch the OHLCV data of every pair of a simulation concurrently.
 
-    except Exception as e:
-        logger.error(f"Error fetching positions from API: {e}")
-        return [], []
\ No newline at end of file
+    Only the candles from the last one stored in the local candle store are
+    requested, then merged into the store. If a pair cannot be fetched, its
+    stored candles are used instead.
+
+    simulation: Simulation configuration dictionary. The optional keys
+                'qtsbe_url', 'fetch_concurrency', 'fetch_timeout' and
+                'fetch_retries' of simulation['api'] override the defaults of
+                this module. With 'offline' set to "True", QTSBE isn't
+                requested and only the stored candles are used.
+    pairs_to_fetch: Pairs requested from QTSBE (the others use their stored
+                    candles), all of them by default.
+
+    return: List of payloads in the same order as simulation['api']['pairs_list']
+            (their 'data' is the OHLCVFrame of the stored candles), with None for
+            the pairs that could not be fetched nor found in the store.
+    """
+    api = simulation['api']
+    pairs = list(api['pairs_list'])
+    semaphore = asyncio.Semaphore(int(api.get('fetch_concurrency', DEFAULT_CONCURRENCY)))
+    timeout = aiohttp.ClientTimeout(total=float(api.get('fetch_timeout', DEFAULT_TIMEOUT)))
+    retries = int(api.get('fetch_retries', DEFAULT_RETRIES))
+    base_url = api.get('qtsbe_url') or DEFAULT_QTSBE_URL
+    offline = str(api.get('offline', '')).lower() == 'true'
+    store = get_candle_store()
+
+    fetched = set(pairs if pairs_to_fetch is None else pairs_to_fetch)  # the others use their stored candles
+    payloads = [None] * len(pairs)
+    if not offline:
+        session = get_session()
+        last_dates = await store.run(lambda: {pair: store.get_last_date(pair) for pair in pairs if pair in fetched})
+        positions, requests = [], []
+        for position, pair in enumerate(pairs):
+            if pair not in fetched:
+                continue
+            url = f"{base_url}/QTSBE/{pair}/default" # {simulation['api']['strategy']}
+            params = {'details': 'True'}
+            last_date = last_dates[pair]
+            if last_date:
+                params['start_ts'] = last_date  # the last candle may still have been forming
+            positions.append(position)
+            requests.append(fetch_pair(session, url, params, semaphore, timeout, retries))
+        for position, payload in zip(positions, await asyncio.gather(*requests)):
+            payloads[position] = payload
+
+    def merge_payloads():
+        pairs_data = []
+        for pair, payload in zip(pairs, payloads):
+            if payload is not None and not (isinstance(payload, dict) and 'data' in payload):
+                logger.warning(f"No candles in the response of QTSBE for {pair}, handled as a failed request")
+                payload = None
+            if payload is not None:
+                pairs_data.append(dict(payload, data=store.merge(pair, payload['data'])))
+            elif store.get_rows(pair):
+                if pair in fetched and not offline:
+                    logger.warning(f"Using {len(store.get_rows(pair))} cached candles for {pair}")
+                pairs_data.append({'data': store.get_rows(pair)})
+            else:
+                if offline:
+                    logger.warning(f"No stored candles for {pair}")
+                pairs_data.append(None)
+        return pairs_data
+    return await store.run(merge_payloads)  # in a single trip to the thread of the store
@@ -0,0 +1,157 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the OHLCVFrame class, the in-memory form of the candles
+# of a pair: one typed array per column (epoch seconds, open, high, low,
+# close, volume) instead of a list of rows. Indexing a frame still returns
+# rows, so the strategies written for the rows of the API keep working.
+# =============================================================================
+
+from array import array
+from datetime import date, datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_DATE = date(1970, 1, 1)
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+_days = {}  # day since the epoch -> 'YYYY-MM-DD'
+_times = {}  # second of the day -> ' HH:MM:SS'
+
+def parse_date(date):
+    """
+    Convert a 'YYYY-MM-DD HH:MM:SS' string (or a naive datetime) to epoch seconds.
+    """
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return (date - EPOCH) // timedelta(seconds=1)
+
+def format_date(epoch):
+    """
+    Convert epoch seconds to a 'YYYY-MM-DD HH:MM:SS' string (cached by day
+    and by second of the day, candles share both).
+    """
+    day, seconds = divmod(epoch, 86400)
+    prefix = _days.get(day)
+    if prefix is None:
+        prefix = _days[day] = (EPOCH_DATE + timedelta(days=day)).isoformat()
+    suffix = _times.get(seconds)
+    if suffix is None:
+        suffix = _times[seconds] = f" {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return prefix + suffix
+
+def to_float(value):
+    return float('nan') if value is None else float(value)
+
+class OHLCVFrame:
+    __slots__ = ('epochs', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, epochs=None, open=None, high=None, low=None, close=None, volume=None):
+        """
+        Candles of a pair, by column.
+
+        epochs: array('q') of the candle dates in epoch seconds, sorted.
+        open, high, low, close, volume: array('d') of the same length.
+
+        Frames are not modified once built (merging candles builds a new one),
+        so they can be shared by the candle store, the timelines and the runs.
+        """
+        self.epochs = epochs if epochs is not None else array('q')
+        self.open = open if open is not None else array('d')
+        self.high = high if high is not None else array('d')
+        self.low = low if low is not None else array('d')
+        self.close = close if close is not None else array('d')
+        self.volume = volume if volume is not None else array('d')
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a frame from OHLCV rows ([date, open, high, low, close, volume]).
+        Missing values are NaN.
+        """
+        frame = cls()
+        frame.extend(rows)
+        return frame
+
+    def extend(self, rows):
+        """
+        Append OHLCV rows (only while the frame is being built).
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        try:
+            epochs = array('q', [parse_date(row[0]) for row in rows])
+            columns = [array('d', [row[i] for row in rows]) for i in range(1, 6)]
+        except (IndexError, TypeError):
+            for row in rows:  # short rows or null values, converted one by one
+                self.append(parse_date(row[0]), *row[1:6])
+            return
+        self.epochs.extend(epochs)
+        for column, values in zip(self.columns(), columns):
+            column.extend(values)
+
+    def append(self, epoch, open=None, high=None, low=None, close=None, volume=None):
+        """
+        Append a candle (only while the frame is being built).
+        """
+        self.epochs.append(epoch)
+        self.open.append(to_float(open))
+        self.high.append(to_float(high))
+        self.low.append(to_float(low))
+        self.close.append(to_float(close))
+        self.volume.append(to_float(volume))
+
+    def columns(self):
+        return (self.open, self.high, self.low, self.close, self.volume)
+
+    def date(self, index):
+        """
+        return: The date of a candle, 'YYYY-MM-DD HH:MM:SS'.
+        """
+        return format_date(self.epochs[index])
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __getitem__(self, index):
+        """
+        Row access, like the list of rows of the API: frame[i] is the tuple
+        (date, open, high, low, close, volume) of a candle, a slice is a frame.
+        """
+        if isinstance(index, slice):
+            return OHLCVFrame(self.epochs[index], self.open[index], self.high[index],
+                              self.low[index], self.close[index], self.volume[index])
+        return (format_date(self.epochs[index]), self.open[index], self.high[index],
+                self.low[index], self.close[index], self.volume[index])
+
+    def __iter__(self):
+        return zip(map(format_date, self.epochs), *self.columns())
+
+    def __repr__(self):
+        if not self:
+            return "OHLCVFrame(0 candles)"
+        return f"OHLCVFrame({len(self)} candles, {self.date(0)} to {self.date(-1)})"
+
+    def concat(self, other):
+        """
+        return: A new frame with the candles of this frame, then the ones of other.
+        """
+        return OHLCVFrame(*(column + other_column for column, other_column in
+                            zip((self.epochs, *self.columns()), (other.epochs, *other.columns()))))
+
+    def arrays(self):
+        """
+        Vectorized access for the strategies (and the batch engine).
+
+        return: Dictionary mapping 'open', 'high', 'low', 'close' and 'volume'
+                to read-only float64 NumPy arrays sharing the memory of the frame.
+        """
+        import numpy as np
+        arrays = {}
+        for name, column in zip(PRICE_COLUMNS, self.columns()):
+            values = np.frombuffer(column, dtype=np.float64) if column else np.empty(0)
+            values.flags.writeable = False
+            arrays[name] = values
+        return arrays
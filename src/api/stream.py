@@ -0,0 +1,146 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the CandlesDecoder class, which decodes a QTSBE response
+# while it is received: the rows of its 'data' array are decoded by batches
+# straight into an OHLCVFrame, so the whole body and the whole tree of Python
+# lists never exist at once. orjson is used when it is installed.
+# =============================================================================
+
+import json
+import re
+from src.api.frame import OHLCVFrame
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+STRUCTURE = re.compile(rb'["{}\[\]]')
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+DATA_VALUE = re.compile(rb'\s*(?::\s*)?')
+DATA_ARRAY = re.compile(rb'\s*:\s*\[')
+ROWS_END = re.compile(rb'\]\s*\]')  # end of the last row, then of the array
+
+def loads(content):
+    """
+    Decode JSON with orjson if available (it rejects NaN, json accepts it).
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(content)
+
+class CandlesDecoder:
+    HEAD, ROWS, TAIL = range(3)
+
+    def __init__(self):
+        """
+        Incremental decoder of a QTSBE response ({..., "data": [[date, open,
+        high, low, close, volume], ...], ...}).
+
+        Rows are flat arrays (no ']' inside them), so a batch of complete rows
+        ends at the last ']' received. The other fields are kept as text and
+        decoded at the end.
+        """
+        self.state = self.HEAD
+        self.head = bytearray()  # text before the rows, up to the '[' of the data array
+        self.rows = b''  # rows received but not decoded yet
+        self.tail = bytearray()  # text after the data array
+        self.scan_pos = 0  # position in head of the next token to scan
+        self.depth = 0
+        self.frame = OHLCVFrame()
+
+    def feed(self, chunk):
+        """
+        Decode a chunk of the response (CPU-bound, run it off the event loop).
+        """
+        if self.state == self.HEAD:
+            self.head += chunk
+            start = self.find_data()
+            if start is None:
+                return
+            self.rows, self.head = bytes(self.head[start:]), self.head[:start]
+            self.state = self.ROWS
+            chunk = b''
+        if self.state == self.ROWS:
+            self.rows += chunk
+            self.decode_rows()
+        else:
+            self.tail += chunk
+
+    def find_data(self):
+        """
+        Scan the head for the "data" key of the top-level object.
+
+        return: Position after the '[' of the data array, or None if it was not received yet.
+        """
+        head, pos = self.head, self.scan_pos
+        while True:
+            match = STRUCTURE.search(head, pos)
+            if match is None:
+                self.scan_pos = len(head)
+                return None
+            token = head[match.start()]
+            if token == ord('"'):
+                string = STRING.match(head, match.start())
+                if string is None:
+                    self.scan_pos = match.start()  # the string is incomplete
+                    return None
+                if self.depth == 1 and string.group() == b'"data"':
+                    if DATA_VALUE.match(head, string.end()).end() == len(head):
+                        self.scan_pos = match.start()  # its value is not received yet
+                        return None
+                    array = DATA_ARRAY.match(head, string.end())
+                    if array is not None:
+                        return array.end()
+                pos = string.end()
+                continue
+            self.depth += 1 if token in b'{[' else -1
+            pos = match.end()
+
+    def decode_rows(self):
+        """
+        Decode the complete rows received, and detect the end of the data array.
+        """
+        rows = self.rows.lstrip()
+        if rows.startswith(b','):
+            rows = rows[1:].lstrip()
+        if rows.startswith(b']'):
+            self.finish_rows(b'', rows[1:])
+            return
+        cut = rows.rfind(b']')
+        if cut < 0:
+            self.rows = rows
+            return
+        end = ROWS_END.search(rows, 0, cut + 1)
+        if end is not None:
+            self.finish_rows(rows[:end.start() + 1], rows[end.end():])
+            return
+        self.frame.extend(loads(b'[' + rows[:cut + 1] + b']'))
+        self.rows = rows[cut + 1:]
+
+    def finish_rows(self, rows, tail):
+        if rows:
+            self.frame.extend(loads(b'[' + rows + b']'))
+        self.rows = b''
+        self.tail = bytearray(tail)
+        self.state = self.TAIL
+
+    def close(self):
+        """
+        return: The decoded payload, with the OHLCVFrame of the candles in 'data'.
+        """
+        if self.state == self.HEAD:
+            return loads(self.head)  # no data array: decoded at once
+        if self.state == self.ROWS:
+            raise ValueError("Truncated response: the data array is not terminated")
+        payload = loads(self.head + b']' + self.tail)
+        payload['data'] = self.frame
+        return payload
@@ -0,0 +1,86 @@
+import threading
+from src.db.manager import AsyncAccess
+
+class Cursors:
+    def __init__(self, db_manager):
+        """
+        Initialize the Cursors manager.
+
+        A cursor records, for each simulation and pair, the date of the last
+        candle the simulation has processed, so that a loop iteration only
+        evaluates the candles that are strictly newer.
+
+        db_manager: An instance of DatabaseManager.
+        """
+        self.db_manager = db_manager
+        self.aio = AsyncAccess(self, db_manager)  # awaitable methods for async code
+        self.cache = {}  # simulation_name -> {pair: last_date}
+        self.lock = threading.Lock()  # the cache is shared by the reader threads, the writer thread and the event loop
+
+    def get_cursors(self, simulation_name):
+        """
+        Get the cursors of every pair of a simulation.
+
+        simulation_name: The name of the simulation.
+
+        Returns:
+            Dictionary (a copy) mapping each pair to the date ('YYYY-MM-DD HH:MM:SS') of its last processed candle.
+        """
+        with self.lock:
+            cursors = self.cache.get(simulation_name)
+            if cursors is not None:
+                return dict(cursors)
+        cursors = self.load_cursors(simulation_name)
+        with self.lock:
+            # keep the entry of a concurrent update_cursors, which is newer
+            return dict(self.cache.setdefault(simulation_name, cursors))
+
+    def load_cursors(self, simulation_name):
+        """
+        Read the cursors of a simulation from the database (on the connection of the current thread).
+
+        simulation_name: The name of the simulation.
+
+        Returns:
+            Dictionary mapping each pair to the date of its last processed candle.
+        """
+        query = "SELECT pair, last_date FROM cursors WHERE simulation_name = ?"
+        self.db_manager.db_cursor.execute(query, [simulation_name])
+        return dict(self.db_manager.db_cursor.fetchall())
+
+    def update_cursors(self, simulation_name, last_dates):
+        """
+        Move the cursors of some pairs of a simulation forward.
+
+        simulation_name: The name of the simulation.
+        last_dates: Dictionary mapping each pair to the date of its last processed candle.
+
+        Returns:
+            None
+        """
+        if not last_dates:
+            return
+        query = '''INSERT INTO cursors (simulation_name, pair, last_date) VALUES (?, ?, ?)
+                ON CONFLICT (simulation_name, pair) DO UPDATE SET last_date = excluded.last_date'''
+        self.db_manager.db_cursor.executemany(query,
+            [(simulation_name, pair, last_date) for pair, last_date in last_dates.items()])
+        self.db_manager.commit()
+        with self.lock:
+            cursors = self.cache.get(simulation_name)
+            if cursors is None:
+                cursors = self.cache[simulation_name] = self.load_cursors(simulation_name)
+            cursors.update(last_dates)
+
+    def delete_cursors(self, simulation_name):
+        """
+        Delete the cursors of a simulation, so that it is processed again from the start.
+
+        simulation_name: The name of the simulation.
+
+        Returns:
+            None
+        """
+        self.db_manager.db_cursor.execute("DELETE FROM cursors WHERE simulation_name = ?", [simulation_name])
+        self.db_manager.commit()
+        with self.lock:
+            self.cache.pop(simulation_name, None)
@@ -12,20 +12,157 @@
 
 import sqlite3
 import asyncio
-from src.db.tables import create_tables
+import contextvars
+import functools
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from src.db.tables import create_tables, migrate
+
+PRAGMAS = {
+    "journal_mode": "WAL",  # readers don't block the writer (and the other way around)
+    "synchronous": "NORMAL",  # safe with WAL, fsync only at checkpoints
+    "temp_store": "MEMORY",
+    "cache_size": -32000,  # 32 MB page cache
+    "busy_timeout": 5000,  # ms to wait for a lock held by another connection
+}
+
+def register_math_functions(connection):
+    """
+    Register LN and EXP (used by the fund slot stats) on a connection, when
+    SQLite was built without its math functions.
+    """
+    try:
+        connection.execute("SELECT LN(1), EXP(0)")
+    except sqlite3.OperationalError:
+        connection.create_function("LN", 1, lambda x: math.log(x) if x is not None and x > 0 else None, deterministic=True)
+        connection.create_function("EXP", 1, lambda x: math.exp(x) if x is not None else None, deterministic=True)
 
 class DatabaseManager:
-    def __init__(self, db_path='simulator.db'):
+    def __init__(self, db_path='simulator.db', readers=2):
         """
         Initialize the database manager.
+
+        The connection of the manager is the single writer. From async code,
+        writes must go through write() (they run on a dedicated thread) and
+        reads through read() (they run on a pool of read-only connections),
+        so that SQLite never blocks the event loop.
         
         db_path: Path to the SQLite database file.
+        readers: Number of read-only connections of the read pool.
         """
-        self.db_connection = sqlite3.connect(db_path)  # connect to the SQLite database
-        self.db_cursor = self.db_connection.cursor()  # create a cursor object to interact with the database
+        self.db_path = db_path
+        self.db_connection = sqlite3.connect(db_path, check_same_thread=False)  # connect to the SQLite database
+        for pragma, value in PRAGMAS.items():
+            self.db_connection.execute(f"PRAGMA {pragma} = {value}")
+        register_math_functions(self.db_connection)
+        self.writer_cursor = self.db_connection.cursor()  # create a cursor object to interact with the database
+        self.transaction_depth = 0
+        self.local = threading.local()  # read-only connection of each reader thread
+        self.reader_connections = []
         asyncio.run(create_tables(self))  # create tables if they don't exist
+        migrate(self)  # bring the schema (indexes, ...) up to date
+
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        # an in-memory database can't be shared between connections: reads go to the writer
+        self.readers = self.writer if db_path == ':memory:' else ThreadPoolExecutor(
+            max_workers=readers, thread_name_prefix="db-reader", initializer=self.open_reader)
+
+    @property
+    def db_cursor(self):
+        """
+        The cursor of the current thread: the read-only one on a reader thread, the writer one otherwise.
+        """
+        return getattr(self.local, 'cursor', None) or self.writer_cursor
+
+    def open_reader(self):
+        """
+        Open the read-only connection of a reader thread.
+        """
+        connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        connection.execute(f"PRAGMA busy_timeout = {PRAGMAS['busy_timeout']}")
+        register_math_functions(connection)
+        self.reader_connections.append(connection)
+        self.local.cursor = connection.cursor()
+
+    async def write(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on the writer thread and return its result.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.writer, functools.partial(contextvars.copy_context().run, func, *args, **kwargs))  # metrics labels
+
+    async def read(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on a reader thread and return its result.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.readers, functools.partial(contextvars.copy_context().run, func, *args, **kwargs))
+
+    async def read_many(self, calls):
+        """
+        Run several reads in a single trip to a reader thread.
+
+        calls: List of (func, args) tuples.
+
+        return: List of the results, in the same order.
+        """
+        return await self.read(lambda: [func(*args) for func, args in calls])
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group every write made inside the block in a single transaction.
+
+        Calls to commit() inside the block are deferred to its end, blocks can
+        be nested, and the whole transaction is rolled back on error.
+        """
+        self.transaction_depth += 1
+        try:
+            yield
+        except BaseException:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.db_connection.rollback()
+            raise
+        self.transaction_depth -= 1
+        if self.transaction_depth == 0:
+            self.db_connection.commit()
+
+    def commit(self):
+        """
+        Commit the current transaction, unless inside a transaction() block.
+        """
+        if self.transaction_depth == 0:
+            self.db_connection.commit()
+
     def close(self):
         """
         Close the database connection.
         """
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+        for connection in self.reader_connections:
+            connection.close()
         self.db_connection.close()  # close the database connection
+
+class AsyncAccess:
+    def __init__(self, target, db_manager):
+        """
+        Awaitable facade of a data access object (Positions, Cursors): its get_*
+        methods run on the read pool, every other method on the writer thread.
+
+        target: The data access object.
+        db_manager: Its DatabaseManager.
+        """
+        self.target = target
+        self.db_manager = db_manager
+
+    def __getattr__(self, name):
+        method = getattr(self.target, name)
+        run = self.db_manager.read if name.startswith('get_') else self.db_manager.write
+
+        async def call(*args, **kwargs):
+            return await run(method, *args, **kwargs)
+        return call
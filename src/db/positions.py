@@ -1,5 +1,8 @@
 from datetime import datetime
+from src.db.manager import AsyncAccess
+from src.internal.metrics import timed_methods
 
+@timed_methods('simulator_db_seconds')
 class Positions:
     def __init__(self, db_manager):
         """
@@ -8,6 +11,7 @@ class Positions:
         db_manager: An instance of DatabaseManager.
         """
         self.db_manager = db_manager
+        self.aio = AsyncAccess(self, db_manager)  # awaitable methods for async code
 
     def get_positions_by_simulation(self, simulation_name, start_ts=None, end_ts=None):
         """
@@ -40,11 +44,13 @@ class Positions:
         simulation_name: The name of the simulation.
 
         Returns:
-            List of open positions.
+            List of open positions as dictionaries, in creation order.
         """
-        query = "SELECT * FROM positions WHERE simulation_name = ? AND sell_index IS NULL"
+        query = "SELECT * FROM positions WHERE simulation_name = ? AND sell_index IS NULL ORDER BY id"
         self.db_manager.db_cursor.execute(query, [simulation_name])
-        return self.db_manager.db_cursor.fetchall()
+        columns = [column[0] for column in self.db_manager.db_cursor.description]
+        rows = self.db_manager.db_cursor.fetchall()
+        return [dict(zip(columns, row)) for row in rows]
 
     def create_position(self, simulation_name, pair, buy_date, buy_price, buy_index, fund_slot, buy_signal):
         """
@@ -68,7 +74,7 @@ class Positions:
                 VALUES (?, ?, ?, ?, ?, ?, ?)'''
         self.db_manager.db_cursor.execute(query, 
             (simulation_name, pair, buy_date, buy_price, buy_index, fund_slot, buy_signal))
-        self.db_manager.db_connection.commit()
+        self.db_manager.commit()
         return self.db_manager.db_cursor.lastrowid
 
     def get_free_fund_slots(self, simulation_name, max_slots):
@@ -127,16 +133,16 @@ class Positions:
         # Calculate the profit/loss ratio
         ratio = round(sell_price / buy_price, 3)  # Round ratio to 3 decimal places
 
-        # Update the position with the sell information
-        query = '''UPDATE positions
-                    SET sell_date = ?, sell_price = ?, sell_index = ?, sell_signal = ?, 
-                    position_duration = ?, ratio = ?
-                WHERE id = ?'''
-        self.db_manager.db_cursor.execute(query, 
-        (sell_date, sell_price, sell_index, sell_signal, position_duration, ratio, position_id))
-        self.db_manager.db_connection.commit()
+        # Update the position and its fund slot in a single transaction
+        with self.db_manager.transaction():
+            query = '''UPDATE positions
+                        SET sell_date = ?, sell_price = ?, sell_index = ?, sell_signal = ?, 
+                        position_duration = ?, ratio = ?
+                    WHERE id = ?'''
+            self.db_manager.db_cursor.execute(query, 
+            (sell_date, sell_price, sell_index, sell_signal, position_duration, ratio, position_id))
 
-        self.update_fund_after_close(simulation_name, fund_slot, position_id, ratio)
+            self.update_fund_after_close(simulation_name, fund_slot, position_id, ratio)
 
     def update_fund_after_close(self, simulation_name, fund_slot, last_position_id, ratio):
         """
@@ -171,7 +177,7 @@ class Positions:
         '''
         self.db_manager.db_cursor.execute(insert_query, 
             (simulation_name, fund_slot, last_position_id, new_capital))
-        self.db_manager.db_connection.commit()
+        self.db_manager.commit()
 
     def get_most_recent_date(self, simulation_name):
         """
@@ -265,13 +271,14 @@ class Positions:
             columns = [column[0] for column in self.db_manager.db_cursor.description]
             return dict(zip(columns, row))
         return None
-    def get_ratios_for_fund_slot(self, simulation_name, fund_slot):
+    def get_ratios_for_fund_slot(self, simulation_name, fund_slot, limit=-1):
         """
         Get the ratio for each position containing the given fund_slot 
         in a specific simulation_name.
 
         simulation_name: The name of the simulation.
         fund_slot: The fund slot for which to retrieve ratios.
+        limit: Maximum number of ratios (the first ones), all of them by default.
 
         Returns:
             List of ratios for the positions containing the specified fund_slot.
@@ -282,11 +289,117 @@ class Positions:
         WHERE simulation_name = ? 
         AND fund_slot = ? 
         AND sell_index IS NOT NULL
+        ORDER BY id
+        LIMIT ?
         '''
-        self.db_manager.db_cursor.execute(query, [simulation_name, fund_slot])
+        self.db_manager.db_cursor.execute(query, [simulation_name, fund_slot, limit])
         rows = self.db_manager.db_cursor.fetchall()
         
         ratios = [row[0] for row in rows]
         
         return ratios
-    
\ No newline at end of file
+
+    def get_capital_by_fund_slot(self, simulation_name):
+        """
+        Get the current capital of every fund slot of a simulation_name (last row of the funds table).
+
+        simulation_name: The name of the simulation.
+
+        Returns:
+            Dictionary mapping each fund slot to its current capital.
+        """
+        query = '''
+        SELECT fund_slot, capital FROM funds
+        WHERE id IN (SELECT MAX(id) FROM funds WHERE simulation_name = ? GROUP BY fund_slot)
+        '''
+        self.db_manager.db_cursor.execute(query, [simulation_name])
+        return dict(self.db_manager.db_cursor.fetchall())
+
+    def get_fund_slot_stats(self, simulation_name, fund_slot=None):
+        """
+        Get the stats of the fund slots of a simulation_name, maintained by the
+        triggers of the fund_slot_stats table (see src/db/tables.py).
+
+        simulation_name: The name of the simulation.
+        fund_slot: A single fund slot, all of them by default.
+
+        Returns:
+            List of dictionaries (one per fund slot, ordered by fund slot) with
+            fund_slot, last_position_id, open_position_id, last_buy_date,
+            last_sell_date and last_ratio (of the last closed position),
+            total_profit (product of the ratios), trades, win_rate and capital.
+        """
+        query = '''
+        SELECT fund_slot, last_position_id, open_position_id, last_buy_date, last_sell_date, last_ratio,
+               EXP(log_profit) AS total_profit, trades, CAST(wins AS REAL) / NULLIF(trades, 0) AS win_rate, capital
+        FROM fund_slot_stats
+        WHERE simulation_name = ?
+        '''
+        params = [simulation_name]
+        if fund_slot is not None:
+            query += " AND fund_slot = ?"
+            params.append(fund_slot)
+        query += " ORDER BY fund_slot"
+        self.db_manager.db_cursor.execute(query, params)
+        columns = [column[0] for column in self.db_manager.db_cursor.description]
+        rows = self.db_manager.db_cursor.fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def find_position_id(self, simulation_name, pair, buy_index):
+        """
+        Get the ID of the position opened by a simulation_name on a pair at a given index.
+
+        simulation_name: The name of the simulation.
+        pair: The trading pair.
+        buy_index: The index of the buy candle.
+
+        Returns:
+            The ID of the position, or None if it doesn't exist.
+        """
+        query = "SELECT id FROM positions WHERE simulation_name = ? AND pair = ? AND buy_index = ?"
+        self.db_manager.db_cursor.execute(query, [simulation_name, pair, buy_index])
+        row = self.db_manager.db_cursor.fetchone()
+        return row[0] if row else None
+
+    def apply_events(self, simulation_name, events, replay=False):
+        """
+        Persist a batch of portfolio events ('open' and 'close') in a single transaction.
+
+        Positions are identified by (pair, buy_index), which is unique within a
+        simulation, so that events can be written before their position has an ID.
+
+        simulation_name: The name of the simulation.
+        events: List of event dictionaries, see src/simulation/portfolio.py.
+        replay: True when replaying a journal, events already in the database are skipped.
+
+        Returns:
+            Dictionary mapping (pair, buy_index) to the ID of each position opened by the events.
+        """
+        cursor = self.db_manager.db_cursor
+        ids = {}
+        for event in events:
+            key = (event['pair'], event['buy_index'])
+            if event['event'] == 'open':
+                position_id = self.find_position_id(simulation_name, *key) if replay else None
+                if position_id is None:
+                    cursor.execute('''INSERT INTO positions (simulation_name, pair, buy_date, buy_price, buy_index, fund_slot, buy_signal)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                        (simulation_name, event['pair'], event['buy_date'], event['buy_price'],
+                         event['buy_index'], event['fund_slot'], event['buy_signal']))
+                    position_id = cursor.lastrowid
+                ids[key] = position_id
+            elif event['event'] == 'close':
+                position_id = event.get('id') or ids.get(key) or self.find_position_id(simulation_name, *key)
+                cursor.execute('''UPDATE positions
+                                  SET sell_date = ?, sell_price = ?, sell_index = ?, sell_signal = ?,
+                                  position_duration = ?, ratio = ?
+                                  WHERE id = ? AND sell_index IS NULL''',
+                    (event['sell_date'], event['sell_price'], event['sell_index'], event['sell_signal'],
+                     event['position_duration'], event['ratio'], position_id))
+                if cursor.rowcount:  # not closed yet (skipped when replaying)
+                    cursor.execute('''INSERT INTO funds (simulation_name, fund_slot, last_position_id, capital)
+                                   VALUES (?, ?, ?, ?)''',
+                        (simulation_name, event['fund_slot'], position_id, event['capital']))
+        self.db_manager.commit()
+        return ids
+
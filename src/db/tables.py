@@ -32,23 +32,130 @@ async def create_tables(db_manager):
                               last_position_id INTEGER,
                               capital REAL)''')
 
-    db_manager.db_connection.commit()  # Commit the changes
+    db_manager.db_cursor.execute('''CREATE TABLE IF NOT EXISTS cursors (
+                              simulation_name TEXT,
+                              pair TEXT,
+                              last_date TEXT,
+                              PRIMARY KEY (simulation_name, pair))''')
+
+    db_manager.commit()  # Commit the changes
     
+# Each migration is a list of statements, applied once in order. The index of
+# the last applied migration (+1) is stored in PRAGMA user_version.
+MIGRATIONS = [
+    [
+        # open positions of a simulation / pair (the hot path of the simulation loop)
+        '''CREATE INDEX IF NOT EXISTS idx_positions_open
+           ON positions (simulation_name, pair) WHERE sell_index IS NULL''',
+        # positions of a simulation / pair by buy index (journal replay, max index)
+        '''CREATE INDEX IF NOT EXISTS idx_positions_pair_buy_index
+           ON positions (simulation_name, pair, buy_index)''',
+        # closed positions of a fund slot (ratios)
+        '''CREATE INDEX IF NOT EXISTS idx_positions_closed_slot
+           ON positions (simulation_name, fund_slot) WHERE sell_index IS NOT NULL''',
+        # positions of a simulation by date (timeframe queries, most recent date)
+        '''CREATE INDEX IF NOT EXISTS idx_positions_buy_date
+           ON positions (simulation_name, buy_date)''',
+        # last capital of a fund slot
+        '''CREATE INDEX IF NOT EXISTS idx_funds_slot
+           ON funds (simulation_name, fund_slot, id)''',
+    ],
+    [
+        # stats of each fund slot, maintained by triggers so they are read without scanning the positions
+        '''CREATE TABLE IF NOT EXISTS fund_slot_stats (
+              simulation_name TEXT,
+              fund_slot INTEGER,
+              last_position_id INTEGER,
+              open_position_id INTEGER,
+              last_buy_date TEXT,
+              last_sell_date TEXT,
+              last_ratio REAL,
+              log_profit REAL NOT NULL DEFAULT 0,
+              trades INTEGER NOT NULL DEFAULT 0,
+              wins INTEGER NOT NULL DEFAULT 0,
+              capital REAL,
+              PRIMARY KEY (simulation_name, fund_slot))''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_fund_slot_stats_open AFTER INSERT ON positions
+           BEGIN
+               INSERT INTO fund_slot_stats (simulation_name, fund_slot, last_position_id, open_position_id, last_buy_date)
+               VALUES (NEW.simulation_name, NEW.fund_slot, NEW.id, NEW.id, NEW.buy_date)
+               ON CONFLICT (simulation_name, fund_slot) DO UPDATE SET
+                   last_position_id = excluded.last_position_id,
+                   open_position_id = excluded.open_position_id,
+                   last_buy_date = excluded.last_buy_date;
+           END''',
+        # a ratio rounded to 0 wipes the slot: its log is -1e308 instead of NULL
+        '''CREATE TRIGGER IF NOT EXISTS trg_fund_slot_stats_close AFTER UPDATE OF sell_index ON positions
+           WHEN OLD.sell_index IS NULL AND NEW.sell_index IS NOT NULL
+           BEGIN
+               UPDATE fund_slot_stats SET
+                   open_position_id = NULLIF(open_position_id, NEW.id),
+                   last_sell_date = NEW.sell_date,
+                   last_ratio = NEW.ratio,
+                   log_profit = log_profit + COALESCE(LN(NEW.ratio), -1e308),
+                   trades = trades + 1,
+                   wins = wins + (NEW.ratio > 1)
+               WHERE simulation_name = NEW.simulation_name AND fund_slot = NEW.fund_slot;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_fund_slot_stats_capital AFTER INSERT ON funds
+           BEGIN
+               INSERT INTO fund_slot_stats (simulation_name, fund_slot, capital)
+               VALUES (NEW.simulation_name, NEW.fund_slot, NEW.capital)
+               ON CONFLICT (simulation_name, fund_slot) DO UPDATE SET capital = excluded.capital;
+           END''',
+        # stats of the existing positions and funds
+        '''INSERT INTO fund_slot_stats (simulation_name, fund_slot, capital)
+           SELECT simulation_name, fund_slot, capital FROM funds
+           WHERE id IN (SELECT MAX(id) FROM funds GROUP BY simulation_name, fund_slot)''',
+        '''INSERT INTO fund_slot_stats (simulation_name, fund_slot, last_position_id, open_position_id, last_buy_date,
+                                        last_sell_date, last_ratio, log_profit, trades, wins)
+           SELECT s.simulation_name, s.fund_slot, s.last_id, s.open_id, last.buy_date,
+                  closed.sell_date, closed.ratio, s.log_profit, s.trades, s.wins
+           FROM (SELECT simulation_name, fund_slot, MAX(id) AS last_id,
+                        MAX(CASE WHEN sell_index IS NULL THEN id END) AS open_id,
+                        MAX(CASE WHEN sell_index IS NOT NULL THEN id END) AS closed_id,
+                        TOTAL(CASE WHEN sell_index IS NOT NULL THEN COALESCE(LN(ratio), -1e308) END) AS log_profit,
+                        COUNT(sell_index) AS trades,
+                        COUNT(CASE WHEN sell_index IS NOT NULL AND ratio > 1 THEN 1 END) AS wins
+                 FROM positions GROUP BY simulation_name, fund_slot) AS s
+           JOIN positions AS last ON last.id = s.last_id
+           LEFT JOIN positions AS closed ON closed.id = s.closed_id
+           WHERE true
+           ON CONFLICT (simulation_name, fund_slot) DO UPDATE SET
+               last_position_id = excluded.last_position_id,
+               open_position_id = excluded.open_position_id,
+               last_buy_date = excluded.last_buy_date,
+               last_sell_date = excluded.last_sell_date,
+               last_ratio = excluded.last_ratio,
+               log_profit = excluded.log_profit,
+               trades = excluded.trades,
+               wins = excluded.wins''',
+    ],
+]
+
+def migrate(db_manager):
+    """
+    Apply the migrations that were not applied yet to the database.
+    """
+    version = db_manager.db_cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        with db_manager.transaction():
+            for statement in statements:
+                db_manager.db_cursor.execute(statement)
+            db_manager.db_cursor.execute(f"PRAGMA user_version = {number}")
+
 async def initialize_funds(db_manager, simulation_name, max_fund_slots, initial_capital_per_slot):
-    for slot in range(1, max_fund_slots + 1):
-        # Vérifier si l'entrée existe déjà
-        db_manager.db_cursor.execute(
-            '''SELECT 1 FROM funds 
-               WHERE simulation_name = ? AND fund_slot = ?''',
-            (simulation_name, slot)
-        )
-        exists = db_manager.db_cursor.fetchone()
+    await db_manager.write(insert_initial_funds, db_manager, simulation_name, max_fund_slots, initial_capital_per_slot)
 
-        if not exists:
-            # Insérer l'entrée si elle n'existe pas
-            db_manager.db_cursor.execute(
-                '''INSERT INTO funds (simulation_name, fund_slot, last_position_id, capital)
-                   VALUES (?, ?, ?, ?)''',
-                (simulation_name, slot, None, initial_capital_per_slot)
-            )
-    db_manager.db_connection.commit()
\ No newline at end of file
+def insert_initial_funds(db_manager, simulation_name, max_fund_slots, initial_capital_per_slot):
+    # insert the initial capital of every fund slot that has no entry yet, in a single statement
+    db_manager.db_cursor.execute(
+        '''WITH RECURSIVE slots(fund_slot) AS (
+               SELECT 1 UNION ALL SELECT fund_slot + 1 FROM slots WHERE fund_slot < ?)
+           INSERT INTO funds (simulation_name, fund_slot, last_position_id, capital)
+           SELECT ?, fund_slot, NULL, ? FROM slots
+           WHERE NOT EXISTS (SELECT 1 FROM funds
+                             WHERE funds.simulation_name = ? AND funds.fund_slot = slots.fund_slot)''',
+        (max_fund_slots, simulation_name, initial_capital_per_slot, simulation_name)
+    )
+    db_manager.commit()
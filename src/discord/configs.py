@@ -5,10 +5,23 @@
 # Author of this code: Simon
 # =============================================================================
 # Description of this file:
-# This file contains the fonctions to get configs from folder configs/
+# This file contains the fonctions to get configs from folder configs/, the
+# typed settings of a validated simulation, and the SimulationsConfig class,
+# which parses configs/simulations.json only when the file changes, validates
+# every simulation and notifies which simulations were added, removed or changed.
 # =============================================================================
 
 import json
+import os
+from collections import namedtuple
+from datetime import datetime
+from loguru import logger
+
+# Fields of a validated simulation the engines rely on, converted (see simulation_settings).
+# The configurations themselves stay dictionaries: they are what the workers
+# receive, what the snapshots hash and what backtest / sweep generate.
+SimulationSettings = namedtuple('SimulationSettings', ['channel_id', 'pairs_list', 'strategy', 'start_date', 'end_date',
+                                                       'engine', 'max_fund_slots', 'invest_capital'])
 
 def get_config(config):
     """
@@ -20,5 +33,142 @@ def get_config(config):
 def get_discord_config():
     return get_config("configs/discord_bot.json")
 
+def validate_simulation(simulation):
+    """
+    Check the fields the simulation engines rely on.
+
+    simulation: Simulation configuration dictionary.
+
+    return: List of the problems found (empty if the simulation is valid).
+    """
+    problems = []
+    sections = {section: simulation.get(section) for section in ('discord', 'api', 'positions', 'wallet')}
+    missing = [section for section, value in sections.items() if not isinstance(value, dict)]
+    if missing:
+        return [f"missing section(s) {', '.join(missing)}"]
+
+    if not sections['discord'].get('discord_channel_id'):
+        problems.append("discord.discord_channel_id is missing")
+    api = sections['api']
+    pairs_list = api.get('pairs_list')
+    if not isinstance(pairs_list, list) or not pairs_list or not all(isinstance(pair, str) for pair in pairs_list):
+        problems.append("api.pairs_list must be a non-empty list of pair names")
+    if not isinstance(api.get('strategy'), str) or not api['strategy']:
+        problems.append("api.strategy is missing")
+    for field in ('start_ts', 'end_ts'):
+        if api.get(field):
+            try:
+                datetime.strptime(api[field], "%Y-%m-%d %H:%M:%S")
+            except (TypeError, ValueError):
+                problems.append(f"api.{field} must be empty or 'YYYY-MM-DD HH:MM:SS'")
+    if api.get('engine', '') not in ('', 'step', 'batch'):
+        problems.append("api.engine must be 'step' or 'batch'")
+
+    try:
+        if int(sections['positions'].get('position_%_invest')) == 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        problems.append("positions.position_%_invest must be a non-zero integer")
+    try:
+        float(sections['wallet'].get('invest_capital'))
+    except (TypeError, ValueError):
+        problems.append("wallet.invest_capital must be a number")
+    return problems
+
+def simulation_settings(simulation):
+    """
+    Convert the fields of a simulation the engines rely on.
+
+    simulation: Simulation configuration dictionary, valid (see validate_simulation).
+
+    return: SimulationSettings of the simulation (start_date and end_date are
+            datetimes, or None if empty).
+    """
+    api = simulation['api']
+    start_ts, end_ts = api.get('start_ts'), api.get('end_ts')
+    return SimulationSettings(
+        channel_id=simulation['discord']['discord_channel_id'],
+        pairs_list=tuple(api['pairs_list']),
+        strategy=api['strategy'],
+        start_date=datetime.strptime(start_ts, "%Y-%m-%d %H:%M:%S") if start_ts else None,
+        end_date=datetime.strptime(end_ts, "%Y-%m-%d %H:%M:%S") if end_ts else None,
+        engine=api.get('engine') or 'step',
+        max_fund_slots=100 // int(simulation['positions']['position_%_invest']),
+        invest_capital=float(simulation['wallet']['invest_capital']),
+    )
+
+class SimulationsConfig:
+    def __init__(self, path="configs/simulations.json"):
+        """
+        Simulations configuration, parsed again only when its file changes
+        (inode, modification time or size).
+
+        path: Path to the simulations configuration file.
+        """
+        self.path = path
+        self.file_id = None  # (inode, mtime, size) of the parsed file
+        self.simulations = {}  # simulation_name -> valid simulation configuration
+        self.listeners = []
+
+    def subscribe(self, callback):
+        """
+        Call callback(event, simulation_name, simulation) for every simulation
+        'added', 'removed' or 'changed' when the file is parsed.
+        """
+        if callback not in self.listeners:  # on_ready runs again after a reconnection
+            self.listeners.append(callback)
+
+    def get(self):
+        """
+        return: Dictionary of the valid simulations (the same dictionary as long
+                as the file doesn't change).
+        """
+        stat = os.stat(self.path)
+        file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_id != self.file_id:
+            self.file_id = file_id
+            self.reload()
+        return self.simulations
+
+    def reload(self):
+        try:
+            content = get_config(self.path)
+            if not isinstance(content, dict):
+                raise ValueError("expected an object of simulations")
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read {self.path}, keeping the previous configuration: {e}")
+            return
+
+        simulations = {}
+        for simulation_name, simulation in content.items():
+            problems = validate_simulation(simulation) if isinstance(simulation, dict) else ["not an object"]
+            if not problems:
+                simulations[simulation_name] = simulation
+                continue
+            previous = self.simulations.get(simulation_name)
+            logger.error(f"Invalid simulation {simulation_name} in {self.path}: {'; '.join(problems)}"
+                         + (", keeping its previous configuration" if previous else ", skipped"))
+            if previous is not None:
+                simulations[simulation_name] = previous
+
+        events = [('removed', name, simulation) for name, simulation in self.simulations.items() if name not in simulations]
+        for simulation_name, simulation in simulations.items():
+            previous = self.simulations.get(simulation_name)
+            if previous is None:
+                events.append(('added', simulation_name, simulation))
+            elif previous != simulation:
+                events.append(('changed', simulation_name, simulation))
+        self.simulations = simulations
+
+        for event, simulation_name, simulation in events:
+            logger.info(f"Simulation {simulation_name} {event}")
+            for callback in self.listeners:
+                try:
+                    callback(event, simulation_name, simulation)
+                except Exception as e:
+                    logger.error(f"Failed to handle the {event} simulation {simulation_name}: {e!r}")
+
+simulations_config = SimulationsConfig()
+
 def get_simulations_config():
-    return get_config("configs/simulations.json")
+    return simulations_config.get()
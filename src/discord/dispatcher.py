@@ -0,0 +1,163 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the NotificationDispatcher class, which sends embeds to
+# Discord in the background: one queue and one rate-limit bucket per channel,
+# local deduplication of the embeds already sent, and up to 10 embeds per
+# message when a channel is backlogged.
+# =============================================================================
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from loguru import logger
+from src.internal.metrics import metrics
+
+MAX_EMBEDS_PER_MESSAGE = 10  # Discord limit
+
+def embed_hash(embed):
+    """
+    Hash of the content of an embed, ignoring its timestamp.
+    """
+    content = embed.to_dict()
+    content.pop('timestamp', None)
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+class TokenBucket:
+    def __init__(self, rate, per):
+        """
+        Rate limit of rate sends every per seconds.
+        """
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        """
+        Wait until a token is available, then take it.
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.fill_rate)
+
+class NotificationDispatcher:
+    def __init__(self, simulator, rate=5, per=5.0, dedup_size=1000):
+        """
+        Initialize the dispatcher.
+
+        simulator: The Simulator (its discord_bot and bot_config are used).
+        rate: Messages allowed per channel every per seconds.
+        per: Period of the rate limit, in seconds.
+        dedup_size: Number of embed hashes remembered per channel.
+        """
+        self.simulator = simulator
+        self.rate = rate
+        self.per = per
+        self.dedup_size = dedup_size
+        self.queues = {}  # channel_id -> deque of embeds waiting to be sent
+        self.sent = {}  # channel_id -> OrderedDict of the hashes of the embeds sent
+        self.workers = {}  # channel_id -> worker task
+        self.wakeups = {}  # channel_id -> asyncio.Event set when embeds are queued
+        self.in_flight = 0  # embeds being sent
+
+    def get_channel(self, channel_id):
+        guild = self.simulator.discord_bot.get_guild(int(self.simulator.bot_config.get("discord_id", "")))
+        return guild.get_channel(int(channel_id))
+
+    def submit(self, channel_id, embed):
+        """
+        Queue an embed to be sent to a channel. Never waits on Discord.
+        """
+        channel_id = int(channel_id)
+        if channel_id not in self.workers:
+            self.queues[channel_id] = deque()
+            self.sent[channel_id] = OrderedDict()
+            self.wakeups[channel_id] = asyncio.Event()
+            self.workers[channel_id] = asyncio.create_task(self.channel_worker(channel_id))
+        self.queues[channel_id].append(embed)
+        self.wakeups[channel_id].set()
+
+    def remember(self, channel_id, digest):
+        sent = self.sent[channel_id]
+        sent[digest] = None
+        if len(sent) > self.dedup_size:
+            sent.popitem(last=False)
+
+    async def seed(self, channel, channel_id):
+        """
+        Remember the embeds of the last messages of the bot in a channel, so
+        that they are not sent again after a restart.
+        """
+        try:
+            async for message in channel.history(limit=MAX_EMBEDS_PER_MESSAGE):
+                if message.author == self.simulator.discord_bot.user:
+                    for embed in message.embeds:
+                        self.remember(channel_id, embed_hash(embed))
+        except Exception as e:
+            logger.error(f"Failed to read the history of channel {channel_id}: {e}")
+
+    async def channel_worker(self, channel_id):
+        """
+        Send the queued embeds of a channel, respecting its rate limit.
+        """
+        queue, wakeup = self.queues[channel_id], self.wakeups[channel_id]
+        bucket = TokenBucket(self.rate, self.per)
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            logger.error(f"Channel not found for ID: {channel_id}")
+        else:
+            await self.seed(channel, channel_id)
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            await bucket.acquire()
+            embeds = []
+            while queue and len(embeds) < MAX_EMBEDS_PER_MESSAGE:
+                embed = queue.popleft()
+                digest = embed_hash(embed)
+                if digest not in self.sent[channel_id]:
+                    self.remember(channel_id, digest)
+                    embeds.append(embed)
+            if not embeds or channel is None:
+                continue
+            self.in_flight += len(embeds)
+            try:
+                with metrics.timer('simulator_discord_seconds', operation='send'):
+                    await channel.send(embeds=embeds)
+                metrics.inc('simulator_discord_embeds_total', len(embeds))
+            except Exception as e:
+                logger.error(f"Failed to send {len(embeds)} embeds to channel {channel_id}: {e}")
+            finally:
+                self.in_flight -= len(embeds)
+
+    def pending(self):
+        """
+        return: Number of embeds waiting to be sent, over all channels.
+        """
+        return self.in_flight + sum(len(queue) for queue in self.queues.values())
+
+    async def drain(self, timeout=30):
+        """
+        Wait (at most timeout seconds) until every queued embed is sent, then stop the workers.
+        """
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers.clear()
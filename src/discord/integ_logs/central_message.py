@@ -1,95 +1,165 @@
+import asyncio
+import time
 import discord
 from loguru import logger
 from datetime import datetime
 from src.internal.mng import ensure_internal_ini, read_simulation_data, write_simulation_data
+from src.discord.dispatcher import embed_hash
+from src.internal.metrics import metrics
 
-async def send_or_update_central_summary_embed(simulator, channel_id, simulation_name):
-    ensure_internal_ini()
-    
-    central_message_id = read_simulation_data(simulation_name)
-    
-    positions = simulator.positions.get_positions_by_simulation(simulation_name)
-    
-    if not positions:
-        logger.info(f"No positions found for simulation {simulation_name}")
-        return
-
-    fund_slot_data = {}
-    for position in positions:
-        fund_slot = position[11]  
-        #position_id = position[0]  
-        buy_date = position[3] if position[3] is not None else "N/A"
-        sell_date = position[5] if position[5] is not None else "N/A"
-        ratio = position[10] if position[10] is not None else 1.0  
-
-        if fund_slot not in fund_slot_data:
-            fund_slot_data[fund_slot] = {
-                "last_buy_date": buy_date,
-                "last_sell_date": sell_date,
-                "last_ratio": ratio,
-                "total_profit": 1.0
+DEFAULT_SUMMARY_INTERVAL = 10  # seconds between two edits of a central summary
+
+class CentralSummary:
+    def __init__(self, simulator, channel_id, simulation_name, interval=DEFAULT_SUMMARY_INTERVAL):
+        """
+        Central summary of a simulation, maintained from the opened / closed
+        positions and edited at most once every interval seconds.
+
+        simulator: The Simulator (its discord_bot, bot_config and positions are used).
+        channel_id: Channel of the simulation.
+        simulation_name: The name of the simulation.
+        interval: Minimum number of seconds between two edits of the message.
+        """
+        self.simulator = simulator
+        self.channel_id = channel_id
+        self.simulation_name = simulation_name
+        self.interval = interval
+        self.fund_slots = {}  # fund_slot -> last buy / sell date, last ratio and total profit
+        self.open_position_ids = set()
+        self.last_position_id = 0  # highest position ID applied
+        ensure_internal_ini()
+        self.message_id = read_simulation_data(simulation_name)  # read once, then kept in memory
+        self.message = None
+        self.rendered_hash = None  # hash of the embed of the message
+        self.last_update = 0.0
+        self.task = None
+
+    def position_opened(self, position):
+        if position['id'] <= self.last_position_id:
+            return  # already applied (read from the database)
+        self.last_position_id = position['id']
+        self.open_position_ids.add(position['id'])
+        data = self.fund_slots.setdefault(position['fund_slot'], {"total_profit": 1.0})
+        data["last_buy_date"] = position['buy_date']
+        data["last_sell_date"] = "N/A"
+        data["last_ratio"] = 1.0
+
+    def position_closed(self, position):
+        if position['id'] not in self.open_position_ids:
+            return  # already applied
+        self.open_position_ids.discard(position['id'])
+        data = self.fund_slots[position['fund_slot']]
+        data["last_sell_date"] = position['sell_date']
+        data["last_ratio"] = position['ratio']
+        data["total_profit"] *= position['ratio']
+
+    async def catch_up(self):
+        """
+        Reload the summary from the fund slot stats, to include the positions
+        opened or closed without notification (batch engine, first use after
+        a restart).
+        """
+        stats = await self.simulator.positions.aio.get_fund_slot_stats(self.simulation_name)
+        self.fund_slots = {}
+        self.open_position_ids = set()
+        for slot in stats:
+            if slot['last_position_id'] is None:
+                continue  # no position yet
+            is_open = slot['open_position_id'] is not None
+            if is_open:
+                self.open_position_ids.add(slot['open_position_id'])
+            self.last_position_id = max(self.last_position_id, slot['last_position_id'])
+            self.fund_slots[slot['fund_slot']] = {
+                "last_buy_date": slot['last_buy_date'],
+                "last_sell_date": "N/A" if is_open else slot['last_sell_date'],
+                "last_ratio": 1.0 if is_open else slot['last_ratio'],
+                "total_profit": slot['total_profit'],
             }
-        
-        if sell_date > fund_slot_data[fund_slot]["last_sell_date"]:
-            fund_slot_data[fund_slot]["last_sell_date"] = sell_date
-        if buy_date > fund_slot_data[fund_slot]["last_buy_date"]:
-            fund_slot_data[fund_slot]["last_buy_date"] = buy_date
-        fund_slot_data[fund_slot]["last_ratio"] = ratio
-        
-        ratios = simulator.positions.get_ratios_for_fund_slot(simulation_name, fund_slot)
-        if ratios:
-            total = 1.0 
-            for ratio in ratios:
-                total = total * ratio
-            fund_slot_data[fund_slot]["total_profit"] = total 
-    
-    embed = discord.Embed(
-        title="📊 **Central Summary**",
-        description=f"Summary for all fund slots in simulation **{simulation_name}**.",
-        color=discord.Color.pink(), # blue
-        timestamp=datetime.utcnow()
-    )
-    
-    for fund_slot, data in fund_slot_data.items():
-        last_ratio_str = f'{data["last_ratio"]:.3f}'
-        total_profit = round(data["total_profit"], 3)
-        last_buy_date_str = data["last_buy_date"]
-        last_sell_date_str = data["last_sell_date"]
-        
-        embed.add_field(
-            name=f"**💰 Fund Slot {fund_slot}**",
-            value=f"📅 Last Buy Date: {last_buy_date_str}\n"
-                  f"📅 Last Sell Date: {last_sell_date_str}\n"
-                  f"📈 Last Ratio: {last_ratio_str}\n"
-                  f"**🚀 Total Profit:** {total_profit:.3f}\n",
-            inline=False  
+
+    def render(self):
+        embed = discord.Embed(
+            title="📊 **Central Summary**",
+            description=f"Summary for all fund slots in simulation **{self.simulation_name}**.",
+            color=discord.Color.pink(), # blue
+            timestamp=datetime.utcnow()
         )
 
-    guild = simulator.discord_bot.get_guild(int(simulator.bot_config.get("discord_id", "")))
-    channel = guild.get_channel(int(channel_id))
-    if channel is None:
-        logger.error(f"Channel not found for ID: {channel_id}")
-        return
+        for fund_slot, data in self.fund_slots.items():
+            last_ratio_str = f'{data["last_ratio"]:.3f}'
+            total_profit = round(data["total_profit"], 3)
+            last_buy_date_str = data["last_buy_date"]
+            last_sell_date_str = data["last_sell_date"]
 
-    if central_message_id:
-        try:
-            message = await channel.fetch_message(central_message_id)
-            if message.embeds and message.embeds[0].to_dict() == embed.to_dict():
-                return  
-            await message.edit(embed=embed)
+            embed.add_field(
+                name=f"**💰 Fund Slot {fund_slot}**",
+                value=f"📅 Last Buy Date: {last_buy_date_str}\n"
+                      f"📅 Last Sell Date: {last_sell_date_str}\n"
+                      f"📈 Last Ratio: {last_ratio_str}\n"
+                      f"**🚀 Total Profit:** {total_profit:.3f}\n",
+                inline=False
+            )
+        return embed
+
+    def request_update(self):
+        """
+        Schedule an update of the message, unless one is already scheduled.
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.update_later())
+
+    async def update_later(self):
+        await asyncio.sleep(max(0.0, self.last_update + self.interval - time.monotonic()))
+        await self.update()
+
+    async def flush(self):
+        """
+        Update the message now if an update is scheduled.
+        """
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await self.update()
+
+    async def update(self):
+        """
+        Edit (or send and pin) the message, if its content changed.
+        """
+        self.last_update = time.monotonic()
+        if not self.fund_slots:
+            logger.info(f"No positions found for simulation {self.simulation_name}")
             return
-        except discord.NotFound:
-            logger.error(f"Message with ID {central_message_id} not found, sending a new message.")
-        except discord.HTTPException as e:
-            logger.error(f"Failed to fetch or edit message: {e}")
+        embed = self.render()
+        rendered_hash = embed_hash(embed)
+        if rendered_hash == self.rendered_hash:
+            return
+
+        guild = self.simulator.discord_bot.get_guild(int(self.simulator.bot_config.get("discord_id", "")))
+        channel = guild.get_channel(int(self.channel_id))
+        if channel is None:
+            logger.error(f"Channel not found for ID: {self.channel_id}")
             return
 
-    new_message = await channel.send(embed=embed)
-    #existing_central_message_id = read_simulation_data(simulation_name)
-    write_simulation_data(simulation_name, new_message.id)
+        if self.message_id:
+            if self.message is None:
+                self.message = channel.get_partial_message(self.message_id)
+            try:
+                with metrics.timer('simulator_discord_seconds', operation='edit'):
+                    await self.message.edit(embed=embed)
+                self.rendered_hash = rendered_hash
+                return
+            except discord.NotFound:
+                logger.error(f"Message with ID {self.message_id} not found, sending a new message.")
+            except discord.HTTPException as e:
+                logger.error(f"Failed to edit message: {e}")
+                return
+
+        with metrics.timer('simulator_discord_seconds', operation='send'):
+            self.message = await channel.send(embed=embed)
+        self.message_id = self.message.id
+        self.rendered_hash = rendered_hash
+        write_simulation_data(self.simulation_name, self.message_id)
 
-    try:
-        await new_message.pin()
-        logger.info(f"Message with ID {new_message.id} pinned successfully.")
-    except discord.HTTPException as e:
-        logger.error(f"Failed to pin message: {e}")
\ No newline at end of file
+        try:
+            await self.message.pin()
+            logger.info(f"Message with ID {self.message_id} pinned successfully.")
+        except discord.HTTPException as e:
+            logger.error(f"Failed to pin message: {e}")
@@ -2,32 +2,28 @@ import discord
 from loguru import logger
 from datetime import datetime
 
-async def send_fund_slot_summary_embed(simulator, channel_id, position_id):
-    position = simulator.positions.get_position_by_id(position_id)
-    if not position:
-        logger.error(f"Position not found for ID: {position_id}")
-        return
+MAX_RATIOS_SHOWN = 150  # more than fit in the 1024 characters of a field
+
+async def send_fund_slot_summary_embed(simulator, channel_id, position):
 
     simulation_name = position['simulation_name']
     fund_slot = position['fund_slot']
     
-    ratios = simulator.positions.get_ratios_for_fund_slot(simulation_name, fund_slot)
+    stats, ratios = await simulator.db_manager.read_many([
+        (simulator.positions.get_fund_slot_stats, (simulation_name, fund_slot)),
+        (simulator.positions.get_ratios_for_fund_slot, (simulation_name, fund_slot, MAX_RATIOS_SHOWN)),
+    ])
     
-    if not ratios:
+    if not stats or not stats[0]['trades']:
         logger.info(f"No ratios found for fund slot {fund_slot}")
         total_profit = 0.0
     else:
-        total_profit = 1.0
-        for ratio in ratios:
-            total_profit *= ratio
-        total_profit = round(total_profit, 3)
-    
-    guild = simulator.discord_bot.get_guild(int(simulator.bot_config.get("discord_id", "")))
-    channel = guild.get_channel(int(channel_id))
-    if channel is None:
-        logger.error(f"Channel not found for ID: {channel_id}")
-        return
+        total_profit = round(stats[0]['total_profit'], 3)
+
+    simulator.notifier.dispatcher.submit(channel_id, build_fund_slot_summary_embed(position, ratios, total_profit))
 
+def build_fund_slot_summary_embed(position, ratios, total_profit):
+    fund_slot = position['fund_slot']
     embed = discord.Embed(
         title="📉 Fund Slot Summary",
         description=f"Summary for fund slot **{fund_slot}**.",
@@ -48,9 +44,4 @@ async def send_fund_slot_summary_embed(simulator, channel_id, position_id):
     embed.add_field(name="💰 Total Profit", value=f"{total_profit:.3f}", inline=True)
 
     embed.set_footer(text="SmartSwap Simulator", icon_url="https://github.com/smartswap-org/simulator/blob/main/assets/simulator-logo.jpeg?raw=true")
-
-    async for message in channel.history(limit=10):
-        if message.author == simulator.discord_bot.user and message.embeds and message.embeds[0].to_dict() == embed.to_dict():
-            return
-
-    await channel.send(embed=embed)
\ No newline at end of file
+    return embed
\ No newline at end of file
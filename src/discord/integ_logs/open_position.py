@@ -11,17 +11,11 @@
 
 import discord
 from datetime import datetime
-from loguru import logger 
 
-async def send_open_position_embed(simulator, channel_id, position_id):
-    position = simulator.positions.get_position_by_id(position_id)
-    
-    guild = simulator.discord_bot.get_guild(int(simulator.bot_config.get("discord_id", "")))
-    channel = guild.get_channel(int(channel_id))
-    if channel is None:
-        logger.error(f"Channel not found for ID: {channel_id}")
-        return
+async def send_open_position_embed(simulator, channel_id, position):
+    simulator.notifier.dispatcher.submit(channel_id, build_open_position_embed(position))
 
+def build_open_position_embed(position):
     embed = discord.Embed(
         title="🚀 New Position Opened!",
         description=f"A new position has been opened for **{position['pair']}**.",
@@ -37,9 +31,4 @@ async def send_open_position_embed(simulator, channel_id, position_id):
     embed.add_field(name="💼 Fund Slot", value=f"{position['fund_slot']}", inline=True)
 
     embed.set_footer(text="SmartSwap Simulator", icon_url="https://github.com/smartswap-org/simulator/blob/main/assets/simulator-logo.jpeg?raw=true")
-
-    async for message in channel.history(limit=10):
-        if message.author == simulator.discord_bot.user and message.embeds and message.embeds[0].to_dict() == embed.to_dict():
-            return
-
-    await channel.send(embed=embed)
\ No newline at end of file
+    return embed
\ No newline at end of file
@@ -0,0 +1,167 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the notifiers used by the simulation engines to report
+# opened / closed positions and central summaries. DiscordNotifier sends them
+# to Discord, QueueNotifier forwards them to the main process from a worker,
+# NullNotifier discards them and FileNotifier writes them to a file.
+# =============================================================================
+
+import json
+from src.discord.integ_logs.open_position import send_open_position_embed
+from src.discord.integ_logs.close_position import send_close_position_embed
+from src.discord.integ_logs.fund_slot_summary import send_fund_slot_summary_embed
+from src.discord.integ_logs.central_message import CentralSummary, DEFAULT_SUMMARY_INTERVAL
+from src.discord.dispatcher import NotificationDispatcher
+from src.internal.metrics import metrics
+from loguru import logger
+
+class DiscordNotifier:
+    def __init__(self, simulator):
+        """
+        Notifier sending the embeds of a simulator to Discord.
+
+        Position embeds are queued to a NotificationDispatcher, so the
+        simulation doesn't wait for Discord to send them. Central summaries are
+        updated from the positions and edited at most once every
+        summary_interval seconds (configs/discord_bot.json).
+
+        simulator: The Simulator (its discord_bot, bot_config and positions are used).
+        """
+        self.simulator = simulator
+        self.dispatcher = NotificationDispatcher(simulator)
+        self.summary_interval = float(simulator.bot_config.get("summary_interval", DEFAULT_SUMMARY_INTERVAL))
+        self.summaries = {}  # simulation_name -> CentralSummary
+        metrics.gauge('simulator_discord_queue_depth', self.dispatcher.pending)
+
+    async def get_summary(self, channel_id, simulation_name):
+        summary = self.summaries.get(simulation_name)
+        if summary is None:
+            summary = CentralSummary(self.simulator, channel_id, simulation_name, self.summary_interval)
+            await summary.catch_up()  # positions written before this run
+            self.summaries[simulation_name] = summary
+        return summary
+
+    async def get_position(self, position_id):
+        position = await self.simulator.positions.aio.get_position_by_id(position_id)
+        if not position:
+            logger.error(f"Position not found for ID: {position_id}")
+        return position
+
+    async def position_opened(self, channel_id, position_id):
+        position = await self.get_position(position_id)
+        if not position:
+            return
+        summary = await self.get_summary(channel_id, position['simulation_name'])
+        summary.position_opened(position)
+        summary.request_update()
+        with metrics.timer('simulator_notification_seconds', kind='open_position'):
+            await send_open_position_embed(self.simulator, channel_id, position)
+
+    async def position_closed(self, channel_id, position_id):
+        position = await self.get_position(position_id)
+        if not position:
+            return
+        summary = await self.get_summary(channel_id, position['simulation_name'])
+        summary.position_closed(position)
+        summary.request_update()
+        with metrics.timer('simulator_notification_seconds', kind='close_position'):
+            await send_close_position_embed(self.simulator, channel_id, position)
+        with metrics.timer('simulator_notification_seconds', kind='fund_slot_summary'):
+            await send_fund_slot_summary_embed(self.simulator, channel_id, position)
+
+    async def central_summary(self, channel_id, simulation_name, catch_up=False):
+        """
+        Update the central summary of a simulation (throttled).
+
+        catch_up: Read the positions changed without notification first (batch engine).
+        """
+        summary = self.summaries.get(simulation_name)
+        if summary is None:
+            summary = await self.get_summary(channel_id, simulation_name)
+        elif catch_up:
+            await summary.catch_up()
+        summary.request_update()
+
+    async def close(self):
+        for summary in self.summaries.values():
+            await summary.flush()
+        await self.dispatcher.drain()
+
+    async def dispatch(self, notification):
+        """
+        Send a notification received from a QueueNotifier: (method name, *arguments).
+        """
+        method, *arguments = notification
+        await getattr(self, method)(*arguments)
+
+class NullNotifier:
+    """
+    Notifier discarding every notification (benchmarks, runs without Discord).
+    """
+    async def position_opened(self, channel_id, position_id):
+        pass
+
+    async def position_closed(self, channel_id, position_id):
+        pass
+
+    async def central_summary(self, channel_id, simulation_name, catch_up=False):
+        pass
+
+    async def close(self):
+        pass
+
+    async def dispatch(self, notification):
+        method, *arguments = notification
+        await getattr(self, method)(*arguments)
+
+class FileNotifier(NullNotifier):
+    def __init__(self, simulator, path):
+        """
+        Notifier writing the opened / closed positions to a JSON lines file
+        (headless runs). Central summaries are not written.
+
+        simulator: The Simulator (its positions are used).
+        path: Path of the file, appended to.
+        """
+        self.simulator = simulator
+        self.file = open(path, 'a')
+
+    async def write(self, notification, channel_id, position_id):
+        position = await self.simulator.positions.aio.get_position_by_id(position_id)
+        self.file.write(json.dumps({'notification': notification, 'channel_id': channel_id, 'position': position}) + '\n')
+
+    async def position_opened(self, channel_id, position_id):
+        await self.write('position_opened', channel_id, position_id)
+
+    async def position_closed(self, channel_id, position_id):
+        await self.write('position_closed', channel_id, position_id)
+
+    async def close(self):
+        self.file.close()
+
+class QueueNotifier:
+    def __init__(self, queue):
+        """
+        Notifier of a worker process, forwarding every notification to the
+        main process (and its event loop) through a multiprocessing queue.
+
+        queue: multiprocessing queue read by the main process.
+        """
+        self.queue = queue
+
+    async def position_opened(self, channel_id, position_id):
+        self.queue.put(('position_opened', channel_id, position_id))
+
+    async def position_closed(self, channel_id, position_id):
+        self.queue.put(('position_closed', channel_id, position_id))
+
+    async def central_summary(self, channel_id, simulation_name, catch_up=False):
+        self.queue.put(('central_summary', channel_id, simulation_name, catch_up))
+
+    async def close(self):
+        pass
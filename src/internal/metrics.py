@@ -0,0 +1,271 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the metrics of the simulator (counters, histograms and
+# gauges with labels) and their exporter: a local HTTP endpoint in the
+# Prometheus text format and/or a file written periodically. Metrics are
+# disabled unless configured, and then cost a single check per call.
+# =============================================================================
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from loguru import logger
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+DEFAULT_METRICS_INTERVAL = 15  # seconds between two writes of the metrics file
+
+# name -> (type, help, buckets of the histograms)
+DESCRIPTIONS = {
+    'simulator_tick_seconds': ('histogram', "Duration of a run of a simulation (fetch to notifications)", SECONDS_BUCKETS),
+    'simulator_tick_events': ('histogram', "Positions opened or closed by a run of a simulation", COUNT_BUCKETS),
+    'simulator_candles_total': ('counter', "Candles processed", None),
+    'simulator_stage_seconds': ('histogram', "Time spent in each stage of the pipeline (exclusive of nested stages)", SECONDS_BUCKETS),
+    'simulator_db_seconds': ('histogram', "Duration of the Positions methods", SECONDS_BUCKETS),
+    'simulator_fetch_seconds': ('histogram', "Duration of the QTSBE requests, retries included", SECONDS_BUCKETS),
+    'simulator_fetch_errors_total': ('counter', "Failed QTSBE request attempts", None),
+    'simulator_notification_seconds': ('histogram', "Duration of the integ_logs senders", SECONDS_BUCKETS),
+    'simulator_discord_seconds': ('histogram', "Duration of the Discord API calls", SECONDS_BUCKETS),
+    'simulator_discord_embeds_total': ('counter', "Embeds sent to Discord", None),
+    'simulator_discord_queue_depth': ('gauge', "Embeds waiting to be sent to Discord", None),
+    'simulator_lag_seconds': ('gauge', "Seconds between the last processed candle of a simulation and its newest candle", None),
+    'simulator_loop_lag_seconds':('histogram', "Delay of the event loop in waking up a sleeping task", SECONDS_BUCKETS),
+}
+
+current_simulation = ContextVar('current_simulation', default='')  # label of the metrics of a run
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Metrics:
+    def __init__(self):
+        """
+        Registry of the metrics of the process.
+
+        Histograms keep one count per bucket (not cumulative), then the sum
+        and the count of the observations.
+        """
+        self.enabled = False
+        self.lock = threading.Lock()  # the stages also run on the database threads
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.gauges = {}  # name -> callback returning the value
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        buckets = DESCRIPTIONS[name][2]
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the duration of a block of code.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name, callback):
+        """
+        Register a gauge, read from callback() when the metrics are exported
+        (a number, or a dictionary mapping each simulation to its value).
+        """
+        self.gauges[name] = callback
+
+    def take(self):
+        """
+        Take the metrics collected since the last call (worker processes send
+        them to the main process, see merge).
+        """
+        with self.lock:
+            snapshot = (self.counters, self.histograms)
+            self.counters, self.histograms = {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        counters, histograms = snapshot
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, values in histograms.items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    self.histograms[key] = list(values)
+                else:
+                    self.histograms[key] = [a + b for a, b in zip(histogram, values)]
+
+    def render(self):
+        """
+        return: The metrics in the Prometheus text format.
+        """
+        with self.lock:
+            counters, histograms = dict(self.counters), {key: list(values) for key, values in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in DESCRIPTIONS.items():
+            if kind == 'gauge':
+                if name not in self.gauges:
+                    continue
+                value = self.gauges[name]()
+                if isinstance(value, dict):  # one series per simulation
+                    series = [f"{name}{format_labels([('simulation', label)])} {value[label]}" for label in sorted(value)]
+                else:
+                    series = [f"{name} {value}"]
+            elif kind == 'counter':
+                series = [f"{name}{format_labels(key)} {value}"
+                          for (metric, key), value in sorted(counters.items()) if metric == name]
+            else:
+                series = []
+                for (metric, key), values in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ['+Inf'], values):
+                        cumulative += count
+                        series.append(f"{name}_bucket{format_labels(key, [('le', bound)])} {cumulative}")
+                    series.append(f"{name}_sum{format_labels(key)} {values[-2]}")
+                    series.append(f"{name}_count{format_labels(key)} {values[-1]}")
+            if series:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + series
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Write the metrics to a file, atomically.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+metrics = Metrics()
+
+def configure_metrics(bot_config):
+    """
+    Enable the metrics if an exporter is configured in configs/discord_bot.json
+    ("metrics_port" and/or "metrics_file").
+    """
+    metrics.enabled = bool(bot_config.get("metrics_port") or bot_config.get("metrics_file"))
+    return metrics.enabled
+
+def timed_methods(metric):
+    """
+    Class decorator observing the duration of every public method in metric
+    (label 'method').
+    """
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if callable(method) and not name.startswith('_'):
+                setattr(cls, name, timed(method, metric, name))
+        return cls
+    return decorate
+
+def timed(method, metric, name):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return method(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.observe(metric, time.perf_counter() - started, method=name)
+    return wrapper
+
+class MetricsExporter:
+    def __init__(self, bot_config):
+        """
+        Exporter of the metrics of the main process.
+
+        bot_config: Content of configs/discord_bot.json: "metrics_port" (HTTP
+                    endpoint on 127.0.0.1, /metrics), "metrics_host" (to listen
+                    on another interface), "metrics_file" and "metrics_interval"
+                    (seconds between two writes of the file).
+        """
+        self.port = int(bot_config.get("metrics_port") or 0)
+        self.host = bot_config.get("metrics_host", "127.0.0.1")
+        self.path = bot_config.get("metrics_file")
+        self.interval = float(bot_config.get("metrics_interval", DEFAULT_METRICS_INTERVAL))
+        self.runner = None
+        self.tasks = []
+
+    async def start(self):
+        if not metrics.enabled:
+            return
+        if self.port:
+            from aiohttp import web
+
+            async def handle(request):
+                return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+            app = web.Application()
+            app.router.add_get('/metrics', handle)
+            self.runner = web.AppRunner(app, access_log=None)
+            await self.runner.setup()
+            await web.TCPSite(self.runner, self.host, self.port).start()
+            logger.info(f"Metrics on http://{self.host}:{self.port}/metrics")
+        if self.path:
+            self.tasks.append(asyncio.create_task(self.write_periodically()))
+        self.tasks.append(asyncio.create_task(self.measure_loop_lag()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.path:
+            metrics.dump(self.path)
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def write_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                metrics.dump(self.path)
+            except OSError as e:
+                logger.error(f"Failed to write the metrics to {self.path}: {e}")
+
+    async def measure_loop_lag(self, period=0.5):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(period)
+            metrics.observe('simulator_loop_lag_seconds', max(0.0, loop.time() - started - period))
@@ -1,27 +1,50 @@
 import configparser
 import os
 
+class InternalStore:
+    def __init__(self, ini_path='ini/internal.ini'):
+        """
+        Internal state of the simulator (e.g., the central message of each
+        simulation), read once and kept in memory. The file is only written
+        when a value changes, atomically (a crash never leaves it truncated).
+        """
+        self.ini_path = ini_path
+        self.config = None
+
+    def load(self):
+        if self.config is None:
+            self.config = configparser.ConfigParser()
+            self.config.read(self.ini_path)
+        return self.config
+
+    def get(self, section, key, fallback=None):
+        return self.load().get(section, key, fallback=fallback)
+
+    def set(self, section, key, value):
+        config = self.load()
+        if config.get(section, key, fallback=None) == str(value):
+            return
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, key, str(value))
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.ini_path}.tmp"
+        with open(tmp_path, 'w') as configfile:
+            self.load().write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())
+        os.replace(tmp_path, self.ini_path)
+
+internal_store = InternalStore()
+
 def ensure_internal_ini():
-    ini_path = 'ini/internal.ini'
-    if not os.path.exists(ini_path):
-        config = configparser.ConfigParser()
-        config.read_dict({})
-        with open(ini_path, 'w') as configfile:
-            config.write(configfile)
+    if not os.path.exists(internal_store.ini_path):
+        internal_store.save()
 
 def read_simulation_data(simulation_name):
-    ini_path = 'ini/internal.ini'
-    config = configparser.ConfigParser()
-    config.read(ini_path)
-    central_message_id = config.getint(simulation_name, 'central_message_id', fallback=0)
-    return central_message_id
+    return int(internal_store.get(simulation_name, 'central_message_id', fallback=0))
 
 def write_simulation_data(simulation_name, central_message_id):
-    ini_path = 'ini/internal.ini'
-    config = configparser.ConfigParser()
-    config.read(ini_path)
-    if not config.has_section(simulation_name):
-        config.add_section(simulation_name)
-    config.set(simulation_name, 'central_message_id', str(central_message_id))
-    with open(ini_path, 'w') as configfile:
-        config.write(configfile)
\ No newline at end of file
+    internal_store.set(simulation_name, 'central_message_id', central_message_id)
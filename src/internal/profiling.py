@@ -0,0 +1,206 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the strategy profiler of the -profile mode: it times
+# every buy_signal, sell_signal and Indicators call by strategy and pair,
+# warns about the calls over the per-candle time budget, and samples the
+# stacks of the running strategy code into collapsed stacks (the input of
+# flamegraph tools), one report per strategy.
+# =============================================================================
+
+import os
+import sys
+import threading
+import time
+from array import array
+from loguru import logger
+
+DEFAULT_CANDLE_BUDGET = 1.0  # milliseconds of strategy code per candle of a pair
+SAMPLE_INTERVAL = 0.005  # seconds between two samples of the stacks
+PERCENTILES = (50, 90, 99)
+PROFILED_FUNCTIONS = ('Indicators', 'buy_signal', 'sell_signal')
+
+def percentile(values, p):
+    """
+    return: The p-th percentile (nearest rank) of sorted values.
+    """
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+class StrategyProfiler:
+    def __init__(self):
+        """
+        Profiler of the strategies, disabled until started (-profile).
+        """
+        self.enabled = False
+        self.budget = DEFAULT_CANDLE_BUDGET / 1000  # seconds
+        self.interval = SAMPLE_INTERVAL
+        self.lock = threading.Lock()  # the batch engine calls the strategies on an executor thread
+        self.durations = {}  # (strategy, function, pair) -> array('d') of the call durations
+        self.over_budget = {}  # (strategy, function, pair) -> calls over the budget
+        self.stacks = {}  # strategy -> {collapsed stack: samples}
+        self.active = {}  # thread id -> (strategy, function) of the strategy code running on it
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    def start(self, budget=DEFAULT_CANDLE_BUDGET, interval=SAMPLE_INTERVAL):
+        """
+        Enable the profiler and start the sampling thread.
+
+        budget: Time budget of the strategy code per candle of a pair, in milliseconds.
+        interval: Seconds between two samples of the stacks.
+        """
+        self.enabled = True
+        self.budget = budget / 1000
+        self.interval = interval
+        self.stopping.clear()
+        self.sampler = threading.Thread(target=self.sample, name="strategy-sampler", daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.enabled = False
+        self.stopping.set()
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+
+    def wrap(self, strategy_name, strategy, pairs_list, data):
+        """
+        Time the functions of a strategy for a run of a simulation.
+
+        strategy_name: Name of the strategy.
+        strategy: The strategy dictionary (see StrategyLoader).
+        pairs_list: Pairs of the simulation.
+        data: Payloads of the pairs, in the order of pairs_list (None for missing pairs).
+
+        return: A copy of the strategy dictionary whose functions are timed. The
+                pair of a call is found from the candles it receives.
+        """
+        pairs = {id(pair_data['data']): pair_name for pair_name, pair_data in zip(pairs_list, data) if pair_data is not None}
+        profiled = dict(strategy)
+        for function in PROFILED_FUNCTIONS:
+            profiled[function] = self.timed(strategy_name, function, strategy[function], pairs)
+        return profiled
+
+    def timed(self, strategy_name, function, func, pairs):
+        data_position = 0 if function == 'Indicators' else 1  # Indicators(data), *_signal(pos, data, index, indicators)
+
+        def wrapper(*args):
+            data = args[data_position]
+            candles = len(data) if function == 'Indicators' else 1  # the indicators cover the whole history
+            return self.call((strategy_name, function, pairs.get(id(data), '?')), candles, func, args)
+        return wrapper
+
+    def call(self, key, candles, func, args):
+        thread_id = threading.get_ident()
+        previous = self.active.get(thread_id)
+        self.active[thread_id] = key[:2]  # read by the sampler
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            if previous is None:
+                del self.active[thread_id]
+            else:
+                self.active[thread_id] = previous
+            self.record(key, elapsed, candles)
+
+    def record(self, key, elapsed, candles):
+        over = elapsed > self.budget * candles
+        with self.lock:
+            durations = self.durations.get(key)
+            if durations is None:
+                durations = self.durations[key] = array('d')
+            durations.append(elapsed)
+            if over:
+                first = key not in self.over_budget
+                self.over_budget[key] = self.over_budget.get(key, 0) + 1
+        if over and first:  # once per strategy, function and pair, the report counts the others
+            strategy_name, function, pair = key
+            logger.warning(f"Strategy '{strategy_name}' is over its budget: {function} took {1000 * elapsed:.2f} ms "
+                           f"for {candles} candle(s) of {pair} (budget {1000 * self.budget:.2f} ms per candle)")
+
+    def sample(self):
+        """
+        Sampling thread: collapse the stack of every thread running strategy
+        code, from the profiled function down to the running frame.
+        """
+        stop_code = StrategyProfiler.call.__code__
+        while not self.stopping.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, (strategy_name, function) in list(self.active.items()):
+                frame = frames.get(thread_id)
+                names = []
+                while frame is not None and frame.f_code is not stop_code:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if frame is None:
+                    continue  # the call returned while the stacks were read
+                names.append(function)
+                stack = ';'.join(reversed(names))  # root first
+                with self.lock:
+                    stacks = self.stacks.setdefault(strategy_name, {})
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+    def report(self, strategy_name):
+        """
+        return: List of dictionaries, one per function and pair of the strategy,
+                durations in milliseconds.
+        """
+        with self.lock:
+            entries = [(key, sorted(durations), self.over_budget.get(key, 0))
+                       for key, durations in self.durations.items() if key[0] == strategy_name]
+        rows = []
+        for (_, function, pair), durations, over in sorted(entries, key=lambda entry: -sum(entry[1])):
+            total = sum(durations)
+            row = {'function': function, 'pair': pair, 'calls': len(durations), 'total': 1000 * total,
+                   'mean': 1000 * total / len(durations), 'max': 1000 * durations[-1], 'over_budget': over}
+            for p in PERCENTILES:
+                row[f'p{p}'] = 1000 * percentile(durations, p)
+            rows.append(row)
+        return rows
+
+    def strategies(self):
+        with self.lock:
+            return sorted({key[0] for key in self.durations} | set(self.stacks))
+
+    def format_report(self, strategy_name):
+        """
+        Format the report of a strategy as a text table.
+        """
+        from src.simulation.backtest import format_table
+        header = ("Function", "Pair", "Calls", "Total ms", "Mean ms") + tuple(f"p{p} ms" for p in PERCENTILES) + ("Max ms", "Over budget")
+        rows = [(row['function'], row['pair'], str(row['calls']), f"{row['total']:.1f}", f"{row['mean']:.3f}")
+                + tuple(f"{row[f'p{p}']:.3f}" for p in PERCENTILES) + (f"{row['max']:.3f}", str(row['over_budget']))
+                for row in self.report(strategy_name)]
+        return f"Strategy '{strategy_name}' (budget {1000 * self.budget:.2f} ms per candle)\n" + format_table(header, rows)
+
+    def write(self, folder):
+        """
+        Write the reports of every profiled strategy to folder: STRATEGY.txt
+        (timings) and STRATEGY.collapsed (sampled stacks, 'frame;frame;frame count'
+        lines for flamegraph.pl or speedscope).
+
+        return: Paths of the files written.
+        """
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for strategy_name in self.strategies():
+            path = os.path.join(folder, f"{strategy_name}.txt")
+            with open(path, 'w') as f:
+                f.write(self.format_report(strategy_name) + "\n")
+            paths.append(path)
+            with self.lock:
+                stacks = dict(self.stacks.get(strategy_name, {}))
+            path = os.path.join(folder, f"{strategy_name}.collapsed")
+            with open(path, 'w') as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+            paths.append(path)
+        return paths
+
+profiler = StrategyProfiler()
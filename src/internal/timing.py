@@ -0,0 +1,56 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the stage timers of the simulation pipeline (fetch,
+# index, indicators, signals, db, notify). Nested stages are exclusive: the
+# time of an inner stage is not counted in the outer one. The stages are also
+# observed by the metrics (simulator_stage_seconds) when they are enabled.
+# =============================================================================
+
+import threading
+import time
+from contextlib import contextmanager
+from src.internal.metrics import metrics, current_simulation
+
+stage_times = {}  # stage name -> seconds
+stage_calls = {}  # stage name -> number of times the stage ran
+_lock = threading.Lock()
+_local = threading.local()  # stack of the running stages of each thread
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of code as a stage of the pipeline.
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    frame = [time.perf_counter(), 0.0]  # start, time spent in nested stages
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        stack.pop()
+        elapsed = time.perf_counter() - frame[0]
+        if stack:
+            stack[-1][1] += elapsed
+        with _lock:
+            stage_times[name] = stage_times.get(name, 0.0) + elapsed - frame[1]
+            stage_calls[name] = stage_calls.get(name, 0) + 1
+        metrics.observe('simulator_stage_seconds', elapsed - frame[1], stage=name, simulation=current_simulation.get())
+
+def get_stages():
+    """
+    return: Dictionary mapping each stage name to a (seconds, calls) tuple.
+    """
+    with _lock:
+        return {name: (stage_times[name], stage_calls[name]) for name in stage_times}
+
+def reset_stages():
+    with _lock:
+        stage_times.clear()
+        stage_calls.clear()
@@ -0,0 +1,113 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the headless backtest mode: the simulations run once, at
+# full speed and without Discord, then their results are printed as a table
+# (python simulator.py backtest, see README.md).
+# =============================================================================
+
+from datetime import datetime
+from src.api.fetch import close_session
+from src.discord.configs import simulation_settings
+
+def select_simulations(simulations_config, names=None, engine=None, offline=False):
+    """
+    Select the simulations of a backtest.
+
+    simulations_config: Dictionary of the simulations (configs/simulations.json).
+    names: Names of the simulations to run, all of them by default.
+    engine: Engine forced on every simulation ('step' or 'batch'), optional. By
+            default, the simulations whose end_ts is in the past (pure backtests)
+            run on the batch engine unless their configuration sets api.engine.
+    offline: Only use the stored candles (no QTSBE requests).
+
+    return: Dictionary of the selected simulations (copies of their configs).
+    """
+    unknown = [name for name in names or () if name not in simulations_config]
+    if unknown:
+        raise KeyError(f"Unknown simulation(s): {', '.join(unknown)}")
+    selected = {}
+    for name in names or simulations_config:
+        simulation = dict(simulations_config[name], api=dict(simulations_config[name]['api']))
+        if engine:
+            simulation['api']['engine'] = engine
+        elif not simulation['api'].get('engine') and is_past(simulation['api'].get('end_ts')):
+            simulation['api']['engine'] = 'batch'
+        if offline:
+            simulation['api']['offline'] = "True"
+        selected[name] = simulation
+    return selected
+
+def is_past(end_ts):
+    """
+    return: True if end_ts ('YYYY-MM-DD HH:MM:SS', optional) is in the past.
+    """
+    return bool(end_ts) and datetime.strptime(end_ts, "%Y-%m-%d %H:%M:%S") < datetime.now()
+
+async def backtest(simulator, simulations_config):
+    """
+    Run the simulations once (in the worker processes of simulator.pool if any).
+    """
+    from src.simulation.simulates import simulates
+    try:
+        if simulator.pool is not None:
+            await simulator.pool.run(simulations_config)
+        else:
+            await simulates(simulator, simulations_config)
+    finally:
+        await simulator.stop()
+        await close_session()
+
+def get_results(simulator, simulations_config):
+    """
+    Get the results of the simulations from their fund slot stats.
+
+    return: List of dictionaries, one per simulation.
+    """
+    results = []
+    for name, simulation in simulations_config.items():
+        slots = simulator.positions.get_fund_slot_stats(name)
+        trades = sum(slot['trades'] for slot in slots)
+        wins = sum(round(slot['win_rate'] * slot['trades']) for slot in slots if slot['trades'])
+        invested = simulation_settings(simulation).invest_capital
+        capital = sum(slot['capital'] or 0.0 for slot in slots)
+        results.append({
+            'simulation': name,
+            'trades': trades,
+            'open': sum(slot['open_position_id'] is not None for slot in slots),
+            'win_rate': wins / trades if trades else None,
+            'invested': invested,
+            'capital': capital,
+            'return': capital / invested - 1 if invested else None,
+        })
+    return results
+
+def format_results(results):
+    """
+    Format the results as a text table (capital is the realized one: open
+    positions count at their buy value).
+    """
+    header = ("Simulation", "Trades", "Open", "Win rate", "Invested", "Capital", "Return")
+    return format_table(header, [(
+        result['simulation'],
+        str(result['trades']),
+        str(result['open']),
+        f"{100 * result['win_rate']:.1f}%" if result['win_rate'] is not None else "-",
+        f"{result['invested']:.2f}",
+        f"{result['capital']:.2f}",
+        f"{100 * result['return']:+.2f}%" if result['return'] is not None else "-",
+    ) for result in results])
+
+def format_table(header, rows):
+    """
+    Format rows of strings as a text table, the first column aligned left.
+    """
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths)))
+             for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
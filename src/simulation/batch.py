@@ -0,0 +1,187 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the batch engine, used for historical ranges. It loads
+# the candles of every pair in NumPy arrays, evaluates the vectorized signals
+# of the strategy when it provides them, and allocates the fund slots in a
+# single pass over all the candles (off the database writer thread), without
+# Discord notifications.
+# =============================================================================
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import time
+import numpy as np
+from loguru import logger
+from src.internal.timing import stage
+
+def vectorized_signals(signals_func, data, indicators):
+    """
+    Evaluate a vectorized signals function of a strategy over a whole pair.
+
+    signals_func: The strategy's buy_signals / sell_signals function, or None.
+    data: OHLCVFrame of the pair.
+    indicators: Indicators of the pair.
+
+    return: Tuple of (signals, prices) arrays, or None if the strategy has no such function.
+    """
+    if signals_func is None:
+        return None
+    signals, prices = signals_func(data.arrays(), indicators)
+    return np.asarray(signals), np.asarray(prices, dtype=np.float64)
+
+def candles_order(run):
+    """
+    Get the new candles of every pair in the order the step engine processes
+    them: by date, then by position of the pair in the pairs_list.
+
+    return: Tuple of (pair positions, candle indexes, epochs) arrays.
+    """
+    first_date, last_date = run.dates[0], run.dates[-1]
+    epochs, pair_positions, indexes = [], [], []
+    for position, (pair_name, pair_data) in enumerate(zip(run.pairs_list, run.data)):
+        if pair_data is None:
+            continue
+        pair_epochs = np.frombuffer(run.timeline.pairs[pair_name], dtype=np.int64)
+        last_epoch = run.last_epochs[pair_name]
+        lo = np.searchsorted(pair_epochs, first_date, side='left')
+        if last_epoch is not None:
+            lo = max(lo, np.searchsorted(pair_epochs, last_epoch, side='right'))
+        closed_epoch = run.closed_epochs[pair_name]  # the candles after it are still forming
+        hi = np.searchsorted(pair_epochs, last_date if closed_epoch is None else min(last_date, closed_epoch), side='right')
+        if lo >= hi:
+            continue
+        epochs.append(pair_epochs[lo:hi])
+        pair_positions.append(np.full(hi - lo, position))
+        indexes.append(np.arange(lo, hi))
+    if not epochs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    epochs, pair_positions, indexes = np.concatenate(epochs), np.concatenate(pair_positions), np.concatenate(indexes)
+    order = np.lexsort((pair_positions, epochs))
+    return pair_positions[order], indexes[order], epochs[order]
+
+def in_context(func, *args):
+    """
+    return: func(*args) bound to a copy of the current context (labels of the metrics), for an executor.
+    """
+    return functools.partial(contextvars.copy_context().run, func, *args)
+
+async def batch_simulation(simulator, run, deadline=None):
+    """
+    Process the new candles of a simulation in a single pass.
+
+    Trades are the same as the step engine's on the same input: for each
+    candle, open positions of the pair are checked for a sell first, then a
+    buy is checked if a fund slot is free.
+
+    The signals and the allocation run in the default executor, only the
+    flushes of the portfolio run on the database writer thread, so the other
+    writes don't wait for the whole pass.
+
+    run: SimulationRun of the simulation (see src/simulation/simulates.py).
+    deadline: time.monotonic() after which no new date is started (at least
+              one date is processed), None to process every candle.
+
+    return: The number of dates processed.
+    """
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    allocator = await loop.run_in_executor(None, in_context(BatchAllocator, run))
+    while not await loop.run_in_executor(None, in_context(allocator.allocate, deadline)):
+        await simulator.db_manager.write(run.portfolio.flush)
+    await simulator.db_manager.write(run.portfolio.flush)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Batch engine: {run.simulation_name}, {allocator.next} candles, {allocator.trades} trades "
+                f"in {elapsed:.3f}s ({allocator.next / max(elapsed, 1e-9):.0f} candles/s)")
+    return allocator.processed_dates()
+
+class BatchAllocator:
+    def __init__(self, run):
+        """
+        Order the new candles of a run and evaluate the vectorized signals of its pairs.
+
+        run: SimulationRun of the simulation.
+        """
+        self.run = run
+        with stage('index'):
+            pair_positions, indexes, epochs = candles_order(run)
+        self.pair_positions, self.indexes, self.epochs = pair_positions.tolist(), indexes.tolist(), epochs.tolist()
+        self.next = 0  # next candle to process
+        self.trades = 0
+        self.buys, self.sells = {}, {}
+        strategy = run.strategy
+        with stage('signals'):
+            for position, (pair_name, pair_data) in enumerate(zip(run.pairs_list, run.data)):
+                if pair_data is not None:
+                    indicators = run.indicators_by_pair[pair_name]
+                    self.buys[position] = vectorized_signals(strategy['buy_signals'], pair_data['data'], indicators)
+                    self.sells[position] = vectorized_signals(strategy['sell_signals'], pair_data['data'], indicators)
+
+    def processed_dates(self):
+        """
+        return: The number of dates of the run processed so far (every date once
+                every candle is processed).
+        """
+        if self.next == len(self.indexes):
+            return len(self.run.dates)
+        return bisect.bisect_right(self.run.dates, self.epochs[self.next - 1]) if self.next else 0
+
+    def allocate(self, deadline=None):
+        """
+        Evaluate the signals of the candles (in order, from the next one) and
+        open / close the positions, until flush_every events are pending.
+
+        deadline: time.monotonic() after which no new date is started, None to
+                  process every candle.
+
+        return: True if every candle is processed or the deadline passed, False
+                if the pending events must be flushed first.
+        """
+        run = self.run
+        portfolio = run.portfolio
+        strategy = run.strategy
+        buys, sells = self.buys, self.sells
+        with stage('signals'):
+            while self.next < len(self.indexes):
+                if portfolio.needs_flush():
+                    return False
+                if (deadline is not None and self.next and self.epochs[self.next] != self.epochs[self.next - 1]
+                        and time.monotonic() >= deadline):
+                    return True  # the next work unit resumes from the cursors
+                position, index = self.pair_positions[self.next], self.indexes[self.next]
+                self.next += 1
+                pair_name = run.pairs_list[position]
+                pair_data = run.data[position]['data']
+                indicators = run.indicators_by_pair[pair_name]
+                candle_date = pair_data.date(index)
+                portfolio.advance(pair_name, candle_date)
+
+                open_positions = portfolio.open_positions.get(pair_name)
+                buy = buys[position]
+                if not open_positions and (not portfolio.free_slots or (buy is not None and buy[0][index] <= 0)):
+                    continue  # nothing can happen on this candle
+
+                sell = sells[position]
+                for pos in list(open_positions or ()):
+                    if sell is not None:
+                        sell_signal, sell_price = sell[0][index].item(), sell[1][index].item()
+                    else:
+                        sell_signal, sell_price = strategy['sell_signal'](pos, pair_data, index, indicators)
+                    if sell_signal > 0:
+                        portfolio.close_position(pos, candle_date, sell_price, index, sell_signal)
+                        self.trades += 1
+                if portfolio.has_free_fund_slot():
+                    if buy is not None:
+                        buy_signal, buy_price = buy[0][index].item(), buy[1][index].item()
+                    else:
+                        buy_signal, buy_price = strategy['buy_signal'](None, pair_data, index, indicators)
+                    if buy_signal > 0:
+                        portfolio.open_position(pair_name, candle_date, buy_price, index, buy_signal)
+                        self.trades += 1
+        return True
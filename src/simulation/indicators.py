@@ -0,0 +1,80 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the IndicatorsCache class, which keeps the indicators of
+# every (strategy, pair) so they are built once per fetched dataset instead of
+# once per date of the simulation loop.
+# =============================================================================
+
+from loguru import logger
+
+def data_fingerprint(data):
+    """
+    Compute a cheap fingerprint of the OHLCV rows of a pair.
+
+    Candles are only ever appended (and the last one may still be moving),
+    so the length, the first date and the whole last row identify the dataset.
+
+    data: List of OHLCV rows as returned by the API.
+
+    return: A hashable fingerprint.
+    """
+    if not data:
+        return (0, None, None)
+    return (len(data), data[0][0], tuple(data[-1]))
+
+class IndicatorsCache:
+    def __init__(self):
+        """
+        Initialize the indicators cache.
+
+        Entries are keyed by (strategy_name, pair_name) and hold the version of
+        the strategy and the fingerprint of the data they were built from, so a
+        pair receiving new candles only rebuilds its own entry.
+        """
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, strategy_name, indicators_class, pair_name, data, version=None):
+        """
+        Get the indicators of a pair, building them only if the data changed.
+
+        strategy_name: Name of the strategy (key of the strategies dict).
+        indicators_class: The Indicators class of the strategy.
+        pair_name: The trading pair (e.g., 'Binance_BTCUSDT_1d').
+        data: List of OHLCV rows of the pair.
+        version: Version of the strategy, indicators of another version are rebuilt.
+
+        return: The indicators of the strategy for this pair.
+        """
+        key = (strategy_name, pair_name)
+        fingerprint = (version, data_fingerprint(data))
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        indicators = indicators_class(data).indicators
+        self.entries[key] = (fingerprint, indicators)
+        logger.debug(f"Built indicators for {pair_name} ({strategy_name}), {len(data)} candles")
+        return indicators
+
+    def invalidate(self, strategy_name=None, pair_name=None):
+        """
+        Drop cached entries matching the given strategy and/or pair (all if none given).
+        """
+        for key in list(self.entries):
+            if (strategy_name is None or key[0] == strategy_name) and (pair_name is None or key[1] == pair_name):
+                del self.entries[key]
+
+    def stats(self):
+        """
+        return: Dictionary with the hits, misses and number of cached entries.
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -0,0 +1,166 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the SimulationPool class, which runs the simulations in
+# worker processes. Each simulation always runs in the same worker (its
+# shard) so the worker keeps its caches warm between loop iterations. Workers
+# write to the database through their own connection (WAL mode) and send
+# their notifications back to the main event loop through a queue.
+# =============================================================================
+
+import asyncio
+import multiprocessing
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from src.internal.metrics import metrics
+
+# state of a worker process, set by init_worker
+worker_simulator = None
+worker_loop = None
+
+def init_worker(db_path, bot_config, queue, log_file, log_level):
+    """
+    Initialize a worker process: its Simulator (forwarding notifications to
+    the queue) and the event loop reused by every simulation it runs.
+    """
+    global worker_simulator, worker_loop
+    from src.simulation.simulator import Simulator
+    from src.discord.notifier import QueueNotifier
+    if log_file:
+        logger.add(log_file, level=log_level)
+    worker_simulator = Simulator(None, bot_config, db_path, notifier=QueueNotifier(queue))
+    worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(worker_loop)
+
+def run_in_worker(simulation_name, simulation, pairs_to_fetch=None, budget=None):
+    """
+    Run a single simulation in the worker process.
+
+    return: Tuple of (dates left and lag of the simulation, see simulate;
+            metrics of the run to merge into the metrics of the main process, or None).
+    """
+    from src.simulation.simulates import simulate
+    progress = worker_loop.run_until_complete(simulate(worker_simulator, simulation_name, simulation, pairs_to_fetch, budget))
+    return progress, metrics.take() if metrics.enabled else None
+
+def save_snapshots_in_worker():
+    from src.simulation.simulates import save_snapshots
+    worker_loop.run_until_complete(save_snapshots(worker_simulator))
+
+def reset_in_worker(simulation_name):
+    from src.simulation.simulates import reset_simulation
+    reset_simulation(simulation_name)
+
+class SimulationPool:
+    def __init__(self, simulator, workers, log_file=None, log_level="INFO"):
+        """
+        Initialize the pool of worker processes.
+
+        simulator: The Simulator of the main process, whose notifier sends the
+                   notifications of the workers.
+        workers: Number of worker processes (shards).
+        log_file: Log file the workers also write to.
+        log_level: Log level of the workers.
+        """
+        self.simulator = simulator
+        context = multiprocessing.get_context("spawn")  # don't fork the Discord client and its threads
+        self.queue = context.Queue()
+        self.shards = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=init_worker,
+                                initargs=(simulator.db_path, simulator.bot_config, self.queue, log_file, log_level))
+            for _ in range(workers)
+        ]
+        self.drain_task = None
+
+    def get_shard(self, simulation_name):
+        """
+        Get the worker of a simulation (stable across loop iterations and restarts).
+        """
+        return self.shards[zlib.crc32(simulation_name.encode()) % len(self.shards)]
+
+    async def drain(self):
+        """
+        Send the notifications of the workers from the main event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            notification = await loop.run_in_executor(None, self.queue.get)
+            if notification is None:
+                return
+            try:
+                await self.simulator.notifier.dispatch(notification)
+            except Exception as e:
+                logger.error(f"Failed to send notification {notification}: {e}")
+
+    async def run(self, simulations_config, due_pairs=None):
+        """
+        Run every simulation in its worker and wait for all of them.
+
+        simulations_config: Dictionary of the simulations (configs/simulations.json).
+        due_pairs: Dictionary mapping simulation names to the pairs to fetch, all of them by default.
+        """
+        loop = asyncio.get_running_loop()
+        if self.drain_task is None:
+            self.drain_task = asyncio.create_task(self.drain())
+        names = list(simulations_config)
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.get_shard(name), run_in_worker, name, simulations_config[name],
+                                 (due_pairs or {}).get(name))
+            for name in names
+        ), return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Simulation {name} failed in its worker: {result!r}")
+            elif result[1] is not None:
+                metrics.merge(result[1])
+
+    async def run_unit(self, simulation_name, simulation, pairs_to_fetch, budget):
+        """
+        Run a work unit of a simulation in its worker (see WorkQueue).
+
+        return: Tuple of (dates left to process, lag in seconds), see simulate.
+        """
+        if self.drain_task is None:
+            self.drain_task = asyncio.create_task(self.drain())
+        progress, snapshot = await asyncio.get_running_loop().run_in_executor(
+            self.get_shard(simulation_name), run_in_worker, simulation_name, simulation, pairs_to_fetch, budget)
+        if snapshot is not None:
+            metrics.merge(snapshot)
+        return progress
+
+    def reset(self, simulation_name):
+        """
+        Forget the state of a simulation in its worker, before its next run
+        (the worker runs its tasks in order).
+        """
+        self.get_shard(simulation_name).submit(reset_in_worker, simulation_name)
+
+    async def stop(self):
+        """
+        Checkpoint the simulations of the workers, send the notifications left
+        in the queue, then stop the drain (before the event loop closes: the
+        drain waits on the queue in a thread).
+        """
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(shard, save_snapshots_in_worker) for shard in self.shards),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to write the snapshots of a worker: {result!r}")
+        if self.drain_task is not None:
+            self.queue.put(None)
+            await self.drain_task
+            self.drain_task = None
+
+    def close(self):
+        """
+        Stop the workers and the notifications drain.
+        """
+        self.queue.put(None)
+        for shard in self.shards:
+            shard.shutdown(wait=True, cancel_futures=True)
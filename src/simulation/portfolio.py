@@ -0,0 +1,211 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the Portfolio class, the in-memory state of a simulation
+# (open positions, free fund slots, capital of each slot). Changes are written
+# behind to the database in batches through Positions, and are appended to a
+# journal first so they can be replayed after a crash. It can also be
+# restored from a snapshot (see src/simulation/snapshots.py).
+# =============================================================================
+
+import heapq
+import json
+import os
+from datetime import datetime
+from loguru import logger
+from src.internal.timing import stage
+
+class Portfolio:
+    def __init__(self, positions, cursors, simulation_name, max_fund_slots, journal_dir='journal', flush_every=500, snapshot=None):
+        """
+        Initialize the portfolio of a simulation and load its state from the
+        database, or from a snapshot still matching the database.
+
+        positions: Positions instance used as persistence layer.
+        cursors: Cursors instance, cursors are flushed along with the positions.
+        simulation_name: The name of the simulation.
+        max_fund_slots: Number of fund slots of the simulation.
+        journal_dir: Folder of the journals of pending events.
+        flush_every: Number of pending events after which the batch engine flushes them.
+        snapshot: State of a snapshot of the simulation (see SnapshotStore.load), optional.
+        """
+        self.positions = positions
+        self.cursors = cursors
+        self.simulation_name = simulation_name
+        self.max_fund_slots = max_fund_slots
+        self.flush_every = flush_every
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(journal_dir, f"{simulation_name}.jsonl")
+        self.journal = None
+        self.pending = []  # events not flushed yet
+        self.events_count = 0  # positions opened or closed by this portfolio
+        self.pending_cursors = {}  # pair -> date of the last processed candle, not flushed yet
+        self.pending_positions = {}  # (pair, buy_index) -> position opened but not flushed yet
+        self.replay_journal()
+        self.restored = snapshot is not None and self.restore(snapshot)
+        if not self.restored:
+            self.load()
+
+    def load(self):
+        """
+        Load the open positions and the capital of each fund slot from the database.
+        """
+        self.open_positions = {}  # pair -> list of open positions (dicts, same keys as the positions table)
+        for position in self.positions.get_open_positions(self.simulation_name):
+            self.open_positions.setdefault(position['pair'], []).append(position)
+        used_slots = {position['fund_slot'] for pair_positions in self.open_positions.values() for position in pair_positions}
+        self.free_slots = [slot for slot in range(1, self.max_fund_slots + 1) if slot not in used_slots]
+        heapq.heapify(self.free_slots)
+        self.capital = self.positions.get_capital_by_fund_slot(self.simulation_name)
+
+    def snapshot(self):
+        """
+        return: A copy of the state of the portfolio, once flushed (see restore).
+        """
+        open_positions = {pair: [dict(position) for position in positions] for pair, positions in self.open_positions.items()}
+        return {'open_positions': open_positions, 'free_slots': list(self.free_slots), 'capital': self.capital}
+
+    def restore(self, state):
+        """
+        Restore the state of a snapshot, if the database is still where the
+        snapshot left it (same cursors: no candle was processed since).
+
+        return: True if the state was restored.
+        """
+        if state['cursors'] != self.cursors.get_cursors(self.simulation_name):
+            logger.warning(f"The snapshot of simulation {self.simulation_name} is older than the database, loading it from the database")
+            return False
+        self.open_positions = state['open_positions']
+        self.free_slots = list(state['free_slots'])
+        heapq.heapify(self.free_slots)
+        self.capital = state['capital']
+        return True
+
+    def replay_journal(self):
+        """
+        Write to the database the events of a journal left by a crash, then clear it.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'r') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        if events:
+            logger.warning(f"Replaying {len(events)} journaled events for simulation {self.simulation_name}")
+            # each pair was processed at least up to the candle of its last event
+            last_dates = {}
+            for event in events:
+                date = event['sell_date'] if event['event'] == 'close' else event['buy_date']
+                last_dates[event['pair']] = max(date, last_dates.get(event['pair'], date))
+            self.write(events, last_dates, replay=True)
+        os.remove(self.journal_path)
+
+    def record(self, event):
+        """
+        Append an event to the journal and to the pending events.
+        """
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a')
+        self.journal.write(json.dumps(event) + '\n')
+        self.journal.flush()  # hand it to the OS so it survives a crash of the process
+        self.pending.append(event)
+        self.events_count += 1
+
+    def write(self, events, last_dates, replay=False):
+        """
+        Write events and cursors to the database in a single transaction.
+
+        return: Dictionary mapping (pair, buy_index) to the ID of each opened position.
+        """
+        with self.positions.db_manager.transaction():
+            ids = self.positions.apply_events(self.simulation_name, events, replay=replay)
+            self.cursors.update_cursors(self.simulation_name, last_dates)
+        return ids
+
+    def flush(self):
+        """
+        Write the pending events to the database, then clear the journal.
+        Opened positions get their database ID.
+        """
+        if not self.pending and not self.pending_cursors:
+            return
+        with stage('db'):
+            ids = self.write(self.pending, self.pending_cursors)
+        for key, position_id in ids.items():
+            position = self.pending_positions.pop(key, None)
+            if position is not None:
+                position['id'] = position_id
+        self.pending = []
+        self.pending_positions = {}
+        self.pending_cursors = {}
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+            os.remove(self.journal_path)
+
+    def needs_flush(self):
+        """
+        return: True if there are at least flush_every pending events.
+        """
+        return len(self.pending) >= self.flush_every
+
+    def get_open_positions_by_pair(self, pair_name):
+        """
+        return: List (copy) of the open positions of a pair.
+        """
+        return list(self.open_positions.get(pair_name, ()))
+
+    def has_free_fund_slot(self):
+        return bool(self.free_slots)
+
+    def open_position(self, pair, buy_date, buy_price, buy_index, buy_signal):
+        """
+        Open a position in the lowest free fund slot.
+
+        return: The position as a dictionary ('id' is None until it is flushed).
+        """
+        fund_slot = heapq.heappop(self.free_slots)
+        position = {
+            'id': None, 'simulation_name': self.simulation_name, 'pair': pair,
+            'buy_date': buy_date, 'buy_price': buy_price, 'sell_date': None, 'sell_price': None,
+            'buy_index': buy_index, 'sell_index': None, 'position_duration': None, 'ratio': None,
+            'fund_slot': fund_slot, 'buy_signal': buy_signal, 'sell_signal': None
+        }
+        self.open_positions.setdefault(pair, []).append(position)
+        self.pending_positions[(pair, buy_index)] = position
+        self.record({'event': 'open', 'pair': pair, 'buy_date': buy_date, 'buy_price': buy_price,
+                     'buy_index': buy_index, 'fund_slot': fund_slot, 'buy_signal': buy_signal})
+        return position
+
+    def close_position(self, position, sell_date, sell_price, sell_index, sell_signal):
+        """
+        Close an open position, free its fund slot and compound its capital.
+        Duration, ratio and capital are computed as in Positions.close_position.
+        """
+        buy_date = datetime.strptime(position['buy_date'], '%Y-%m-%d %H:%M:%S')
+        position_duration = (datetime.strptime(sell_date, '%Y-%m-%d %H:%M:%S') - buy_date).days
+        ratio = round(sell_price / position['buy_price'], 3)
+        fund_slot = position['fund_slot']
+        if fund_slot not in self.capital:
+            raise ValueError(f"No fund entry found for simulation '{self.simulation_name}' and fund slot '{fund_slot}'")
+        self.capital[fund_slot] = round(self.capital[fund_slot] * ratio, 3)
+
+        position.update(sell_date=sell_date, sell_price=sell_price, sell_index=sell_index,
+                        sell_signal=sell_signal, position_duration=position_duration, ratio=ratio)
+        self.open_positions[position['pair']].remove(position)
+        heapq.heappush(self.free_slots, fund_slot)
+        self.record({'event': 'close', 'id': position['id'], 'pair': position['pair'], 'buy_index': position['buy_index'],
+                     'sell_date': sell_date, 'sell_price': sell_price, 'sell_index': sell_index,
+                     'sell_signal': sell_signal, 'position_duration': position_duration, 'ratio': ratio,
+                     'fund_slot': fund_slot, 'capital': self.capital[fund_slot]})
+
+    def advance(self, pair, last_date):
+        """
+        Move the cursor of a pair to the last processed candle (flushed with the positions).
+
+        Cursors are not journaled: on replay they are derived from the dates of the events.
+        """
+        self.pending_cursors[pair] = last_date
@@ -0,0 +1,154 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the CandleScheduler class, which decides when each pair
+# of each simulation can have a new candle: at the close of its current
+# candle (from its timeframe) plus a grace delay. The simulator sleeps until
+# the next due pair instead of running every simulation every second.
+# =============================================================================
+
+import asyncio
+import heapq
+import re
+from src.api.cache import get_timeframe
+from src.api.frame import parse_date
+
+TIMEFRAME_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+WEEK_OFFSET = 4 * 86400  # weekly candles open on Monday, the epoch was a Thursday
+DEFAULT_GRACE = 5  # seconds after the close of a candle before requesting it
+DEFAULT_POLL_INTERVAL = 60  # seconds between two runs of the pairs of unknown timeframe
+DEFAULT_RETRY_DELAY = 10  # seconds before requesting a candle that was not available, doubled every time
+CONFIG_CHECK_INTERVAL = 5  # seconds between two checks of configs/simulations.json while idle
+
+def timeframe_seconds(timeframe):
+    """
+    Convert a timeframe ('15m', '4h', '1d', '1w') to seconds.
+
+    return: The duration of a candle, or None for unknown timeframes (e.g., months).
+    """
+    match = re.fullmatch(r'(\d+)([mhdw])', timeframe or '')
+    return int(match.group(1)) * TIMEFRAME_UNITS[match.group(2)] if match else None
+
+def candle_open(epoch, period):
+    """
+    return: The open epoch of the candle of duration period containing epoch.
+    """
+    offset = WEEK_OFFSET if period % TIMEFRAME_UNITS['w'] == 0 else 0
+    return (epoch - offset) // period * period + offset
+
+class CandleScheduler:
+    def __init__(self, grace=DEFAULT_GRACE, poll_interval=DEFAULT_POLL_INTERVAL, retry_delay=DEFAULT_RETRY_DELAY):
+        """
+        Priority queue of the (simulation, pair) to run, by due time (epoch seconds).
+
+        grace: Seconds after the close of a candle before the pair is due.
+        poll_interval: Seconds between two runs of the pairs whose timeframe is unknown.
+        retry_delay: Seconds before running a pair again when its new candle
+                     was not available yet (doubled every time, at most a candle).
+        """
+        self.grace = grace
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.heap = []  # (due time, simulation_name, pair), entries replaced in self.due are skipped
+        self.due = {}  # (simulation_name, pair) -> due time of its entry in the heap
+        self.periods = {}  # (simulation_name, pair) -> seconds per candle, None if unknown
+        self.ends = {}  # simulation_name -> epoch of its end_ts, None if it runs live
+        self.retries = {}  # (simulation_name, pair) -> runs without the expected candle
+        self.wakeup = asyncio.Event()
+
+    def __contains__(self, simulation_name):
+        return simulation_name in self.ends
+
+    def update(self, simulation_name, simulation, now):
+        """
+        Schedule every pair of a simulation now (added or changed).
+
+        simulation: Simulation configuration dictionary, simulation['api']['timeframe']
+                    overrides the timeframe of the pair names.
+        """
+        self.remove(simulation_name)
+        api = simulation['api']
+        end_ts = api.get('end_ts')
+        self.ends[simulation_name] = parse_date(end_ts) if end_ts else None
+        for pair_name in api['pairs_list']:
+            key = (simulation_name, pair_name)
+            self.periods[key] = timeframe_seconds(api.get('timeframe') or get_timeframe(pair_name))
+            self.push(key, now)
+        self.wakeup.set()
+
+    def remove(self, simulation_name):
+        """
+        Unschedule a simulation (its entries left in the heap are skipped).
+        """
+        self.ends.pop(simulation_name, None)
+        for mapping in (self.due, self.periods, self.retries):
+            for key in [key for key in mapping if key[0] == simulation_name]:
+                del mapping[key]
+
+    def push(self, key, when):
+        self.due[key] = when
+        heapq.heappush(self.heap, (when, *key))
+
+    def next_due(self):
+        """
+        return: The due time of the next pair, or None if nothing is scheduled.
+        """
+        while self.heap:
+            when, simulation_name, pair_name = self.heap[0]
+            if self.due.get((simulation_name, pair_name)) == when:
+                return when
+            heapq.heappop(self.heap)  # rescheduled or removed since
+        return None
+
+    def pop_due(self, now):
+        """
+        return: Dictionary mapping each simulation with due pairs to the list of these pairs.
+        """
+        due = {}
+        while True:
+            when = self.next_due()
+            if when is None or when > now:
+                return due
+            _, simulation_name, pair_name = heapq.heappop(self.heap)
+            del self.due[(simulation_name, pair_name)]
+            due.setdefault(simulation_name, []).append(pair_name)
+
+    def reschedule(self, simulation_name, pair_name, last_epoch, now):
+        """
+        Schedule a pair after it ran: at the close of its current candle if the
+        candle is stored, sooner (with a backoff) if it was not available yet.
+
+        last_epoch: Epoch of the last stored candle of the pair, None if nothing is stored.
+        """
+        key = (simulation_name, pair_name)
+        if key not in self.periods or key in self.due:
+            return  # removed, or scheduled again by a configuration change during the run
+        period = self.periods[key]
+        if period is None:
+            self.push(key, now + self.poll_interval)
+            return
+        end = self.ends[simulation_name]
+        expected = candle_open(min(now, end) if end is not None else now, period)
+        if last_epoch is not None and last_epoch >= expected:
+            self.retries.pop(key, None)
+            if end is None or end >= expected + period:
+                self.push(key, expected + period + self.grace)
+            return  # else: every candle up to end_ts is processed
+        retries = self.retries[key] = self.retries.get(key, 0) + 1
+        self.push(key, now + min(self.retry_delay * 2 ** (retries - 1), period))
+
+    async def wait(self, now, timeout):
+        """
+        Sleep until the next pair is due, a simulation is scheduled, or timeout seconds.
+        """
+        when = self.next_due()
+        delay = timeout if when is None else min(timeout, max(0.0, when - now))
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
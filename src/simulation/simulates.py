@@ -1,169 +1,359 @@
-import os
-import importlib
-import aiohttp
-from src.discord.configs import get_simulations_config
+from src.discord.configs import get_simulations_config, simulation_settings
 from src.api.fetch import fetch_ohlcv_from_api
 from loguru import logger
-from src.discord.integ_logs.open_position import send_open_position_embed
-from src.discord.integ_logs.close_position import send_close_position_embed
-from src.discord.integ_logs.fund_slot_summary import send_fund_slot_summary_embed
-from src.discord.integ_logs.central_message import send_or_update_central_summary_embed
 from src.db.tables import initialize_funds
+from src.simulation.indicators import IndicatorsCache
+from src.simulation.strategy_loader import StrategyLoader
+from src.simulation.timeline import Timeline
+from src.api.frame import parse_date, format_date
+from src.simulation.portfolio import Portfolio
+from src.simulation.batch import batch_simulation
+from src.simulation.scheduler import timeframe_seconds
+from src.api.cache import get_timeframe
+from src.internal.timing import stage
+from src.internal.metrics import metrics, current_simulation
+from src.internal.profiling import profiler
 from datetime import datetime, timedelta
 import asyncio
+import functools
+import time
 
-def import_signals_and_indicators(strategies_folder="strategies"):
-    strategies = {}
-    for root, dirs, files in os.walk(strategies_folder):
-        for file_name in files:
-            if file_name.endswith(".py"):
-                file_path = os.path.join(root, file_name)
-                name_without_extension = os.path.splitext(file_name)[0]
-                strategy_name = os.path.relpath(file_path, strategies_folder).replace(os.sep, '_').rsplit('.', 1)[0]
-                try:
-                    spec = importlib.util.spec_from_file_location(name_without_extension, file_path)
-                    module = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(module)
-                    buy_signal_func = getattr(module, 'buy_signal', None)
-                    sell_signal_func = getattr(module, 'sell_signal', None)
-                    indicators_class = getattr(module, 'Indicators', None)
-                    if buy_signal_func and sell_signal_func and indicators_class:
-                        strategies[strategy_name] = {
-                            "buy_signal": buy_signal_func,
-                            "sell_signal": sell_signal_func,
-                            "Indicators": indicators_class
-                        }
-                        logger.debug(f"Imported strategy '{strategy_name}' from {file_path}")
-                except Exception as e:
-                    logger.error(f"Failed to import module '{strategy_name}' from {file_path}: {e}")
-    logger.info(f'Strategies: {strategies}')
-    return strategies
-
-strategies = import_signals_and_indicators()
-
-def extract_all_dates(data):
-    all_dates = set()
-    for pair_data in data:
-        for entry in pair_data['data']:
-            date_str = entry[0]
-            all_dates.add(datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S"))
-    return sorted(all_dates)
+strategies = StrategyLoader()  # imported on first use, again when their file changes
+indicators_cache = IndicatorsCache()
+initialized_funds = set()  # simulations whose funds have been initialized during this run
+portfolios = {}  # in-memory Portfolio of each simulation
+timelines = {}  # Timeline of each simulation, extended with the new candles of each fetch
+
+def reset_simulation(simulation_name):
+    """
+    Forget the in-memory state of a simulation (its configuration changed or
+    it was removed), it is rebuilt from the database on its next run.
+    """
+    portfolios.pop(simulation_name, None)
+    timelines.pop(simulation_name, None)
+    initialized_funds.discard(simulation_name)
 
 def str_to_datetime(date_str):
     return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S") if date_str else None
 
-def preprocess_data(pair_data):
-    return {datetime.strptime(entry[0], "%Y-%m-%d %H:%M:%S"): i for i, entry in enumerate(pair_data['data'])}
+def last_closed_epoch(simulation, pair_name, now):
+    """
+    Get the open epoch of the last candle of a pair that can be closed at now
+    (open + timeframe <= now): the candles after it are still forming, they
+    are processed once QTSBE returns them closed.
 
-def get_index_for_date(preprocessed_data, target_date, pair_name):
-    if isinstance(target_date, datetime):
-        target_date_key = target_date
-    elif isinstance(target_date, datetime.date):
-        target_date_key = datetime.combine(target_date, datetime.min.time())
-    else:
-        logger.error("Invalid target_date type: %s", type(target_date))
-        return None
-    
-    index = preprocessed_data.get(target_date_key, None)
-    
-    if index is None:
-        logger.error(f'No index found for date {target_date_key} ({pair_name})')
-    
-    return index
-
-async def simulates(simulator):
-    async with aiohttp.ClientSession() as session:
-        simulations_config = get_simulations_config()
-        for simulation_name, simulation in simulations_config.items():
-            logger.info(f"Starting simulation: {simulation_name}")
-            
-            # Calculate fund slots and initial capital
-            max_fund_slots = 100 // int(simulation['positions']['position_%_invest'])
-            initial_capital = float(simulation['wallet']['invest_capital'])
-            initial_capital_per_slot = initial_capital / max_fund_slots
-            
-            # Initialize funds
+    return: The epoch, or None if the timeframe of the pair is unknown (no bound).
+    """
+    period = timeframe_seconds(simulation['api'].get('timeframe') or get_timeframe(pair_name))
+    return int(now) - period if period else None
+
+class SimulationRun:
+    def __init__(self, simulation_name, simulation, data, timeline, last_epochs, dates, indicators_by_pair, portfolio, strategy,
+                 closed_epochs):
+        """
+        Everything a simulation engine needs to process the new candles of a simulation.
+
+        simulation_name: The name of the simulation.
+        simulation: Simulation configuration dictionary.
+        data: List of API payloads, in the order of the pairs_list (None for missing pairs).
+        timeline: Timeline of the data.
+        last_epochs: Dictionary mapping each pair to the epoch of its last processed candle (or None).
+        dates: array('q') of the dates with a new candle for at least one pair, in epoch seconds.
+        indicators_by_pair: Dictionary mapping each fetched pair to its indicators.
+        portfolio: Portfolio of the simulation.
+        strategy: The strategy dictionary, in the version the indicators were built with.
+        closed_epochs: Dictionary mapping each pair to the open epoch of its last closed
+                       candle (see last_closed_epoch), None if unbounded.
+        """
+        self.simulation_name = simulation_name
+        self.simulation = simulation
+        self.pairs_list = simulation['api']['pairs_list']
+        self.data = data
+        self.timeline = timeline
+        self.last_epochs = last_epochs
+        self.dates = dates
+        self.indicators_by_pair = indicators_by_pair
+        self.portfolio = portfolio
+        self.strategy_name = simulation['api']['strategy']
+        self.strategy = strategy
+        self.closed_epochs = closed_epochs
+
+    def is_new(self, pair_name, target_epoch):
+        """
+        return: True if the candle of the pair at target_epoch was not processed
+                yet and is closed.
+        """
+        last_epoch = self.last_epochs[pair_name]
+        closed_epoch = self.closed_epochs[pair_name]
+        return (last_epoch is None or target_epoch > last_epoch) and (closed_epoch is None or target_epoch <= closed_epoch)
+
+async def prepare_simulation(simulator, simulation_name, simulation, pairs_to_fetch=None):
+    """
+    Fetch the data of a simulation and work out which candles are new.
+
+    pairs_to_fetch: Pairs requested from QTSBE (see fetch_ohlcv_from_api), all of them by default.
+
+    return: A SimulationRun, or None if there is no new candle to process.
+    """
+    # Calculate fund slots and initial capital
+    settings = simulation_settings(simulation)
+    max_fund_slots = settings.max_fund_slots
+    initial_capital_per_slot = settings.invest_capital / max_fund_slots
+
+    # Initialize funds (once per run, they only change when positions are closed)
+    if simulation_name not in initialized_funds:
+        with stage('db'):
             await initialize_funds(simulator.db_manager, simulation_name, max_fund_slots, initial_capital_per_slot)
+        initialized_funds.add(simulation_name)
+
+    # Fetch OHLCV data
+    with stage('fetch'):
+        data = await fetch_ohlcv_from_api(simulation, pairs_to_fetch)
+    pairs_list = simulation['api']['pairs_list']
+
+    start_date, end_date = settings.start_date, settings.end_date
+
+    with stage('db'):
+        portfolio = portfolios.get(simulation_name)
+        if portfolio is None:
+            snapshot = await load_snapshot(simulator, simulation_name, simulation)
+            portfolio = await simulator.db_manager.write(functools.partial(
+                Portfolio, simulator.positions, simulator.cursors, simulation_name, max_fund_slots, snapshot=snapshot))
+            portfolios[simulation_name] = portfolio
+
+        # Each pair resumes after its cursor (the last candle processed). Pairs
+        # without a cursor resume after the most recent position of the
+        # simulation, and never before start_ts.
+        cursors = await simulator.cursors.aio.get_cursors(simulation_name)
+        most_recent_date = None
+        if any(pair_name not in cursors for pair_name in pairs_list):
+            most_recent_date = str_to_datetime(await simulator.positions.aio.get_most_recent_date(simulation_name))
+
+    last_epochs = {}
+    for pair_name in pairs_list:
+        last_date = str_to_datetime(cursors.get(pair_name)) or most_recent_date
+        if start_date and (last_date is None or last_date < start_date):
+            last_date = start_date - timedelta(seconds=1)
+        last_epochs[pair_name] = parse_date(last_date) if last_date else None
+
+    # Only closed candles are processed: the cursors never move past a candle
+    # that is still forming (it is fetched again, then processed once closed)
+    now = time.time()
+    closed_epochs = {pair_name: last_closed_epoch(simulation, pair_name, now) for pair_name in pairs_list}
+    end_epoch = parse_date(end_date) if end_date else None
+    until = {}  # pair_name -> epoch of its last candle to process (None: no bound)
+    for pair_name, closed_epoch in closed_epochs.items():
+        bounds = [bound for bound in (end_epoch, closed_epoch) if bound is not None]
+        until[pair_name] = min(bounds) if bounds else None
+
+    with stage('index'):
+        timeline = timelines.get(simulation_name)
+        if timeline is None or not timeline.extend(pairs_list, data):
+            timeline = timelines[simulation_name] = Timeline(pairs_list, data)
+        dates = timeline.dates_after(last_epochs, until)  # new for at least one pair
+    if not dates:
+        logger.debug(f"No new candles for simulation: {simulation_name}")
+        return None
+
+    # Build (or reuse) the indicators once per pair for this fetch, with the
+    # current version of the strategy (imported again if its file changed)
+    strategy_name = simulation['api']['strategy']
+    with stage('indicators'):
+        strategy = strategies.get(strategy_name)
+        if profiler.enabled:
+            strategy = profiler.wrap(strategy_name, strategy, pairs_list, data)
+        indicators_by_pair = {
+            pair_name: indicators_cache.get(strategy_name, strategy['Indicators'], pair_name, pair_data['data'], strategy['version'])
+            for pair_name, pair_data in zip(pairs_list, data) if pair_data is not None
+        }
+
+    return SimulationRun(simulation_name, simulation, data, timeline, last_epochs, dates, indicators_by_pair, portfolio, strategy,
+                         closed_epochs)
+
+async def load_snapshot(simulator, simulation_name, simulation):
+    """
+    Read the snapshot of a simulation when it runs for the first time in this
+    process, and put its indicators in the indicators cache (they are only
+    used if the candles still have the same fingerprint).
+
+    return: The state of the snapshot, or None.
+    """
+    if simulator.snapshots is None:
+        return None
+    strategy_name = simulation['api']['strategy']
+    version = strategies.get(strategy_name)['version']
+    snapshot = await asyncio.get_running_loop().run_in_executor(
+        None, simulator.snapshots.load, simulation_name, simulation, version)
+    if snapshot is not None:
+        for pair_name, entry in snapshot['indicators'].items():
+            indicators_cache.entries.setdefault((strategy_name, pair_name), entry)
+    return snapshot
 
-            # Fetch OHLCV data
-            data = await fetch_ohlcv_from_api(simulation)
-            pairs_list = simulation['api']['pairs_list']
-
-            most_recent_date_str = simulator.positions.get_most_recent_date(simulation_name)
-            most_recent_date = str_to_datetime(most_recent_date_str)
-
-            start_ts = simulation['api'].get('start_ts')
-            end_ts = simulation['api'].get('end_ts')
-
-            start_date = str_to_datetime(start_ts) if start_ts else None
-            end_date = str_to_datetime(end_ts) if end_ts else None
-
-            if start_date and (most_recent_date is None or most_recent_date < start_date):
-                most_recent_date = start_date
-                logger.info(f"Adjusted start date to {start_date.strftime('%Y-%m-%d %H:%M:%S')}")
-
-            all_dates = extract_all_dates(data)
-            filtered_dates = [date for date in all_dates if most_recent_date is None or date > most_recent_date - timedelta(days=1)]
-            if end_date:
-                filtered_dates = [date for date in filtered_dates if date <= end_date]
-
-            closed_positions_ids = set()
-            start_time = asyncio.get_event_loop().time()
-
-            for target_date in filtered_dates:
-                await send_or_update_central_summary_embed(simulator, simulation['discord'].get('discord_channel_id'), simulation_name)
-
-                current_time = asyncio.get_event_loop().time()
-                elapsed_time = current_time - start_time
-
-                if elapsed_time >= 10:
-                    await asyncio.sleep(1)
-                    start_time = asyncio.get_event_loop().time()
-
-                if end_date and target_date > end_date:
-                    logger.info(f"Stopping simulation as target date {target_date.strftime('%Y-%m-%d %H:%M:%S')} exceeds end date {end_date.strftime('%Y-%m-%d %H:%M:%S')}")
-                    break
-
-                logger.info(f"Processing date: {target_date.strftime('%Y-%m-%d %H:%M:%S')}")
-
-                for pair_name, pair_data in zip(pairs_list, data):
-                    await asyncio.sleep(0)  # Yield control to the event loop
-                    preprocessed_data = preprocess_data(pair_data)
-                    index = get_index_for_date(preprocessed_data, target_date, pair_name)
-                    if index is None:
-                        continue
-
-                    indicators = strategies[simulation['api']['strategy']]['Indicators'](pair_data['data']).indicators
-
-                    open_positions = simulator.positions.get_open_positions_by_pair(simulation_name, pair_name)
-                    
-                    if open_positions:
-                        for pos in open_positions:
-                            if pos['id'] in closed_positions_ids:
-                                continue
-                            sell_signal, sell_price = strategies[simulation['api']['strategy']]['sell_signal'](pos, pair_data['data'], index, indicators)
-                            if sell_signal > 0:
-                                sell_date = pair_data['data'][index][0]
-                                sell_price = sell_price
-                                sell_index = index
-                                simulator.positions.close_position(
-                                    pos['id'], sell_date, sell_price, sell_index, sell_signal
-                                )
-                                closed_positions_ids.add(pos['id'])
-                                logger.info(f"Closed position {pos['id']} for {pair_name} on {sell_date} at price {sell_price}")
-                                await send_close_position_embed(simulator, simulation['discord']['discord_channel_id'], pos['id'])
-                                await send_fund_slot_summary_embed(simulator, simulation['discord']['discord_channel_id'], pos['id'])
-                    free_fund_slots = simulator.positions.get_free_fund_slots(simulation_name, max_fund_slots)
-                    if free_fund_slots:
-                        buy_signal, buy_price = strategies[simulation['api']['strategy']]['buy_signal'](None, pair_data['data'], index, indicators)
-                        if buy_signal > 0:
-                            fund_slot = free_fund_slots.pop(0)  
-                            buy_date = pair_data['data'][index][0]
-                            buy_price = buy_price
-                            position_id = simulator.positions.create_position(
-                                simulation_name, pair_name, buy_date, buy_price, index, fund_slot, buy_signal
-                            )
-                            logger.info(f"Opened position {position_id} for {pair_name} on {buy_date} at price {buy_price} with fund slot {fund_slot}")
-                            await send_open_position_embed(simulator, simulation['discord']['discord_channel_id'], position_id)
+async def save_snapshot(simulator, simulation_name):
+    """
+    Checkpoint the state of a simulation after its run (see SnapshotStore).
+    """
+    portfolio = portfolios.get(simulation_name)
+    simulation = simulator.snapshots.tracked.get(simulation_name, (None,))[0]
+    if portfolio is None or simulation is None or portfolio.pending or portfolio.pending_cursors:
+        return
+    strategy_name = simulation['api']['strategy']
+    pairs_list = set(simulation['api']['pairs_list'])
+    # Copy the state on the loop (the next run changes it), then pickle and
+    # write it in the executor
+    portfolio_state = portfolio.snapshot()
+    indicators = {pair_name: entry for (name, pair_name), entry in indicators_cache.entries.items()
+                  if name == strategy_name and pair_name in pairs_list}
+    cursors = await simulator.cursors.aio.get_cursors(simulation_name)
+    await asyncio.get_running_loop().run_in_executor(None, simulator.snapshots.save, simulation_name, simulation,
+                                                     portfolio_state, cursors, indicators)
+    simulator.snapshots.mark_saved(simulation_name)
+
+async def save_snapshots(simulator):
+    """
+    Checkpoint every simulation that ran in this process (when the simulator stops).
+    """
+    if simulator.snapshots is None:
+        return
+    for simulation_name in list(simulator.snapshots.tracked):
+        try:
+            await save_snapshot(simulator, simulation_name)
+        except Exception as e:
+            logger.error(f"Failed to write the snapshot of simulation {simulation_name}: {e!r}")
+
+def use_batch_engine(simulation):
+    """
+    Choose the engine of a simulation: the batch engine only if
+    simulation['api']['engine'] is 'batch' (opt-in, it doesn't notify the
+    positions), the step engine otherwise. See select_simulations for the
+    default of the backtests.
+    """
+    return simulation_settings(simulation).engine == 'batch'
+
+async def step_simulation(simulator, run, deadline=None):
+    """
+    Process the new candles of a simulation date by date, notifying every
+    opened and closed position through simulator.notifier.
+
+    deadline: time.monotonic() after which no new date is started (at least
+              one date is processed), None to process every date.
+
+    return: The number of dates processed.
+    """
+    simulation_name = run.simulation_name
+    portfolio = run.portfolio
+    strategy = run.strategy
+    channel_id = run.simulation['discord']['discord_channel_id']
+    processed = 0
+
+    for target_epoch in run.dates:
+        if processed and deadline is not None and time.monotonic() >= deadline:
+            break  # the next work unit resumes from the cursors
+        processed += 1
+        with stage('notify'):
+            await simulator.notifier.central_summary(run.simulation['discord'].get('discord_channel_id'), simulation_name)
+
+        logger.info(f"Processing date: {format_date(target_epoch)}")
+
+        events = []  # (opened/closed, position) of this date, notified once flushed
+        for pair_name, pair_data in zip(run.pairs_list, run.data):
+            await asyncio.sleep(0)  # Yield control to the event loop
+            if pair_data is None:
+                continue  # the pair could not be fetched this time
+            if not run.is_new(pair_name, target_epoch):
+                continue  # already processed by a previous iteration
+            index = run.timeline.get_index(pair_name, target_epoch)
+            if index is None:
+                continue  # no candle of this pair at this date (gap or other timeframe)
+
+            indicators = run.indicators_by_pair[pair_name]
+            candle_date = pair_data['data'].date(index)
+
+            with stage('signals'):
+                for pos in portfolio.get_open_positions_by_pair(pair_name):
+                    sell_signal, sell_price = strategy['sell_signal'](pos, pair_data['data'], index, indicators)
+                    if sell_signal > 0:
+                        portfolio.close_position(pos, candle_date, sell_price, index, sell_signal)
+                        events.append(('closed', pos))
+                if portfolio.has_free_fund_slot():
+                    buy_signal, buy_price = strategy['buy_signal'](None, pair_data['data'], index, indicators)
+                    if buy_signal > 0:
+                        pos = portfolio.open_position(pair_name, candle_date, buy_price, index, buy_signal)
+                        events.append(('opened', pos))
+                portfolio.advance(pair_name, candle_date)
+
+        await simulator.db_manager.write(portfolio.flush)
+
+        with stage('notify'):
+            for kind, pos in events:
+                if kind == 'closed':
+                    logger.info(f"Closed position {pos['id']} for {pos['pair']} on {pos['sell_date']} at price {pos['sell_price']}")
+                    await simulator.notifier.position_closed(channel_id, pos['id'])
+                else:
+                    logger.info(f"Opened position {pos['id']} for {pos['pair']} on {pos['buy_date']} at price {pos['buy_price']} with fund slot {pos['fund_slot']}")
+                    await simulator.notifier.position_opened(channel_id, pos['id'])
+
+    return processed
+
+async def simulate(simulator, simulation_name, simulation, pairs_to_fetch=None, budget=None):
+    """
+    Process the new candles of a single simulation with its engine.
+
+    pairs_to_fetch: Pairs that can have new candles (see CandleScheduler), all of them by default.
+    budget: Seconds of work after which the engine stops between two dates (a
+            work unit, see WorkQueue), None to process every new candle.
+
+    return: Tuple of (dates left to process, seconds between the last processed
+            candle and the newest one).
+    """
+    logger.info(f"Starting simulation: {simulation_name}")
+    token = current_simulation.set(simulation_name)  # label of the metrics of this run
+    started = time.perf_counter()
+    try:
+        run = await prepare_simulation(simulator, simulation_name, simulation, pairs_to_fetch)
+        if run is None:
+            return 0, 0
+        events_before = run.portfolio.events_count
+
+        deadline = time.monotonic() + budget if budget is not None else None
+        if use_batch_engine(simulation):
+            processed = await batch_simulation(simulator, run, deadline)
+            with stage('notify'):
+                await simulator.notifier.central_summary(simulation['discord'].get('discord_channel_id'), simulation_name, catch_up=True)
+        else:
+            processed = await step_simulation(simulator, run, deadline)
+
+        # Every date of the run is new for at least one pair (see prepare_simulation):
+        # each unit moves a cursor forward, and the dates left are new ones only
+        remaining = len(run.dates) - processed
+        lag = run.dates[-1] - run.dates[processed - 1] if remaining else 0
+        if remaining:
+            logger.info(f"Simulation {simulation_name} paused with {remaining} dates left ({lag} seconds behind)")
+
+        metrics.inc('simulator_candles_total', processed, simulation=simulation_name)
+        metrics.observe('simulator_tick_events', run.portfolio.events_count - events_before, simulation=simulation_name)
+
+        if simulator.snapshots is not None:
+            simulator.snapshots.track(simulation_name, simulation, run.strategy['version'])
+            if simulator.snapshots.due(simulation_name):
+                await save_snapshot(simulator, simulation_name)
+        return remaining, lag
+    finally:
+        metrics.observe('simulator_tick_seconds', time.perf_counter() - started, simulation=simulation_name)
+        current_simulation.reset(token)
+
+async def simulates(simulator, simulations_config=None, due_pairs=None):
+    """
+    Process the new candles of every simulation, one after the other.
+
+    simulations_config: Dictionary of the simulations, configs/simulations.json by default.
+    due_pairs: Dictionary mapping simulation names to the pairs to fetch, all of them by default.
+    """
+    if simulations_config is None:
+        simulations_config = get_simulations_config()
+    for simulation_name, simulation in simulations_config.items():
+        await simulate(simulator, simulation_name, simulation, (due_pairs or {}).get(simulation_name))
+    cache_stats = indicators_cache.stats()
+    logger.info(f"Indicators cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
     logger.info("Simulation completed.")
-    logger.info("")
\ No newline at end of file
+    logger.info("")
@@ -0,0 +1,182 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the Simulator class, which holds the database managers
+# and the notifier used by the simulation engines, and runs them when the
+# candles of their pairs close (see src/simulation/scheduler.py), by work
+# units shared fairly between the simulations (see src/simulation/work_queue.py).
+# It also starts the metrics exporter when one is configured, and keeps the
+# snapshots of the simulations for warm restarts.
+# =============================================================================
+
+import asyncio
+import socket
+import time
+from loguru import logger
+from src.db.manager import DatabaseManager
+from src.db.positions import Positions
+from src.db.cursors import Cursors
+from src.discord.configs import simulations_config
+from src.discord.integ_logs.log import log
+from src.discord.notifier import DiscordNotifier
+from src.simulation.simulates import simulate, reset_simulation, save_snapshots
+from src.simulation.snapshots import SnapshotStore, DEFAULT_SNAPSHOT_INTERVAL
+from src.simulation.scheduler import (CandleScheduler, DEFAULT_GRACE, DEFAULT_POLL_INTERVAL,
+                                      DEFAULT_RETRY_DELAY, CONFIG_CHECK_INTERVAL)
+from src.simulation.work_queue import WorkQueue, DEFAULT_UNIT_BUDGET
+from src.api.fetch import close_candle_store, get_candle_store
+from src.internal.metrics import metrics, configure_metrics, MetricsExporter
+
+class Simulator:
+    def __init__(self, discord_bot, bot_config, db_path='simulator.db', notifier=None):
+        """
+        Initialize the simulator.
+
+        discord_bot: The Discord client (None in worker processes and headless runs).
+        bot_config: Content of configs/discord_bot.json.
+        db_path: Path to the SQLite database file.
+        notifier: Where notifications are sent, DiscordNotifier(self) by default.
+        """
+        self.discord_bot = discord_bot
+        self.bot_config = bot_config
+        self.db_path = db_path
+        self.db_manager = DatabaseManager(db_path)
+        self.positions = Positions(self.db_manager)
+        self.cursors = Cursors(self.db_manager)
+        self.notifier = notifier or DiscordNotifier(self)
+        self.pool = None  # SimulationPool when simulations run in worker processes
+        self.snapshots = None  # in-memory databases (sweeps) have nothing to restore
+        if db_path != ':memory:' and str(bot_config.get("snapshots", "True")).lower() == "true":
+            self.snapshots = SnapshotStore(db_path, bot_config.get("snapshots_folder", "snapshots"),
+                                           float(bot_config.get("snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL)))
+        configure_metrics(bot_config)  # worker processes get the same configuration
+        self.metrics_exporter = None  # started with the simulations, in the main process only
+        self.scheduler = CandleScheduler(float(bot_config.get("scheduler_grace", DEFAULT_GRACE)),
+                                         float(bot_config.get("scheduler_poll_interval", DEFAULT_POLL_INTERVAL)),
+                                         float(bot_config.get("scheduler_retry_delay", DEFAULT_RETRY_DELAY)))
+        self.scheduler_task = None
+        self.work = WorkQueue()
+        self.unit_budget = float(bot_config.get("unit_budget", DEFAULT_UNIT_BUDGET))
+        self.unit_tasks = set()
+        metrics.gauge('simulator_lag_seconds', lambda: dict(self.work.lags))
+
+    async def stop(self):
+        """
+        Let the running work units finish, checkpoint the simulations and send
+        the pending notifications, before the event loop closes.
+        """
+        if self.scheduler_task is not None:
+            self.scheduler_task.cancel()
+            await asyncio.gather(self.scheduler_task, return_exceptions=True)
+            self.scheduler_task = None
+        await asyncio.gather(*self.unit_tasks, return_exceptions=True)
+        await save_snapshots(self)
+        if self.pool is not None:
+            await self.pool.stop()
+        await self.notifier.close()
+        if self.metrics_exporter is not None:
+            await self.metrics_exporter.stop()
+            self.metrics_exporter = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        self.db_manager.close()
+        close_candle_store()
+
+    def on_simulation_changed(self, event, simulation_name, simulation):
+        """
+        Reinitialize only the simulations whose configuration changed or that
+        were removed from configs/simulations.json, and schedule the new ones.
+        """
+        if event != 'added':
+            if self.pool is not None:
+                self.pool.reset(simulation_name)
+            else:
+                reset_simulation(simulation_name)
+        if event == 'removed':
+            self.scheduler.remove(simulation_name)
+            self.work.remove(simulation_name)
+        else:
+            self.scheduler.update(simulation_name, simulation, time.time())
+
+    def queue_due_simulations(self):
+        """
+        Queue the simulations whose pairs are due, with these pairs (the only
+        ones fetched by their next work unit).
+        """
+        simulations = simulations_config.get()  # parsed again only when the file changes
+        for simulation_name, simulation in simulations.items():
+            if simulation_name not in self.scheduler:
+                self.scheduler.update(simulation_name, simulation, time.time())
+        for simulation_name, pairs in self.scheduler.pop_due(time.time()).items():
+            if simulation_name in simulations:
+                self.work.push(simulation_name, pairs)
+
+    def is_free(self, simulation_name):
+        """
+        return: True if a work unit of the simulation can start now: one unit at
+                a time per worker, or a single one without workers.
+        """
+        if self.pool is None:
+            return not self.work.running
+        shard = self.pool.get_shard(simulation_name)
+        return all(self.pool.get_shard(name) is not shard for name in self.work.running)
+
+    def start_units(self):
+        while True:
+            job = self.work.pop(self.is_free)
+            if job is None:
+                return
+            task = asyncio.create_task(self.run_unit(*job))
+            self.unit_tasks.add(task)
+            task.add_done_callback(self.unit_tasks.discard)
+
+    async def run_unit(self, simulation_name, pairs):
+        """
+        Run a work unit of a simulation (at most unit_budget seconds of dates),
+        then schedule its fetched pairs again from their last stored candle.
+        """
+        remaining, lag = 0, self.work.lags.get(simulation_name, 0)
+        try:
+            simulation = simulations_config.get().get(simulation_name)
+            if simulation is not None:
+                if self.pool is not None:
+                    remaining, lag = await self.pool.run_unit(simulation_name, simulation, pairs, self.unit_budget)
+                else:
+                    remaining, lag = await simulate(self, simulation_name, simulation, pairs, self.unit_budget)
+        except Exception as e:
+            logger.exception(f"Simulation {simulation_name} failed: {e!r}")
+        finally:
+            store = get_candle_store()
+            last_epochs = await store.run(lambda: [store.read_last_epoch(pair_name) for pair_name in pairs])
+            now = time.time()
+            for pair_name, last_epoch in zip(pairs, last_epochs):
+                self.scheduler.reschedule(simulation_name, pair_name, last_epoch, now)
+            self.work.done(simulation_name, remaining, lag)
+            if simulation_name not in self.scheduler:
+                self.work.remove(simulation_name)  # removed from the configuration during the unit
+            self.scheduler.wakeup.set()
+
+    async def scheduler_loop(self):
+        while True:
+            try:
+                self.queue_due_simulations()
+                self.start_units()
+            except Exception as e:
+                logger.exception(f"Simulation loop failed: {e!r}")
+            await self.scheduler.wait(time.time(), CONFIG_CHECK_INTERVAL)
+
+    async def start_simulation(self):
+        simulations_config.subscribe(self.on_simulation_changed)
+        if self.metrics_exporter is None:  # on_ready runs again after a reconnection
+            self.metrics_exporter = MetricsExporter(self.bot_config)
+            await self.metrics_exporter.start()
+        await log(self, self.bot_config["logs_channel_id"], "🚀 Started", 
+                  f"Simulator has been started on host: {socket.gethostname()}")
+        if self.scheduler_task is None:
+            self.scheduler_task = asyncio.create_task(self.scheduler_loop())
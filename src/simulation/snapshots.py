@@ -0,0 +1,163 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the SnapshotStore class, which checkpoints the runtime
+# state of each simulation (cursors, open positions, capital of the fund
+# slots and indicators with the fingerprint of their candles) to a binary
+# file, so a restarted simulator restores it instead of rebuilding it.
+# =============================================================================
+
+import hashlib
+import json
+import os
+import pickle
+import struct
+import time
+import zlib
+from datetime import datetime
+from loguru import logger
+
+MAGIC = b'SSNP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>4sHI16s12sQ')  # magic, format version, crc32, config hash, strategy version, payload size
+DEFAULT_SNAPSHOT_INTERVAL = 300  # seconds between two snapshots of a simulation
+COMPRESSION_LEVEL = 1  # indicators are mostly floats, higher levels barely shrink them
+
+def config_hash(simulation, db_path):
+    """
+    Hash of a simulation configuration and of its database: a snapshot is
+    only valid for the configuration and the database it was taken with.
+    """
+    content = json.dumps([simulation, os.path.abspath(db_path)], sort_keys=True).encode()
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+def encode_snapshot(state, config_digest, strategy_version):
+    """
+    return: The bytes of a snapshot: header, then the compressed pickle of state.
+    """
+    payload = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), COMPRESSION_LEVEL)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, zlib.crc32(payload), config_digest,
+                         strategy_version.encode().ljust(12)[:12], len(payload))
+    return header + payload
+
+def decode_snapshot(content, config_digest, strategy_version):
+    """
+    Check and decode the bytes of a snapshot.
+
+    return: Tuple of (state, None), or (None, reason) if the snapshot is rejected.
+    """
+    if len(content) < HEADER.size:
+        return None, "truncated header"
+    magic, format_version, crc, digest, version, size = HEADER.unpack_from(content)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        return None, "unknown format"
+    payload = content[HEADER.size:]
+    if len(payload) != size or zlib.crc32(payload) != crc:
+        return None, "corrupted"
+    if digest != config_digest:
+        return None, "configuration changed"
+    if version != strategy_version.encode().ljust(12)[:12]:
+        return None, "strategy changed"
+    return pickle.loads(zlib.decompress(payload)), None
+
+class SnapshotStore:
+    def __init__(self, db_path, folder='snapshots', interval=DEFAULT_SNAPSHOT_INTERVAL):
+        """
+        Initialize the snapshots of the simulations of a database.
+
+        db_path: Database of the simulations (part of the hash of the snapshots).
+        folder: Folder of the snapshot files, one per simulation.
+        interval: Minimum number of seconds between two snapshots of a simulation
+                  (they are also taken when the simulator stops).
+        """
+        self.db_path = db_path
+        self.folder = folder
+        self.interval = interval
+        self.started = time.monotonic()
+        self.saved_at = {}  # simulation_name -> time of its last snapshot
+        self.tracked = {}  # simulation_name -> (simulation, strategy version) of its last run
+
+    def path(self, simulation_name):
+        return os.path.join(self.folder, f"{simulation_name}.snap")
+
+    def load(self, simulation_name, simulation, strategy_version):
+        """
+        Read the snapshot of a simulation.
+
+        return: The state of the snapshot, or None if there is no valid one.
+        """
+        try:
+            with open(self.path(simulation_name), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            state, reason = decode_snapshot(content, config_hash(simulation, self.db_path), strategy_version)
+        except Exception as e:  # unreadable pickle (e.g., a class of the strategy was renamed)
+            state, reason = None, f"unreadable ({e!r})"
+        if state is None:
+            logger.warning(f"Ignoring the snapshot of simulation {simulation_name}: {reason}")
+            return None
+        logger.info(f"Restored the snapshot of simulation {simulation_name} taken on {state['saved_at']}")
+        return state
+
+    def take(self, simulation_name, simulation, portfolio_state, cursors, indicators):
+        """
+        Serialize the state of a simulation.
+
+        portfolio_state: Copy of the state of the flushed portfolio (see Portfolio.snapshot).
+        cursors: Cursors of the simulation (pair -> date of its last processed candle).
+        indicators: Dictionary mapping each pair to its indicators cache entry
+                    (fingerprint of the candles and of the strategy version, indicators).
+
+        return: The bytes of the snapshot.
+        """
+        state = dict(portfolio_state, simulation_name=simulation_name, cursors=dict(cursors),
+                     saved_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), indicators=indicators)
+        config_digest = config_hash(simulation, self.db_path)
+        strategy_version = self.tracked[simulation_name][1]
+        try:
+            return encode_snapshot(state, config_digest, strategy_version)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.debug(f"Indicators of simulation {simulation_name} can't be pickled ({e!r}), snapshot without them")
+            return encode_snapshot(dict(state, indicators={}), config_digest, strategy_version)
+
+    def save(self, simulation_name, simulation, portfolio_state, cursors, indicators):
+        """
+        Serialize and write the snapshot of a simulation (see take), in an
+        executor: the state is copied beforehand, on the thread running the simulation.
+        """
+        self.write(simulation_name, self.take(simulation_name, simulation, portfolio_state, cursors, indicators))
+
+    def write(self, simulation_name, content):
+        """
+        Write the bytes of a snapshot, atomically.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(simulation_name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        logger.debug(f"Snapshot of simulation {simulation_name} written ({len(content)} bytes)")
+
+    def track(self, simulation_name, simulation, strategy_version):
+        """
+        Record the configuration and the strategy version of the last run of a simulation.
+        """
+        self.tracked[simulation_name] = (simulation, strategy_version)
+
+    def due(self, simulation_name):
+        """
+        return: True if the last snapshot of the simulation is older than the interval.
+        """
+        return time.monotonic() - self.saved_at.get(simulation_name, self.started) >= self.interval
+
+    def mark_saved(self, simulation_name):
+        self.saved_at[simulation_name] = time.monotonic()
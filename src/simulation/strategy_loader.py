@@ -0,0 +1,127 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the StrategyLoader class, which imports the strategies of
+# the strategies folder on first use (only the ones the simulations run) and
+# imports them again when their file changes, without restarting the bot.
+# =============================================================================
+
+import hashlib
+import importlib.util
+import os
+import time
+from loguru import logger
+
+class StrategyLoader:
+    def __init__(self, strategies_folder="strategies"):
+        """
+        Initialize the loader, nothing is imported until a strategy is used.
+
+        strategies_folder: Folder of the strategy files (subfolders included,
+                           'sub/name.py' is the strategy 'sub_name').
+        """
+        self.strategies_folder = strategies_folder
+        self.paths = None  # strategy name -> file path, scanned on first use
+        self.loaded = {}  # strategy name -> strategy dictionary
+        self.stats = {}  # strategy name -> (mtime, size) of the file it was imported from
+
+    def scan(self):
+        """
+        List the strategy files (without importing them).
+        """
+        self.paths = {}
+        for root, dirs, files in os.walk(self.strategies_folder):
+            for file_name in files:
+                if file_name.endswith(".py"):
+                    file_path = os.path.join(root, file_name)
+                    strategy_name = os.path.relpath(file_path, self.strategies_folder).replace(os.sep, '_').rsplit('.', 1)[0]
+                    self.paths[strategy_name] = file_path
+        return self.paths
+
+    def available(self):
+        """
+        return: Sorted names of the strategy files of the folder.
+        """
+        return sorted(self.scan())
+
+    def import_strategy(self, strategy_name, file_path):
+        """
+        Import a strategy file.
+
+        return: The strategy dictionary, or None if the file isn't a valid strategy.
+        """
+        started = time.perf_counter()
+        with open(file_path, 'rb') as f:
+            version = hashlib.sha1(f.read()).hexdigest()[:12]
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(file_path))[0], file_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        buy_signal_func = getattr(module, 'buy_signal', None)
+        sell_signal_func = getattr(module, 'sell_signal', None)
+        indicators_class = getattr(module, 'Indicators', None)
+        if not (buy_signal_func and sell_signal_func and indicators_class):
+            logger.error(f"Strategy '{strategy_name}' ({file_path}) needs buy_signal, sell_signal and Indicators")
+            return None
+        logger.info(f"Imported strategy '{strategy_name}' from {file_path} in {1000 * (time.perf_counter() - started):.1f} ms")
+        return {
+            "buy_signal": buy_signal_func,
+            "sell_signal": sell_signal_func,
+            "Indicators": indicators_class,
+            # optional vectorized interface, used by the batch engine
+            "buy_signals": getattr(module, 'buy_signals', None),
+            "sell_signals": getattr(module, 'sell_signals', None),
+            # hash of the file, part of the indicators cache entries
+            "version": version
+        }
+
+    def load(self, strategy_name, file_path, stat):
+        """
+        Import a strategy, keeping the previous version if the import fails.
+        """
+        self.stats[strategy_name] = (stat.st_mtime_ns, stat.st_size)  # not retried until the file changes again
+        try:
+            strategy = self.import_strategy(strategy_name, file_path)
+        except Exception as e:
+            logger.error(f"Failed to import strategy '{strategy_name}' from {file_path}: {e}")
+            return None
+        if strategy is not None:
+            self.loaded[strategy_name] = strategy
+        return strategy
+
+    def get(self, strategy_name):
+        """
+        Get a strategy, importing it on first use and again if its file has
+        changed since (a failed import keeps the previous version).
+
+        return: The strategy dictionary.
+        """
+        if self.paths is None or strategy_name not in self.paths:
+            self.scan()  # new strategy files are picked up without a restart
+        file_path = self.paths.get(strategy_name)
+        if file_path is None:
+            raise KeyError(f"Unknown strategy: {strategy_name}")
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None  # removed while the simulations run, keep the version in memory
+        if stat is not None and self.stats.get(strategy_name) != (stat.st_mtime_ns, stat.st_size):
+            if strategy_name in self.loaded:
+                logger.info(f"Strategy '{strategy_name}' changed, importing it again")
+            self.load(strategy_name, file_path, stat)
+        if strategy_name not in self.loaded:
+            raise KeyError(f"Strategy '{strategy_name}' could not be imported")
+        return self.loaded[strategy_name]
+
+    def __getitem__(self, strategy_name):
+        """
+        Get a strategy without checking its file (the version of this iteration).
+        """
+        strategy = self.loaded.get(strategy_name)
+        return strategy if strategy is not None else self.get(strategy_name)
+
+    def __contains__(self, strategy_name):
+        return strategy_name in self.loaded or strategy_name in self.scan()
@@ -0,0 +1,253 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the sweep runner: it expands a grid (or a random sample
+# of a grid) of values of simulation config fields into variants of a
+# simulation, and backtests them in worker processes. The candles are
+# fetched once and the indicators built once, then shared with every worker
+# by its initializer. Results are stored by hash of the variant, so an
+# interrupted sweep resumes where it stopped.
+# =============================================================================
+
+import asyncio
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from loguru import logger
+from src.simulation.backtest import get_results, format_table
+
+def set_field(config, path, value):
+    """
+    Set a field of a config from its dotted path (e.g., 'positions.position_%_invest').
+    """
+    *parents, key = path.split('.')
+    for parent in parents:
+        config = config.setdefault(parent, {})
+    config[key] = value
+
+def variant_hash(base, params):
+    """
+    Hash of a variant: its parameters and the config it is built from.
+    """
+    content = json.dumps({'base': base, 'params': params}, sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+def expand_grid(base, grid, samples=None, seed=0):
+    """
+    Expand a grid of parameters into variants of a simulation config.
+
+    base: Simulation config the variants are built from.
+    grid: Dictionary mapping dotted field paths to lists of values.
+    samples: Number of variants drawn at random from the grid (random
+             search), every combination by default.
+    seed: Seed of the random search.
+
+    return: List of (hash, params, config) tuples.
+    """
+    paths = list(grid)
+    values = [list(grid[path]) for path in paths]
+    total = 1
+    for choices in values:
+        total *= len(choices)
+    if samples is None or samples >= total:
+        combinations = itertools.product(*values)
+    else:
+        # decode sampled indexes of the product, without building it
+        combinations = []
+        for index in random.Random(seed).sample(range(total), samples):
+            combination = []
+            for choices in reversed(values):
+                index, position = divmod(index, len(choices))
+                combination.append(choices[position])
+            combinations.append(tuple(reversed(combination)))
+
+    variants = []
+    for combination in combinations:
+        params = dict(zip(paths, combination))
+        config = copy.deepcopy(base)
+        for path, value in params.items():
+            set_field(config, path, value)
+        variants.append((variant_hash(base, params), params, config))
+    return variants
+
+class SweepResults:
+    def __init__(self, db_path='sweep.db'):
+        """
+        Initialize the results table of the sweeps.
+
+        db_path: Path to the SQLite results file.
+        """
+        self.db_connection = sqlite3.connect(db_path)
+        self.db_cursor = self.db_connection.cursor()
+        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS sweep_results (
+                                  params_hash TEXT PRIMARY KEY,
+                                  params TEXT,
+                                  trades INTEGER,
+                                  open INTEGER,
+                                  win_rate REAL,
+                                  invested REAL,
+                                  capital REAL,
+                                  total_return REAL,
+                                  seconds REAL) WITHOUT ROWID''')
+        self.db_connection.commit()
+
+    def close(self):
+        self.db_connection.close()
+
+    def get_done(self):
+        """
+        return: Set of the hashes of the variants already run.
+        """
+        self.db_cursor.execute("SELECT params_hash FROM sweep_results")
+        return {row[0] for row in self.db_cursor.fetchall()}
+
+    def add(self, params_hash, params, result):
+        self.db_cursor.execute(
+            "INSERT OR REPLACE INTO sweep_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (params_hash, json.dumps(params, sort_keys=True), result['trades'], result['open'], result['win_rate'],
+             result['invested'], result['capital'], result['return'], result['seconds']))
+        self.db_connection.commit()
+
+    def get_results(self, hashes):
+        """
+        return: List of the results of the given variants, best return first.
+        """
+        hashes = list(hashes)
+        self.db_cursor.execute(
+            f"SELECT * FROM sweep_results WHERE params_hash IN ({', '.join('?' * len(hashes))}) ORDER BY total_return DESC",
+            hashes)
+        columns = [column[0] for column in self.db_cursor.description]
+        return [dict(zip(columns, row), params=json.loads(row[1])) for row in self.db_cursor.fetchall()]
+
+def init_sweep_worker(pairs, indicators_entries, log_level):
+    """
+    Initialize a worker process with the shared market data: the stored
+    candles of every pair and the indicators built by the main process.
+    """
+    import sys
+    logger.remove()
+    logger.add(sys.stderr, level=log_level)
+    from src.api.fetch import get_candle_store
+    from src.simulation.simulates import indicators_cache
+    store = get_candle_store()
+    for pair in pairs:
+        store.get_rows(pair)  # loaded once, read by every variant
+    indicators_cache.entries.update(indicators_entries)
+
+def run_variant(simulation_name, simulation):
+    """
+    Backtest a variant in the worker process, on an in-memory database.
+
+    return: Results of the variant (see backtest.get_results).
+    """
+    from src.simulation.simulator import Simulator
+    from src.simulation import simulates
+    from src.discord.notifier import NullNotifier
+    started = time.perf_counter()
+    simulator = Simulator(None, {}, ':memory:', notifier=NullNotifier())
+    try:
+        asyncio.run(simulates.simulate(simulator, simulation_name, simulation))
+        result = get_results(simulator, {simulation_name: simulation})[0]
+    finally:
+        simulator.db_manager.close()  # the candle store stays open for the next variants
+        simulates.reset_simulation(simulation_name)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+async def load_market_data(simulation, strategy_names, offline=False):
+    """
+    Fetch (or read from the candle store) the candles of every pair of the
+    sweep once, and build the indicators of every strategy once.
+
+    simulation: Simulation config with the pairs of every variant.
+    strategy_names: Strategies of the variants.
+    offline: Only use the stored candles.
+
+    return: Dictionary of the entries of the indicators cache to share.
+    """
+    from src.api.fetch import fetch_ohlcv_from_api, close_session
+    from src.simulation.simulates import strategies, indicators_cache
+    try:
+        data = await fetch_ohlcv_from_api(dict(simulation, api=dict(simulation['api'], offline=str(offline))))
+    finally:
+        await close_session()
+    for strategy_name in strategy_names:
+        strategy = strategies.get(strategy_name)
+        for pair_name, pair_data in zip(simulation['api']['pairs_list'], data):
+            if pair_data is not None:
+                indicators_cache.get(strategy_name, strategy['Indicators'], pair_name, pair_data['data'], strategy['version'])
+    return dict(indicators_cache.entries)
+
+def run_sweep(base, grid, results_path='sweep.db', workers=1, samples=None, seed=0,
+              engine='batch', offline=False, log_level="WARNING"):
+    """
+    Run the variants of a sweep that are not in the results yet.
+
+    base: Simulation config the variants are built from.
+    grid: Dictionary mapping dotted field paths to lists of values.
+    results_path: Path to the SQLite results file.
+    workers: Number of worker processes.
+    samples, seed: Random search, see expand_grid.
+    engine: Engine of the variants.
+    offline: Only use the stored candles.
+
+    return: List of the results of every variant of the sweep, best return first.
+    """
+    from src.api.fetch import close_candle_store
+    base = copy.deepcopy(base)
+    base['api']['engine'] = engine
+    base['api']['offline'] = "True"  # variants read the candles loaded by their worker
+    variants = expand_grid(base, grid, samples, seed)
+    results = SweepResults(results_path)
+    try:
+        done = results.get_done()
+        pending = [variant for variant in variants if variant[0] not in done]
+        logger.info(f"Sweep: {len(variants)} variants, {len(variants) - len(pending)} already done")
+        if pending:
+            pairs = sorted({pair for _, _, config in pending for pair in config['api']['pairs_list']})
+            strategy_names = sorted({config['api']['strategy'] for _, _, config in pending})
+            market = dict(base, api=dict(base['api'], pairs_list=pairs))
+            indicators_entries = asyncio.run(load_market_data(market, strategy_names, offline))
+            close_candle_store()  # opened again by the workers
+
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context, initializer=init_sweep_worker,
+                                     initargs=(pairs, indicators_entries, log_level)) as executor:
+                futures = {executor.submit(run_variant, f"sweep_{params_hash}", config): (params_hash, params)
+                           for params_hash, params, config in pending}
+                for future in as_completed(futures):
+                    params_hash, params = futures[future]
+                    try:
+                        results.add(params_hash, params, future.result())
+                    except Exception as e:
+                        logger.error(f"Variant {params_hash} {params} failed: {e!r}")
+        return results.get_results(params_hash for params_hash, _, _ in variants)
+    finally:
+        results.close()
+
+def format_sweep_results(results, top=None):
+    """
+    Format the results of a sweep as a text table, best return first.
+    """
+    paths = sorted({path for result in results for path in result['params']})
+    header = ("Hash", *paths, "Trades", "Win rate", "Capital", "Return", "Seconds")
+    rows = [(
+        result['params_hash'],
+        *(str(result['params'].get(path, '')) for path in paths),
+        str(result['trades']),
+        f"{100 * result['win_rate']:.1f}%" if result['win_rate'] is not None else "-",
+        f"{result['capital']:.2f}",
+        f"{100 * result['total_return']:+.2f}%" if result['total_return'] is not None else "-",
+        f"{result['seconds']:.2f}",
+    ) for result in results[:top]]
+    return format_table(header, rows)
@@ -0,0 +1,105 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the Timeline class, which indexes the candle dates of
+# every pair of a fetched dataset (the epoch arrays of their OHLCVFrame), so
+# the simulation loop never has to parse date strings.
+# =============================================================================
+
+from array import array
+from bisect import bisect_left
+
+class Timeline:
+    def __init__(self, pairs_list, data):
+        """
+        Build the timeline of a fetched dataset.
+
+        pairs_list: List of pair names, in the same order as data.
+        data: List of API payloads (dicts with an OHLCVFrame in 'data'), None for missing pairs.
+        """
+        self.pairs = {
+            pair_name: pair_data['data'].epochs
+            for pair_name, pair_data in zip(pairs_list, data) if pair_data is not None
+        }
+
+    def extend(self, pairs_list, data):
+        """
+        Update the timeline with a new fetch of the same pairs, checking only the
+        candles already indexed (the candles of a pair are only appended, or
+        replaced from the last one when it was still forming).
+
+        pairs_list: List of pair names, in the same order as data.
+        data: List of API payloads, None for missing pairs.
+
+        return: True if the timeline was updated, False if data isn't an extension
+                of it (a pair is missing, or its first candles changed): build a new one.
+        """
+        pairs = {
+            pair_name: pair_data['data'].epochs
+            for pair_name, pair_data in zip(pairs_list, data) if pair_data is not None
+        }
+        if pairs.keys() != self.pairs.keys():
+            return False
+        for pair_name, epochs in pairs.items():
+            indexed = self.pairs[pair_name]
+            if epochs is indexed:
+                continue  # nothing fetched for this pair
+            count = len(indexed)
+            if len(epochs) < count or (count and (epochs[0] != indexed[0] or epochs[count - 1] != indexed[count - 1])):
+                return False
+        self.pairs = pairs
+        return True
+
+    def get_index(self, pair_name, epoch):
+        """
+        Get the index of the candle of a pair at the given epoch.
+
+        pair_name: The trading pair.
+        epoch: The date in epoch seconds.
+
+        return: The index of the candle in the pair data, or None.
+        """
+        epochs = self.pairs.get(pair_name)
+        if not epochs:
+            return None
+        i = bisect_left(epochs, epoch)
+        if i < len(epochs) and epochs[i] == epoch:
+            return i
+        return None
+
+    def pair_dates_after(self, pair_name, epoch=None, until=None):
+        """
+        Get the dates of the candles of a pair strictly after epoch and up to until (inclusive).
+
+        pair_name: The trading pair.
+        epoch: Lower bound in epoch seconds (exclusive), None for no bound.
+        until: Upper bound in epoch seconds (inclusive), None for no bound.
+
+        return: array('q') slice of the epochs of the pair (empty if the pair is missing).
+        """
+        epochs = self.pairs.get(pair_name, array('q'))
+        lo = 0 if epoch is None else bisect_left(epochs, epoch + 1)
+        hi = len(epochs) if until is None else bisect_left(epochs, until + 1)
+        return epochs[lo:hi]
+
+    def dates_after(self, epochs, until):
+        """
+        Get the dates that are new for at least one pair: the union of the dates
+        of each pair after its own cursor, so a pair whose candles stop early
+        (or of a longer timeframe) doesn't bring back the dates of the others.
+
+        epochs: Dictionary mapping each pair to its lower bound in epoch seconds
+                (exclusive, None for no bound).
+        until: Dictionary mapping each pair to its upper bound in epoch seconds
+               (inclusive, None for no bound).
+
+        return: array('q') of the dates, sorted.
+        """
+        merged = set()
+        for pair_name, epoch in epochs.items():
+            merged.update(self.pair_dates_after(pair_name, epoch, until[pair_name]))
+        return array('q', sorted(merged))
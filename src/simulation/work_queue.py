@@ -0,0 +1,95 @@
+# =============================================================================
+# Smartswap Simulator
+# =============================================================================
+# Repository: https://github.com/smartswap-org/simulator
+# Author of this code: Simon
+# =============================================================================
+# Description of this file:
+# This file contains the WorkQueue class, which shares the simulator between
+# the simulations: each one runs by bounded work units (a time budget of
+# dates), the simulations that are caught up go before the ones catching up
+# (backfills), and each class is served round-robin. It also keeps the lag
+# of every simulation.
+# =============================================================================
+
+from collections import deque
+
+DEFAULT_UNIT_BUDGET = 1.0  # seconds of work of a simulation before the next one gets its turn
+
+class WorkQueue:
+    def __init__(self):
+        """
+        Queue of the simulations with work to do.
+
+        A simulation is live when its last work unit processed every new
+        candle, and a backfill while it has dates left (unknown simulations
+        are live, their first unit tells).
+        """
+        self.live = deque()
+        self.backfills = deque()
+        self.queued = set()
+        self.running = set()
+        self.pairs = {}  # simulation_name -> pairs to fetch in its next unit
+        self.remaining = {}  # simulation_name -> dates left after its last unit
+        self.lags = {}  # simulation_name -> seconds between its last processed candle and the newest one
+
+    def push(self, simulation_name, pairs):
+        """
+        Queue a simulation whose pairs have new candles (merged with the pairs
+        of its next unit if it is already queued or running).
+        """
+        self.pairs.setdefault(simulation_name, set()).update(pairs)
+        if simulation_name not in self.queued and simulation_name not in self.running:
+            self.enqueue(simulation_name)
+
+    def enqueue(self, simulation_name):
+        self.queued.add(simulation_name)
+        if self.remaining.get(simulation_name, 0):
+            self.backfills.append(simulation_name)
+        else:
+            self.live.append(simulation_name)
+
+    def pop(self, is_free=lambda simulation_name: True):
+        """
+        Take the next simulation to run: the first live one, else the first
+        backfill, skipping the ones is_free(simulation_name) refuses (e.g.,
+        their worker is busy).
+
+        return: Tuple of (simulation_name, pairs to fetch), or None.
+        """
+        for queue in (self.live, self.backfills):
+            for simulation_name in queue:
+                if is_free(simulation_name):
+                    queue.remove(simulation_name)
+                    self.queued.discard(simulation_name)
+                    self.running.add(simulation_name)
+                    return simulation_name, sorted(self.pairs.pop(simulation_name, ()))
+        return None
+
+    def done(self, simulation_name, remaining, lag):
+        """
+        Record the progress of a work unit, and queue the simulation again
+        (behind the others of its class) if it has dates left.
+
+        remaining: Dates left to process.
+        lag: Seconds between the last processed candle and the newest one.
+        """
+        self.running.discard(simulation_name)
+        self.remaining[simulation_name] = remaining
+        self.lags[simulation_name] = lag
+        if (remaining or self.pairs.get(simulation_name)) and simulation_name not in self.queued:
+            self.enqueue(simulation_name)
+
+    def remove(self, simulation_name):
+        """
+        Forget a simulation removed from the configuration (a running unit finishes).
+        """
+        for queue in (self.live, self.backfills):
+            if simulation_name in queue:
+                queue.remove(simulation_name)
+        self.queued.discard(simulation_name)
+        for mapping in (self.pairs, self.remaining, self.lags):
+            mapping.pop(simulation_name, None)
+
+    def has_work(self):
+        return bool(self.queued)